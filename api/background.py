@@ -0,0 +1,75 @@
+# api/background.py
+"""
+Fire-and-forget file writes off the event loop.
+
+Trace export, profile dumps and traffic capture all end with a blocking
+open/write, and they run when a request finishes, i.e. on the loop. A
+`BackgroundWriter` hands those calls to one daemon thread that runs them in
+order; the request only pays for a queue put. Like the metrics path, a write
+never fails a request: errors are counted and logged, not raised.
+"""
+import logging
+import queue
+import threading
+from typing import Any, Callable, Optional
+
+log = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class BackgroundWriter:
+    def __init__(self, name: str, max_queued: int = 10000) -> None:
+        self.name = name
+        self.written = 0
+        self.dropped = 0
+        self.failures = 0
+        self._q: "queue.Queue" = queue.Queue(maxsize=max_queued)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, fn: Callable[..., Any], *args: Any) -> None:
+        """Queues fn(*args) for the writer thread; dropped (and counted) when the queue is full."""
+        self._start()
+        try:
+            self._q.put_nowait((fn, args))
+        except queue.Full:
+            self.dropped += 1   # a stuck disk must not back up into the requests
+
+    def flush(self) -> None:
+        """Blocks until everything queued so far has been written (tests, shutdown)."""
+        if self._thread is not None:
+            self._q.join()
+
+    def close(self, timeout: float = 5.0) -> None:
+        thread = self._thread
+        if thread is None:
+            return
+        self._q.put(_STOP)
+        thread.join(timeout)
+        self._thread = None
+
+    def _start(self) -> None:
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                    self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            item = self._q.get()
+            try:
+                if item is _STOP:
+                    return
+                fn, args = item
+                fn(*args)
+                self.written += 1
+            except Exception:
+                self.failures += 1
+                log.exception("%s: background write failed", self.name)
+            finally:
+                self._q.task_done()
+
+    def stats(self) -> dict:
+        return {"written": self.written, "queued": self._q.qsize(), "dropped": self.dropped, "failures": self.failures}
@@ -0,0 +1,222 @@
+# api/cache.py
+"""
+Response cache for opening turns.
+
+Most traffic opens with one of a few hundred topics ("The Earth is flat"...),
+and an opening turn only depends on (provider, model, topic, stance) because
+history is empty. Caching that reply answers repeated openings in
+milliseconds without spending provider quota.
+
+Two backends share the same LRU + TTL + byte-budget policy:
+- MemoryCacheBackend: per-process OrderedDict.
+- SQLiteCacheBackend: a local SQLite file, shared by workers on one host and
+  kept across restarts.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_topic(topic: str) -> str:
+    """'  The Earth is FLAT ' and 'the earth is flat' share a cache entry.
+
+    Only case and whitespace are folded: punctuation can carry the topic
+    ("C++" vs "C", "U.S." vs "US"), so it is kept."""
+    return _SPACES.sub(" ", (topic or "").casefold()).strip()
+
+
+def history_fingerprint(history: List[Dict[str, str]]) -> str:
+    if not history:
+        return ""
+    raw = json.dumps([(m["role"], m["message"]) for m in history], ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def cache_key(provider: str, model: str, topic: str, stance: str, history: List[Dict[str, str]]) -> str:
+    parts = (provider, model or "", normalize_topic(topic), stance, history_fingerprint(history))
+    return hashlib.sha1("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class MemoryCacheBackend:
+    def __init__(self, max_bytes: int = 16 << 20, ttl: float = 86400.0, clock: Callable[[], float] = time.monotonic) -> None:
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.bytes = 0
+        self.evictions = 0
+        self._data: "OrderedDict[str, Tuple[str, float, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires, size = item
+            if expires <= self.clock():
+                del self._data[key]
+                self.bytes -= size
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: str) -> None:
+        size = len(key) + len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= old[2]
+            self._data[key] = (value, self.clock() + self.ttl, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, _, evicted) = self._data.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteCacheBackend:
+    # Reads and writes hit the disk: async callers run them in a worker thread
+    blocking = True
+
+    def __init__(self, path: str = "./response_cache.db", max_bytes: int = 64 << 20, ttl: float = 86400.0, clock: Callable[[], float] = time.time) -> None:
+        # Wall clock here: entries survive restarts, monotonic time does not.
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+            " expires_at REAL NOT NULL, used_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_response_cache_used ON response_cache (used_at)")
+        self.bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM response_cache").fetchone()[0]
+
+    def get(self, key: str) -> Optional[str]:
+        now = self.clock()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at, size FROM response_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                self.bytes -= row[2]
+                return None
+            self._conn.execute("UPDATE response_cache SET used_at = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        size = len(key) + len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = self.clock()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM response_cache WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT INTO response_cache (key, value, size, expires_at, used_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, size = excluded.size, "
+                "expires_at = excluded.expires_at, used_at = excluded.used_at",
+                (key, value, size, now + self.ttl, now),
+            )
+            self.bytes += size - (old[0] if old else 0)
+            if self.bytes > self.max_bytes:
+                self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        self._conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (now,))
+        rows = self._conn.execute("SELECT key, size FROM response_cache ORDER BY used_at").fetchall()
+        total = sum(size for _, size in rows)
+        victims = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            victims.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM response_cache WHERE key = ?", victims)
+        self.evictions += len(victims)
+        self.bytes = total
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+
+
+class ResponseCache:
+    """Backend-agnostic front with hit/miss counters."""
+
+    def __init__(self, backend) -> None:
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        # get() runs on the loop and in worker threads (sync endpoints)
+        self._lock = threading.Lock()
+
+    def _count(self, value: Optional[str]) -> Optional[str]:
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def get(self, key: str) -> Optional[str]:
+        return self._count(self.backend.get(key))
+
+    def put(self, key: str, value: str) -> None:
+        self.backend.put(key, value)
+
+    async def aget(self, key: str) -> Optional[str]:
+        if getattr(self.backend, "blocking", False):
+            return self._count(await asyncio.to_thread(self.backend.get, key))
+        return self.get(key)
+
+    async def aput(self, key: str, value: str) -> None:
+        if getattr(self.backend, "blocking", False):
+            await asyncio.to_thread(self.backend.put, key, value)
+        else:
+            self.put(key, value)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": len(self.backend),
+            "bytes": self.backend.bytes,
+            "max_bytes": self.backend.max_bytes,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / total, 3) if total else 0.0,
+            "evictions": self.backend.evictions,
+        }
+
+
+def from_env() -> Optional[ResponseCache]:
+    """RESPONSE_CACHE=off|memory|sqlite, RESPONSE_CACHE_TTL_S, RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_PATH."""
+    kind = os.getenv("RESPONSE_CACHE", "off").lower()
+    ttl = float(os.getenv("RESPONSE_CACHE_TTL_S", "86400"))
+    max_bytes = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(16 << 20)))
+    if kind == "memory":
+        return ResponseCache(MemoryCacheBackend(max_bytes=max_bytes, ttl=ttl))
+    if kind == "sqlite":
+        path = os.getenv("RESPONSE_CACHE_PATH", "./response_cache.db")
+        return ResponseCache(SQLiteCacheBackend(path, max_bytes=max_bytes, ttl=ttl))
+    return None
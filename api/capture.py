@@ -0,0 +1,121 @@
+# api/capture.py
+"""
+Opt-in traffic capture for replay (bench/replay.py): CAPTURE_PATH=traffic.jsonl.
+
+One JSON line per POST /conversation[/stream], written when the response
+ends. Only the shape of the traffic is kept, never its content:
+
+  t            seconds since capture start (arrival time)
+  endpoint     "/conversation" or "/conversation/stream"
+  conv         conversation token: salted hash of the id, stable within one
+               capture (follow-up turns link to their opening), useless outside it
+  new          true when the request opened the conversation
+  provider     X-LLM-Provider header, stance  X-Stance header, timeout  X-Request-Timeout
+  chars, words size of the user message
+  req_bytes    request body size
+  status       HTTP status, ttfb_ms / latency_ms  first byte / last byte
+  stream_error true when a stream sent an "error" event after its 200
+  resp_bytes   response body size
+
+Pure ASGI so streaming responses pass through untouched. The file is opened
+and written by a background thread (`writer`), never on the event loop.
+"""
+import hashlib
+import json
+import os
+import re
+import time
+from typing import Dict, Optional
+
+from api.background import BackgroundWriter
+
+CAPTURE_PATH = os.getenv("CAPTURE_PATH", "")
+PATHS = ("/conversation", "/conversation/stream")
+_HEADERS = {b"x-llm-provider": "provider", b"x-stance": "stance", b"x-request-timeout": "timeout"}
+_CID = re.compile(rb'"conversation_id"\s*:\s*"([^"]+)"')
+
+writer = BackgroundWriter("capture")
+
+
+class CaptureMiddleware:
+    def __init__(self, app, path: str = CAPTURE_PATH) -> None:
+        self.app = app
+        self.path = path
+        # Per-process salt: tokens match within a capture file, not across them
+        self._salt = os.urandom(16)
+        self._t0 = time.monotonic()
+        self._file = None   # opened by the writer thread on the first record
+
+    def _token(self, cid: str) -> str:
+        return hashlib.blake2s(cid.encode(), key=self._salt, digest_size=8).hexdigest()
+
+    async def __call__(self, scope, receive, send):
+        if not self.path or scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in PATHS:
+            return await self.app(scope, receive, send)
+
+        start = time.monotonic()
+        rec: Dict[str, object] = {"t": round(start - self._t0, 4), "endpoint": scope["path"]}
+        for name, value in scope["headers"]:
+            key = _HEADERS.get(name)
+            if key:
+                rec[key] = value.decode("latin-1")[:32]
+        body = []
+        resp = {"bytes": 0, "cid": None, "ttfb": None, "status": 500, "error": False}
+
+        async def recv():
+            message = await receive()
+            if message["type"] == "http.request":
+                body.append(message.get("body", b""))
+            return message
+
+        async def snd(message):
+            if message["type"] == "http.response.start":
+                resp["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                chunk = message.get("body", b"")
+                if resp["ttfb"] is None:
+                    resp["ttfb"] = time.monotonic()
+                if resp["cid"] is None and chunk:
+                    m = _CID.search(chunk)
+                    resp["cid"] = m.group(1).decode() if m else ""
+                resp["bytes"] += len(chunk)
+                if chunk.startswith(b"event: error"):
+                    resp["error"] = True
+            await send(message)
+
+        try:
+            await self.app(scope, recv, snd)
+        finally:
+            self._write(rec, b"".join(body), resp, start)
+
+    def _write(self, rec: Dict[str, object], raw: bytes, resp: Dict[str, object], start: float) -> None:
+        end = time.monotonic()
+        cid: Optional[str] = None
+        msg = ""
+        try:
+            payload = json.loads(raw or b"{}")
+            cid = payload.get("conversation_id")
+            msg = str(payload.get("message") or "")
+        except (ValueError, AttributeError):
+            pass
+        rec["new"] = cid is None
+        cid = cid or resp["cid"]
+        rec["conv"] = self._token(cid) if cid else None
+        rec.update(
+            chars=len(msg),
+            words=len(msg.split()),
+            req_bytes=len(raw),
+            status=resp["status"],
+            ttfb_ms=round((resp["ttfb"] - start) * 1000, 1) if resp["ttfb"] else None,
+            latency_ms=round((end - start) * 1000, 1),
+            resp_bytes=resp["bytes"],
+        )
+        if rec["endpoint"].endswith("/stream"):
+            rec["stream_error"] = resp["error"]
+        writer.submit(self._append, json.dumps(rec, separators=(",", ":")))
+
+    def _append(self, line: str) -> None:
+        # Writer thread only. Line-buffered: every record reaches the file as soon as it is written
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+        self._file.write(line + "\n")
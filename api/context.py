@@ -0,0 +1,125 @@
+# api/context.py
+"""
+Token-budgeted context for the provider adapters.
+
+The stored history is a window of the last HISTORY_CAP messages plus a
+rolling `summary` of everything that left it. Each call then fits that window
+to the model's token budget, newest first; messages that do not fit are
+folded into the summary for that call instead of being silently dropped, so
+prompt size (and time-to-first-token) stays flat however long the debate gets.
+
+Summaries are extractive (first sentence of each message, clipped), so
+folding costs no extra model call.
+"""
+import os
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from api.postprocess import parse
+
+SUMMARY_HEADER = "Summary of earlier turns in this debate (you are 'You'):"
+
+_SENTENCE = re.compile(r"(?<=[.!?])\s")
+_WORDS = re.compile(r"\S+")
+
+
+@lru_cache(maxsize=None)
+def _encoder(model: str):
+    # tiktoken ships in requirements.txt; its BPE files are fetched on first load,
+    # which is why the app calls preload() at startup instead of waiting for a request
+    try:
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(text: str, model: str = "") -> int:
+    """Local token count: tiktoken when available, else ~4 chars/token (same rule as limits)."""
+    if not text:
+        return 0
+    enc = _encoder(model)
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    return max(1, len(text) // 4)
+
+
+def tokenizer(model: str = "") -> str:
+    """Name of the encoding count_tokens uses for `model` ("chars/4" without tiktoken)."""
+    enc = _encoder(model)
+    return enc.name if enc is not None else "chars/4"
+
+
+def preload(models: List[str]) -> Dict[str, str]:
+    """Loads the encoders up front (blocking: BPE download/disk read); returns model -> tokenizer."""
+    return {m or "default": tokenizer(m) for m in ["", *models]}
+
+
+def budget_for(provider: str, default: int = 1200) -> int:
+    """Tokens of history per prompt: CONTEXT_BUDGET_<PROVIDER>, else CONTEXT_BUDGET."""
+    raw = os.getenv(f"CONTEXT_BUDGET_{provider.upper()}") or os.getenv("CONTEXT_BUDGET")
+    return int(raw) if raw else default
+
+
+def _gist(text: str, words: int) -> str:
+    first = _SENTENCE.split(parse(text)[1], 1)[0]
+    toks = _WORDS.findall(first)
+    return " ".join(toks[:words]) + ("..." if len(toks) > words else "")
+
+
+def fold(summary: str, evicted: List[Dict[str, str]], max_tokens: int = 300, words: int = 24, model: str = "") -> str:
+    """Appends one line per evicted message; drops the oldest lines past `max_tokens`."""
+    lines = summary.splitlines() if summary else []
+    for m in evicted:
+        who = "You" if m["role"] == "bot" else "User"
+        lines.append(f"- {who}: {_gist(m['message'], words)}")
+    while len(lines) > 1 and count_tokens("\n".join(lines), model) > max_tokens:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+def fit(
+    history: List[Dict[str, str]],
+    budget: int,
+    summary: str = "",
+    user_msg: str = "",
+    model: str = "",
+    summary_tokens: int = 300,
+) -> Tuple[str, List[Dict[str, str]]]:
+    """
+    (summary, kept): the newest messages whose tokens fit in `budget` (after the
+    user message and the summary), oldest first; the rest folded into summary.
+    """
+    spent = count_tokens(user_msg, model) + count_tokens(summary, model)
+    start = len(history)
+    for i in range(len(history) - 1, -1, -1):
+        cost = count_tokens(history[i]["message"], model) + 4   # role / framing overhead
+        if spent + cost > budget:
+            break
+        spent += cost
+        start = i
+    if start == 0:
+        return summary, list(history)
+    return fold(summary, history[:start], summary_tokens, model=model), history[start:]
+
+
+def summary_message(summary: Optional[str]) -> Optional[str]:
+    return f"{SUMMARY_HEADER}\n{summary}" if summary else None
+
+
+class ContextBuilder:
+    """Per-adapter settings: model name for the tokenizer and the token budget."""
+
+    def __init__(self, provider: str, model: str = "", budget: Optional[int] = None, summary_tokens: Optional[int] = None) -> None:
+        self.model = model
+        self.budget = budget if budget is not None else budget_for(provider)
+        self.summary_tokens = summary_tokens if summary_tokens is not None else int(os.getenv("SUMMARY_MAX_TOKENS", "300"))
+
+    def build(self, history: List[Dict[str, str]], user_msg: str, summary: str = "") -> Tuple[Optional[str], List[Dict[str, str]]]:
+        """(system text for the summary or None, history that fits the budget)."""
+        summary, kept = fit(history, self.budget, summary, user_msg, self.model, self.summary_tokens)
+        return summary_message(summary), kept
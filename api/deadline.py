@@ -0,0 +1,205 @@
+# api/deadline.py
+"""
+Per-turn deadline and the one retry policy that spends it.
+
+A turn gets a `Deadline` at the endpoint (REQUEST_DEADLINE_S, or the shorter
+X-Request-Timeout header) and every provider call made for it — candidates,
+repair rounds, failover, stream open — draws from the same budget:
+
+- each attempt gets `remaining()` as its request timeout and, on the async
+  paths, is also cancelled when the budget runs out;
+- transient failures (Unavailable, UpstreamTimeout, UpstreamNetwork) are
+  retried with full-jitter exponential backoff, but only if the backoff still
+  fits in what is left;
+- running out of budget surfaces as UpstreamTimeout (504).
+
+RateLimited is not retried here: the limiter (api.limits) paces on 429 and the
+router fails over. The SDKs' own retries are turned off in the adapters, so
+this is the only place a provider call is repeated.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+from api import metrics, tracing
+from api.errors import ProviderError, Unavailable, UpstreamNetwork, UpstreamTimeout, _
+
+T = TypeVar("T")
+
+RETRYABLE = (Unavailable, UpstreamTimeout, UpstreamNetwork)
+
+
+def _expired() -> UpstreamTimeout:
+    return UpstreamTimeout(_("Se agotó el tiempo de la solicitud.", "The request deadline was exceeded."))
+
+
+class Deadline:
+    """Absolute point in time on a monotonic clock; `seconds=None` means no limit."""
+
+    def __init__(self, seconds: Optional[float] = None, clock: Callable[[], float] = time.monotonic) -> None:
+        self.clock = clock
+        self.at = None if seconds is None else clock() + max(0.0, seconds)
+
+    def remaining(self) -> Optional[float]:
+        return None if self.at is None else max(0.0, self.at - self.clock())
+
+    @property
+    def expired(self) -> bool:
+        return self.at is not None and self.clock() >= self.at
+
+
+def turn_deadline(header: Optional[str] = None, default: Optional[float] = None) -> Deadline:
+    """REQUEST_DEADLINE_S caps every turn (0 = no cap); an X-Request-Timeout header can only shorten it."""
+    limit = default if default is not None else float(os.getenv("REQUEST_DEADLINE_S", "60"))
+    limit = limit if limit > 0 else None
+    if header is not None:
+        asked = float(header)
+        if asked <= 0:
+            raise ValueError("X-Request-Timeout must be a positive number of seconds")
+        limit = asked if limit is None else min(limit, asked)
+    return Deadline(limit)
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 0.2,
+        max_delay: float = 2.0,
+        retry_on: Tuple[type, ...] = RETRYABLE,
+        rng: Callable[[], float] = random.random,
+    ) -> None:
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_on = retry_on
+        self.rng = rng
+        self.calls = 0
+        self.attempts = 0
+        self.retries: Dict[str, int] = {}
+        self.exhausted = 0
+        self.deadline_exceeded = 0
+        self._lock = threading.Lock()
+
+    def backoff(self, attempt: int) -> float:
+        """Full jitter: uniform in [0, min(max_delay, base * 2^(attempt-1)))."""
+        return self.rng() * min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+
+    def _count(self, field: str) -> None:
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def _next_delay(self, attempt: int, err: ProviderError, deadline: Deadline, provider: str) -> float:
+        """Delay before attempt+1, or raises: attempts spent, or no budget left for another try."""
+        if attempt >= self.max_attempts:
+            self._count("exhausted")
+            raise err
+        delay = self.backoff(attempt)
+        left = deadline.remaining()
+        if left is not None and delay >= left:
+            self._count("deadline_exceeded")
+            raise _expired() from err
+        with self._lock:
+            reason = type(err).__name__
+            self.retries[reason] = self.retries.get(reason, 0) + 1
+        metrics.RETRIES.inc(provider, "upstream")
+        return delay
+
+    def _start(self, deadline: Deadline) -> Optional[float]:
+        if deadline.expired:
+            self._count("deadline_exceeded")
+            raise _expired()
+        self._count("attempts")
+        return deadline.remaining()
+
+    def run(self, fn: Callable[[Optional[float]], T], deadline: Deadline, provider: str = "") -> T:
+        """Sync: fn(timeout) is bounded by the request timeout it is given. `provider` labels the metrics."""
+        self._count("calls")
+        attempt = 0
+        while True:
+            attempt += 1
+            timeout = self._start(deadline)
+            try:
+                return fn(timeout)
+            except self.retry_on as e:
+                delay = self._next_delay(attempt, e, deadline, provider)
+                with tracing.span("retry.backoff"):
+                    time.sleep(delay)
+
+    async def arun(self, fn: Callable[[Optional[float]], Awaitable[T]], deadline: Deadline, provider: str = "") -> T:
+        self._count("calls")
+        attempt = 0
+        while True:
+            attempt += 1
+            timeout = self._start(deadline)
+            try:
+                return await asyncio.wait_for(fn(timeout), timeout)
+            except asyncio.TimeoutError:
+                err: ProviderError = UpstreamTimeout()
+                metrics.error(provider, err)
+            except self.retry_on as e:
+                err = e
+            delay = self._next_delay(attempt, err, deadline, provider)
+            with tracing.span("retry.backoff"):
+                await asyncio.sleep(delay)
+
+    async def aiter(self, open_fn: Callable[[Optional[float]], AsyncIterator[T]], deadline: Deadline, provider: str = "") -> AsyncIterator[T]:
+        """
+        Streams: retried only until the first item arrives (after that the
+        client has seen output); every item must land within the deadline.
+        """
+        self._count("calls")
+        attempt = 0
+        while True:
+            attempt += 1
+            timeout = self._start(deadline)
+            it = open_fn(timeout).__aiter__()
+            started = False
+            try:
+                while True:
+                    try:
+                        item = await asyncio.wait_for(it.__anext__(), deadline.remaining())
+                    except StopAsyncIteration:
+                        return
+                    started = True
+                    yield item
+            except asyncio.TimeoutError:
+                metrics.error(provider, UpstreamTimeout())
+                if started:
+                    self._count("deadline_exceeded")
+                    raise _expired() from None
+                err: ProviderError = UpstreamTimeout()
+            except self.retry_on as e:
+                if started:
+                    raise
+                err = e
+            finally:
+                aclose = getattr(it, "aclose", None)
+                if aclose is not None:
+                    await aclose()
+            delay = self._next_delay(attempt, err, deadline, provider)
+            with tracing.span("retry.backoff"):
+                await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "max_attempts": self.max_attempts,
+                "calls": self.calls,
+                "attempts": self.attempts,
+                "retries": dict(self.retries),
+                "exhausted": self.exhausted,
+                "deadline_exceeded": self.deadline_exceeded,
+            }
+
+
+def from_env() -> RetryPolicy:
+    """RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY_S, RETRY_MAX_DELAY_S."""
+    return RetryPolicy(
+        max_attempts=int(os.getenv("RETRY_MAX_ATTEMPTS", "3")),
+        base_delay=float(os.getenv("RETRY_BASE_DELAY_S", "0.2")),
+        max_delay=float(os.getenv("RETRY_MAX_DELAY_S", "2.0")),
+    )
@@ -34,8 +34,16 @@ class BadRequestError(ProviderError):
 class RateLimited(ProviderError):
     # Quota or request-per-minute cap exceeded
     status_code = 429
-    def __init__(self, detail: str | None = None):
+    def __init__(self, detail: str | None = None, retry_after: float | None = None):
         super().__init__(detail or _("Rate limit or quota exceeded.", "You have exceeded your rate limit or quota. Please wait a moment before trying again."))
+        # Seconds suggested by upstream (Retry-After), if it sent one
+        self.retry_after = retry_after
+
+class AdmissionRejected(RateLimited):
+    # Our own limiter (api.limits) turned the call away: full queue or no slot in time.
+    # Still a 429 for the client, but says nothing about the provider's health.
+    def __init__(self, detail: str | None = None):
+        super().__init__(detail)
 
 class UpstreamTimeout(ProviderError):
     # Timeout from upstream API
@@ -0,0 +1,102 @@
+# api/generation.py
+"""
+Candidate generation with one central retry budget.
+
+Instead of each adapter re-asking on a bad [[STANCE:...]] marker and the
+service re-asking again on non-English output (up to four serial calls), a
+turn asks for `candidates` replies in one round trip (OpenAI `n`, Gemini
+`candidate_count`, concurrent requests for DeepSeek) and keeps the best:
+
+1. English with the right marker;
+2. English with a missing/wrong marker (the service rewrites the marker).
+
+Only when no candidate is English does the turn spend a repair round (a
+stricter prompt), at most `max_repairs` times. GenerationStats counts how
+often each of those paths was needed.
+"""
+import os
+import threading
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+from api.postprocess import declared, parse
+
+
+class GenerationPolicy:
+    def __init__(self, candidates: int = 1, max_repairs: int = 1) -> None:
+        self.candidates = max(1, candidates)
+        self.max_repairs = max(0, max_repairs)
+
+    @property
+    def max_calls(self) -> int:
+        return 1 + self.max_repairs
+
+
+def choose(texts: Sequence[str], stance: str, is_english: Callable[[str], bool]) -> Tuple[Optional[int], bool, Dict[str, int]]:
+    """
+    (index of the chosen candidate or None, marker needs a local fix,
+    rejection counts by reason).
+    """
+    rejected = {"empty": 0, "not_english": 0}
+    fallback = None
+    for i, text in enumerate(texts):
+        if not parse(text)[1]:
+            rejected["empty"] += 1   # nothing, or a bare marker
+            continue
+        if not is_english(text):
+            rejected["not_english"] += 1
+            continue
+        if declared(text) == stance:
+            return i, False, rejected
+        if fallback is None:
+            fallback = i
+    return fallback, fallback is not None, rejected
+
+
+class GenerationStats:
+    def __init__(self) -> None:
+        self.turns = 0
+        self.first_round = 0
+        self.repaired = 0
+        self.exhausted = 0
+        self.marker_fixed = 0
+        self.candidates = 0
+        self.rejected: Dict[str, int] = {"empty": 0, "not_english": 0}
+        self.picked_index: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, rounds: int, index: Optional[int], marker_fixed: bool, candidates: int, rejected: Dict[str, int]) -> None:
+        with self._lock:
+            self.turns += 1
+            self.candidates += candidates
+            for reason, n in rejected.items():
+                self.rejected[reason] = self.rejected.get(reason, 0) + n
+            if index is None:
+                self.exhausted += 1
+                return
+            if rounds == 1:
+                self.first_round += 1
+            else:
+                self.repaired += 1
+            self.marker_fixed += marker_fixed
+            self.picked_index[index] = self.picked_index.get(index, 0) + 1
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "turns": self.turns,
+                "first_round": self.first_round,
+                "repaired": self.repaired,
+                "exhausted": self.exhausted,
+                "marker_fixed_locally": self.marker_fixed,
+                "candidates": self.candidates,
+                "rejected": dict(self.rejected),
+                "picked_index": dict(sorted(self.picked_index.items())),
+            }
+
+
+def from_env() -> GenerationPolicy:
+    """GEN_CANDIDATES (per round trip, opt-in: each one is paid for), GEN_MAX_REPAIRS (extra rounds when no candidate is usable)."""
+    return GenerationPolicy(
+        candidates=int(os.getenv("GEN_CANDIDATES", "1")),
+        max_repairs=int(os.getenv("GEN_MAX_REPAIRS", "1")),
+    )
@@ -0,0 +1,253 @@
+# api/limits.py
+"""
+Per-provider admission control: caps in-flight calls, enforces RPM/TPM budgets
+with token buckets and queues excess work for a bounded time. When upstream
+says we are too fast (429 + Retry-After, or x-ratelimit-* headers) the limiter
+pauses and lowers its own rate, then creeps back up on success (AIMD).
+"""
+import asyncio
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, Mapping, Optional
+
+from api.errors import AdmissionRejected, RateLimited, _
+
+# Completion tokens booked per candidate (the adapters send max_tokens=256)
+COMPLETION_TOKENS = 256
+# Stay this fraction under the quota advertised by the provider
+HEADROOM = 0.9
+BACKOFF_FACTOR = 0.7
+RECOVERY_STEP = 0.05
+MIN_RATE_FRACTION = 0.1
+
+
+class TokenBucket:
+    """Classic token bucket; `reserve` books tokens up front and returns how long to wait."""
+
+    def __init__(self, per_minute: float, clock: Callable[[], float] = time.monotonic) -> None:
+        self.clock = clock
+        self.limit = float(per_minute)
+        self.rate = self.limit / 60.0
+        self.capacity = float(per_minute)
+        self.tokens = self.capacity
+        self.paused_until = 0.0
+        self._ts = clock()
+
+    def _refill(self, now: float) -> None:
+        if now > self._ts:
+            self.tokens = min(self.capacity, self.tokens + (now - self._ts) * self.rate)
+            self._ts = now
+
+    def delay_for(self, n: float) -> float:
+        now = self.clock()
+        self._refill(now)
+        pause = max(0.0, self.paused_until - now)
+        deficit = n - self.tokens
+        return max(pause, deficit / self.rate if deficit > 0 else 0.0)
+
+    def reserve(self, n: float) -> float:
+        wait = self.delay_for(n)
+        self.tokens -= n
+        return wait
+
+    def set_per_minute(self, per_minute: float) -> None:
+        self._refill(self.clock())
+        self.rate = max(per_minute, self.limit * MIN_RATE_FRACTION) / 60.0
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, self.clock() + seconds)
+
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(raw: Optional[str]) -> Optional[float]:
+    """'1m30s', '20ms', '6.5s' (OpenAI reset headers) or plain seconds (Retry-After)."""
+    if not raw:
+        return None
+    raw = raw.strip()
+    try:
+        return float(raw)
+    except ValueError:
+        pass
+    parts = _DURATION.findall(raw)
+    if not parts:
+        return None
+    return sum(float(v) * _UNITS[u] for v, u in parts)
+
+
+class ProviderLimiter:
+    def __init__(
+        self,
+        name: str,
+        max_in_flight: int = 16,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        max_wait: float = 10.0,
+        max_queue: int = 256,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.clock = clock
+        self.requests = TokenBucket(rpm, clock) if rpm else None
+        self.tokens = TokenBucket(tpm, clock) if tpm else None
+        self._sem = asyncio.Semaphore(max_in_flight)
+        # Callers needing several slots take them under this lock, so two of them
+        # never each hold part of what the other is waiting for
+        self._multi = asyncio.Lock()
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.throttled = 0
+
+    def _reject(self) -> AdmissionRejected:
+        self.rejected += 1
+        return AdmissionRejected(_(
+            f"Demasiadas solicitudes en cola para {self.name}.",
+            f"Too many queued requests for {self.name}. Please retry shortly.",
+        ))
+
+    def _reserve(self, tokens: int, requests: int, budget: float) -> float:
+        buckets = [(b, n) for b, n in ((self.requests, requests), (self.tokens, tokens)) if b is not None]
+        wait = max((b.delay_for(n) for b, n in buckets), default=0.0)
+        if wait > budget:
+            raise self._reject()
+        for b, n in buckets:
+            b.reserve(n)
+        return wait
+
+    async def _acquire(self, slots: int) -> None:
+        if slots == 1:
+            await self._sem.acquire()
+            return
+        got = 0
+        try:
+            async with self._multi:
+                for _ in range(slots):
+                    await self._sem.acquire()
+                    got += 1
+        except BaseException:
+            for _ in range(got):
+                self._sem.release()
+            raise
+
+    @asynccontextmanager
+    async def admit(self, tokens: int = 0, max_wait: Optional[float] = None, requests: int = 1) -> AsyncIterator[None]:
+        """
+        Waits (at most `max_wait`, or the caller's shorter budget) for a slot and budget, then runs the call.
+        `requests` upstream requests sent together (e.g. one per candidate) take one slot and one RPM token each.
+        """
+        if self.queued >= self.max_queue:
+            raise self._reject()
+        slots = max(1, min(requests, self.max_in_flight))
+        limit = self.max_wait if max_wait is None else min(self.max_wait, max_wait)
+        start = self.clock()
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._acquire(slots), timeout=limit)
+        except asyncio.TimeoutError:
+            raise self._reject()
+        finally:
+            self.queued -= 1
+        entered = False
+        try:
+            wait = self._reserve(tokens, max(1, requests), limit - (self.clock() - start))
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self.in_flight += slots
+            self.admitted += 1
+            entered = True
+            try:
+                yield
+            except RateLimited as e:
+                self.backoff(getattr(e, "retry_after", None))
+                raise
+            self._recover()
+        finally:
+            if entered:
+                self.in_flight -= slots
+            for _ in range(slots):
+                self._sem.release()
+
+    def backoff(self, retry_after: Optional[float] = None) -> None:
+        """Upstream said 429: pause for Retry-After and cut the rate multiplicatively."""
+        self.throttled += 1
+        for b in (self.requests, self.tokens):
+            if b is None:
+                continue
+            if retry_after:
+                b.pause(retry_after)
+            b.set_per_minute(b.rate * 60.0 * BACKOFF_FACTOR)
+
+    def _recover(self) -> None:
+        for b in (self.requests, self.tokens):
+            if b is not None and b.rate * 60.0 < b.limit:
+                b.set_per_minute(min(b.limit, b.rate * 60.0 + b.limit * RECOVERY_STEP))
+
+    def observe(self, headers: Mapping[str, str]) -> None:
+        """Tune budgets from x-ratelimit-* / retry-after response headers."""
+        h = {k.lower(): v for k, v in headers.items()}
+        for kind in ("requests", "tokens"):
+            bucket = getattr(self, kind)
+            limit = h.get(f"x-ratelimit-limit-{kind}")
+            if limit and limit.replace(".", "", 1).isdigit():
+                if bucket is None:
+                    # Provider advertised a quota we were not configured for: adopt it
+                    bucket = TokenBucket(float(limit) * HEADROOM, self.clock)
+                    setattr(self, kind, bucket)
+                bucket.limit = float(limit) * HEADROOM
+                bucket.capacity = bucket.limit
+                bucket.set_per_minute(min(bucket.rate * 60.0, bucket.limit))
+            if bucket is None:
+                continue
+            remaining = h.get(f"x-ratelimit-remaining-{kind}")
+            if remaining == "0":
+                reset = parse_duration(h.get(f"x-ratelimit-reset-{kind}"))
+                if reset:
+                    bucket.pause(reset)
+        retry_after = parse_duration(h.get("retry-after"))
+        if retry_after:
+            for b in (self.requests, self.tokens):
+                if b is not None:
+                    b.pause(retry_after)
+
+    def stats(self) -> Dict[str, float]:
+        out: Dict[str, float] = {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "throttled": self.throttled,
+        }
+        if self.requests is not None:
+            out["rpm"] = round(self.requests.rate * 60.0, 1)
+        if self.tokens is not None:
+            out["tpm"] = round(self.tokens.rate * 60.0, 1)
+        return out
+
+
+def estimate_tokens(*texts: str, completion: int = COMPLETION_TOKENS) -> int:
+    """Rough prompt+completion size (~4 chars/token) used for the TPM bucket."""
+    return sum(len(t or "") for t in texts) // 4 + completion
+
+
+def from_env(provider: str) -> ProviderLimiter:
+    """<PROVIDER>_MAX_IN_FLIGHT, <PROVIDER>_RPM, <PROVIDER>_TPM, ADMISSION_MAX_WAIT, ADMISSION_MAX_QUEUE."""
+    p = provider.upper()
+    rpm = os.getenv(f"{p}_RPM")
+    tpm = os.getenv(f"{p}_TPM")
+    return ProviderLimiter(
+        provider,
+        max_in_flight=int(os.getenv(f"{p}_MAX_IN_FLIGHT", "16")),
+        rpm=float(rpm) if rpm else None,
+        tpm=float(tpm) if tpm else None,
+        max_wait=float(os.getenv("ADMISSION_MAX_WAIT", "10")),
+        max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "256")),
+    )
@@ -1,100 +1,158 @@
-import os, re
-from typing import List, Dict, Tuple
-from openai import OpenAI
+import asyncio
+import os
+import httpx
+from typing import List, Dict, AsyncIterator
+from openai import OpenAI, AsyncOpenAI, NOT_GIVEN
 import openai as openai_pkg
 
+from api.context import ContextBuilder
+from api.postprocess import strip_tag_and_check
+from api import tracing
+from api.prompts import PromptUsage, system_prompt
 from api.errors import (
     ProviderError, RateLimited, AuthError, PermissionError,
     BadRequestError, UpstreamTimeout, Unavailable, UpstreamNetwork,
 )
+from api.limits import parse_duration
 
-SYSTEM_TEMPLATE = (
-    "Role: debate bot.\n"
-    "Fixed topic: '{topic}'.\n"
-    "Your FIXED stance: '{stance}'. NEVER change it.\n"
-    "Mandatory rules:\n"
-    "1) Always start with the exact line: [[STANCE:{stance}]]\n"
-    "2) Consistently defend that stance in every turn.\n"
-    "3) Be respectful and persuasive; use evidence, analogies, and questions.\n"
-    "4) Max 180 words. Stay strictly on topic.\n"
-    "Write the answer in English."
-)
-
-GUARD_TEMPLATE = (
-    "Critical guard: The stance marker MUST be exactly one of: [[STANCE:pro]] or [[STANCE:contra]]. "
-    "Any other token (e.g., [[STANCE:st]]) is invalid and you must rewrite immediately."
-)
+def _retry_after(e: Exception) -> float | None:
+    response = getattr(e, "response", None)
+    return parse_duration(response.headers.get("retry-after")) if response is not None else None
 
-def _strip_tag_and_check(text: str, stance: str) -> Tuple[str, bool]:
-    t = (text or "").strip()
-    m = re.match(r"\s*\[\[STANCE\s*:\s*([^\]]+)\]\]\s*", t, re.I)
-    declared = m.group(1).lower().strip() if m else None
-    body = t[m.end():].lstrip() if m else t
-    ok = declared in {"pro", "contra"} and declared == stance
-    return body, ok
+# Error mapping: convert OpenAI SDK exceptions to our domain errors.
+def _map_error(e: Exception) -> ProviderError:
+    if isinstance(e, ProviderError):
+        return e
+    if isinstance(e, openai_pkg.RateLimitError):
+        return RateLimited(str(e), retry_after=_retry_after(e))
+    if isinstance(e, openai_pkg.AuthenticationError):
+        return AuthError(str(e))
+    if isinstance(e, openai_pkg.PermissionDeniedError):
+        return PermissionError(str(e))
+    if isinstance(e, openai_pkg.BadRequestError):
+        return BadRequestError(str(e))
+    if isinstance(e, openai_pkg.APITimeoutError):
+        return UpstreamTimeout(str(e))
+    if isinstance(e, openai_pkg.APIConnectionError):
+        return UpstreamNetwork(str(e))
+    if isinstance(e, openai_pkg.APIStatusError):
+        sc = getattr(e, "status_code", None)
+        if sc == 429: return RateLimited(str(e), retry_after=_retry_after(e))
+        if sc == 401: return AuthError(str(e))
+        if sc == 403: return PermissionError(str(e))
+        if sc in (500, 502): return Unavailable(str(e))
+        if sc == 503: return Unavailable(str(e))
+        if sc == 504: return UpstreamTimeout(str(e))
+    return ProviderError(str(e))
 
 class DeepSeekLLM:
-    def __init__(self, api_key: str, model: str = "deepseek-chat", base_url: str | None = None):
-        base = base_url or os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
-        self.client = OpenAI(api_key=api_key, base_url=base)
+    # acandidates sends one request per candidate (no `n`): the limiter books each one
+    fans_out = True
+
+    def __init__(
+        self,
+        api_key: str,
+        model: str = "deepseek-chat",
+        base_url: str | None = None,
+        http_client: httpx.Client | None = None,
+        async_http_client: httpx.AsyncClient | None = None,
+        timeout: httpx.Timeout | float | None = None,
+    ):
+        # http_client/async_http_client: shared pools from api.transport (None = SDK default)
+        self.base_url = base_url or os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
+        tmo = timeout if timeout is not None else NOT_GIVEN
+        self.client = OpenAI(api_key=api_key, base_url=self.base_url, http_client=http_client, timeout=tmo, max_retries=0)
+        self.aclient = AsyncOpenAI(api_key=api_key, base_url=self.base_url, http_client=async_http_client, timeout=tmo, max_retries=0)
         self.model = model
+        # Read timeout the deadline is clamped to (retries live in api.deadline, not the SDK)
+        self.timeout_s = timeout.read if isinstance(timeout, httpx.Timeout) else timeout
+        # Token budget for history (CONTEXT_BUDGET[_DEEPSEEK]); the rest goes into the summary
+        self.context = ContextBuilder("deepseek", model)
+        # Prompt / cached / completion tokens reported by the API
+        self.usage = PromptUsage("deepseek", model)
 
-    def chat(self, topic: str, stance: str, history: List[Dict[str, str]], user_msg: str) -> str:
-        msgs = [
-            {"role": "system", "content": SYSTEM_TEMPLATE.format(topic=topic, stance=stance)},
-            {"role": "system", "content": GUARD_TEMPLATE},
-            {"role": "system", "content": "Always answer in English. If the user asks to change language, politely refuse and continue in English."},
-        ]
+    @tracing.traced("prompt")
+    def _messages(self, topic: str, stance: str, history: List[Dict[str, str]], user_msg: str, summary: str = "") -> List[Dict[str, str]]:
+        # Stable prefix first (provider prompt caching); everything that changes goes after it
+        msgs = [{"role": "system", "content": system_prompt(topic, stance)}]
+        summary_text, history = self.context.build(history, user_msg, summary)
         for m in history:
             role = "assistant" if m["role"] == "bot" else "user"
             msgs.append({"role": role, "content": m["message"]})
+        if summary_text:
+            msgs.append({"role": "system", "content": summary_text})
         msgs.append({"role": "user", "content": user_msg})
+        return msgs
+
+    def _record_usage(self, usage) -> None:
+        if usage is None:
+            return
+        # DeepSeek caches prefixes on its own and reports hits as prompt_cache_hit_tokens
+        cached = getattr(usage, "prompt_cache_hit_tokens", None)
+        if cached is None:
+            cached = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None)
+        self.usage.record(usage.prompt_tokens, cached, usage.completion_tokens)
+
+    def _timeout_args(self, timeout: float | None) -> Dict[str, float]:
+        # Remaining turn budget, never above the configured read timeout
+        if timeout is None:
+            return {}
+        return {"timeout": timeout if self.timeout_s is None else min(timeout, self.timeout_s)}
+
+    def _create_args(self, msgs: List[Dict[str, str]], timeout: float | None = None) -> Dict[str, object]:
+        return dict(model=self.model, messages=msgs, temperature=0.2, max_tokens=256, **self._timeout_args(timeout))
 
+    def _text(self, comp) -> str:
+        self._record_usage(comp.usage)
+        return (comp.choices[0].message.content or "").strip()
+
+    def candidates(self, topic: str, stance: str, history: List[Dict[str, str]], user_msg: str, n: int = 1, summary: str = "", timeout: float | None = None) -> List[str]:
+        # The DeepSeek API has no `n`; the sync path keeps to a single request
+        msgs = self._messages(topic, stance, history, user_msg, summary)
+        try:
+            return [self._text(self.client.chat.completions.create(**self._create_args(msgs, timeout)))]
+        except Exception as e:
+            raise _map_error(e)
+
+    async def acandidates(self, topic: str, stance: str, history: List[Dict[str, str]], user_msg: str, n: int = 1, summary: str = "", timeout: float | None = None) -> List[str]:
+        # ...so the async path fires n requests concurrently (same prefix, cached after the first)
+        msgs = self._messages(topic, stance, history, user_msg, summary)
+        # TaskGroup: the first failure cancels the other requests (and frees their limiter slots)
         try:
-            last_text = ""
-            for _ in range(2):
-                comp = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=msgs,
-                    temperature=0.2,
-                    max_tokens=256,
-                )
-                text = (comp.choices[0].message.content or "").strip()
-                last_text = text
-                body, ok = _strip_tag_and_check(text, stance)
-                if ok:
-                    return f"[[STANCE:{stance}]] {body.strip()}"
+            async with asyncio.TaskGroup() as tg:
+                tasks = [tg.create_task(self.aclient.chat.completions.create(**self._create_args(msgs, timeout))) for _ in range(max(1, n))]
+        except ExceptionGroup as eg:
+            raise _map_error(eg.exceptions[0])
+        return [self._text(t.result()) for t in tasks]
+
+    def chat(self, topic: str, stance: str, history: List[Dict[str, str]], user_msg: str, summary: str = "", timeout: float | None = None) -> str:
+        # Single call; repairs are budgeted by the service (api.generation)
+        text = self.candidates(topic, stance, history, user_msg, 1, summary, timeout)[0]
+        body, ok = strip_tag_and_check(text, stance)
+        return f"[[STANCE:{stance}]] {body.strip()}" if ok else text
 
-                msgs.append({
-                    "role": "user",
-                    "content": (
-                        f"Your previous reply used an invalid or wrong marker. "
-                        f"Rewrite in ENGLISH, start with [[STANCE:{stance}]], keep it under 180 words, "
-                        f"and do not change topic or stance."
-                    ),
-                })
-            return last_text.strip()
+    async def achat(self, topic: str, stance: str, history: List[Dict[str, str]], user_msg: str, summary: str = "", timeout: float | None = None) -> str:
+        text = (await self.acandidates(topic, stance, history, user_msg, 1, summary, timeout))[0]
+        body, ok = strip_tag_and_check(text, stance)
+        return f"[[STANCE:{stance}]] {body.strip()}" if ok else text
 
-        except openai_pkg.RateLimitError as e:
-            raise RateLimited(str(e))
-        except openai_pkg.AuthenticationError as e:
-            raise AuthError(str(e))
-        except openai_pkg.PermissionDeniedError as e:
-            raise PermissionError(str(e))
-        except openai_pkg.BadRequestError as e:
-            raise BadRequestError(str(e))
-        except openai_pkg.APITimeoutError as e:
-            raise UpstreamTimeout(str(e))
-        except openai_pkg.APIConnectionError as e:
-            raise UpstreamNetwork(str(e))
-        except openai_pkg.APIStatusError as e:
-            sc = getattr(e, "status_code", None)
-            if sc == 429: raise RateLimited(str(e))
-            if sc == 401: raise AuthError(str(e))
-            if sc == 403: raise PermissionError(str(e))
-            if sc in (500, 502): raise Unavailable(str(e))
-            if sc == 503: raise Unavailable(str(e))
-            if sc == 504: raise UpstreamTimeout(str(e))
-            raise ProviderError(str(e))
+    async def astream(self, topic: str, stance: str, history: List[Dict[str, str]], user_msg: str, summary: str = "", timeout: float | None = None) -> AsyncIterator[str]:
+        # No marker-repair loop here: the service normalizes the marker incrementally.
+        msgs = self._messages(topic, stance, history, user_msg, summary)
+        try:
+            stream = await self.aclient.chat.completions.create(
+                model=self.model,
+                messages=msgs,
+                temperature=0.2,
+                max_tokens=256,
+                stream=True,
+                stream_options={"include_usage": True},
+                **self._timeout_args(timeout),
+            )
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    self._record_usage(chunk.usage)   # last chunk, no choices
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
         except Exception as e:
-            raise ProviderError(str(e))
+            raise _map_error(e)
@@ -7,3 +7,6 @@ class DummyLLM:
             f"Consider this: {user_msg} — but the evidence and logic still "
             f"support my side. What part would you challenge specifically?"
         )
+
+    async def achat(self, topic: str, stance: str, history: List[Dict[str, str]], user_msg: str) -> str:
+        return self.chat(topic, stance, history, user_msg)
@@ -1,94 +1,155 @@
-from typing import List, Dict, Tuple
-import re
+import threading
+from collections import OrderedDict
+from typing import List, Dict, AsyncIterator
 import google.generativeai as genai
 from google.api_core import exceptions as gax
 
+from api.context import ContextBuilder
+from api.postprocess import strip_tag_and_check
+from api import tracing
+from api.prompts import PromptUsage, system_prompt
 from api.errors import (
     ProviderError, RateLimited, AuthError, PermissionError,
     BadRequestError, UpstreamTimeout, Unavailable, UpstreamNetwork,
 )
 
-SYSTEM_TEMPLATE = (
-    "Role: debate bot.\n"
-    "Fixed topic: '{topic}'.\n"
-    "Your FIXED stance: '{stance}'. NEVER change it.\n"
-    "Mandatory rules:\n"
-    "1) Always start with the exact line: [[STANCE:{stance}]]\n"
-    "2) Consistently defend that stance in every turn.\n"
-    "3) Be respectful and persuasive; use evidence, analogies, and questions.\n"
-    "4) Max 180 words. Stay strictly on topic.\n"
-    "Write the answer in English."
-)
-
-GUARD_TEMPLATE = (
-    "Critical guard: The stance marker MUST be exactly one of: [[STANCE:pro]] or [[STANCE:contra]]. "
-    "Any other token (e.g., [[STANCE:st]]) is invalid and you must rewrite immediately."
-)
-
-def _strip_tag_and_check(text: str, stance: str) -> Tuple[str, bool]:
-    t = (text or "").strip()
-    m = re.match(r"\s*\[\[STANCE\s*:\s*([^\]]+)\]\]\s*", t, re.I)
-    declared = m.group(1).lower().strip() if m else None
-    body = t[m.end():].lstrip() if m else t
-    ok = declared in {"pro", "contra"} and declared == stance
-    return body, ok
+# Error mapping: convert google-api-core exceptions to our domain errors.
+def _map_error(e: Exception) -> ProviderError:
+    if isinstance(e, ProviderError):
+        return e
+    if isinstance(e, genai.types.BlockedPromptException):
+        return BadRequestError(str(e))
+    if isinstance(e, gax.ResourceExhausted):
+        return RateLimited(str(e))
+    # Server errors, like the OpenAI/DeepSeek 5xx: 504 (and DeadlineExceeded, a subclass) is a timeout
+    if isinstance(e, gax.GatewayTimeout):
+        return UpstreamTimeout(str(e))
+    if isinstance(e, gax.Unauthenticated):
+        return AuthError(str(e))
+    if isinstance(e, gax.PermissionDenied):
+        return PermissionError(str(e))
+    if isinstance(e, gax.InvalidArgument):
+        return BadRequestError(str(e))
+    if isinstance(e, (gax.InternalServerError, gax.BadGateway, gax.ServiceUnavailable)):
+        return Unavailable(str(e))
+    return ProviderError(str(e))
 
 class GeminiLLM:
-    def __init__(self, api_key: str, model: str = "gemini-1.5-flash"):
+    def __init__(self, api_key: str, model: str = "gemini-1.5-flash", timeout: float | None = None):
         genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel(model)
+        self.model_name = model
+        # Token budget for history (CONTEXT_BUDGET[_GEMINI]); the rest goes into the summary
+        self.context = ContextBuilder("gemini", model)
+        # One model per conversation prefix: the rules travel as system_instruction,
+        # identical on every turn. Not cached: the prefix is far below the minimum
+        # size of a caching.CachedContent, so every turn pays for it in full
+        self._models: "OrderedDict[str, genai.GenerativeModel]" = OrderedDict()
+        self._models_lock = threading.Lock()
+        self.max_models = 1024
+        self.usage = PromptUsage("gemini", model, prefix_cache=False)
+        # Gemini goes through google-api-core, not httpx; only the timeout is shared config.
+        # retry=None: api-core would otherwise retry 503s for up to 600 s (api.deadline retries instead)
+        self.timeout_s = timeout
+        self.request_options = {"retry": None, "timeout": timeout} if timeout else {"retry": None}
 
-    def chat(self, topic: str, stance: str, history: List[Dict[str, str]], user_msg: str) -> str:
-        system = SYSTEM_TEMPLATE.format(topic=topic, stance=stance)
-        contents = [
-            {"role": "user", "parts": [system]},
-            {"role": "user", "parts": [GUARD_TEMPLATE]},
-            {"role": "user", "parts": ["Always answer in English. If the user asks to change language, politely refuse and continue in English."]},
-        ]
+    def _model_for(self, topic: str, stance: str) -> "genai.GenerativeModel":
+        system = system_prompt(topic, stance)
+        with self._models_lock:
+            model = self._models.get(system)
+            if model is None:
+                model = self._models[system] = genai.GenerativeModel(self.model_name, system_instruction=system)
+                if len(self._models) > self.max_models:
+                    self._models.popitem(last=False)
+            else:
+                self._models.move_to_end(system)
+            return model
+
+    @tracing.traced("prompt")
+    def _contents(self, topic: str, stance: str, history: List[Dict[str, str]], user_msg: str, summary: str = "") -> List[Dict]:
+        # The fixed rules are the model's system_instruction (see _model_for)
+        contents = []
+        summary_text, history = self.context.build(history, user_msg, summary)
         for m in history:
             role = "model" if m["role"] == "bot" else "user"
             contents.append({"role": role, "parts": [m["message"]]})
+        if summary_text:
+            contents.append({"role": "user", "parts": [summary_text]})
         contents.append({"role": "user", "parts": [user_msg]})
+        return contents
+
+    def _record_usage(self, resp) -> None:
+        meta = getattr(resp, "usage_metadata", None)
+        if meta is None or not getattr(meta, "prompt_token_count", 0):
+            return
+        self.usage.record(
+            meta.prompt_token_count,
+            getattr(meta, "cached_content_token_count", 0),
+            getattr(meta, "candidates_token_count", 0),
+        )
+
+    def _options(self, timeout: float | None):
+        # Remaining turn budget, never above the configured timeout
+        if timeout is None:
+            return self.request_options
+        return {"retry": None, "timeout": timeout if self.timeout_s is None else min(timeout, self.timeout_s)}
+
+    @staticmethod
+    def _config(n: int = 1) -> "genai.GenerationConfig":
+        return genai.GenerationConfig(
+            temperature=0.5,
+            max_output_tokens=256,
+            candidate_count=max(1, n),
+        )
 
+    def _texts(self, resp) -> List[str]:
+        # resp.text only works with exactly one candidate
+        self._record_usage(resp)
+        return [
+            "".join(getattr(p, "text", "") for p in c.content.parts).strip()
+            for c in resp.candidates
+        ] or [""]
+
+    def candidates(self, topic: str, stance: str, history: List[Dict[str, str]], user_msg: str, n: int = 1, summary: str = "", timeout: float | None = None) -> List[str]:
+        contents = self._contents(topic, stance, history, user_msg, summary)
+        model = self._model_for(topic, stance)
         try:
-            last_text = ""
-            for _ in range(2):
-                resp = self.model.generate_content(
-                    contents,
-                    generation_config=genai.GenerationConfig(
-                        temperature=0.5,
-                        max_output_tokens=256,
-                    ),
-                )
-                text = (resp.text or "").strip()
-                last_text = text
-                body, ok = _strip_tag_and_check(text, stance)
-                if ok:
-                    return f"[[STANCE:{stance}]] {body.strip()}"
+            return self._texts(model.generate_content(contents, generation_config=self._config(n), request_options=self._options(timeout)))
+        except Exception as e:
+            raise _map_error(e)
 
-                contents.append({
-                    "role": "user",
-                    "parts": [f"Your reply used an invalid/wrong marker. "
-                              f"Rewrite in ENGLISH, start with [[STANCE:{stance}]], keep it under 180 words, "
-                              f"and do not change topic or stance."],
-                })
-            return last_text.strip()
+    async def acandidates(self, topic: str, stance: str, history: List[Dict[str, str]], user_msg: str, n: int = 1, summary: str = "", timeout: float | None = None) -> List[str]:
+        contents = self._contents(topic, stance, history, user_msg, summary)
+        model = self._model_for(topic, stance)
+        try:
+            return self._texts(await model.generate_content_async(contents, generation_config=self._config(n), request_options=self._options(timeout)))
+        except Exception as e:
+            raise _map_error(e)
 
-        except genai.types.BlockedPromptException as e:
-            raise BadRequestError(str(e))
-        except gax.ResourceExhausted as e: 
-            raise RateLimited(str(e))
-        except gax.DeadlineExceeded as e:  
-            raise UpstreamTimeout(str(e))
-        except gax.Unauthenticated as e:
-            raise AuthError(str(e))
-        except gax.PermissionDenied as e:
-            raise PermissionError(str(e))
-        except gax.InvalidArgument as e:
-            raise BadRequestError(str(e))
-        except gax.ServiceUnavailable as e:
-            raise Unavailable(str(e))
-        except gax.GoogleAPICallError as e:
-            raise ProviderError(str(e))
+    def chat(self, topic: str, stance: str, history: List[Dict[str, str]], user_msg: str, summary: str = "", timeout: float | None = None) -> str:
+        # Single call; repairs are budgeted by the service (api.generation)
+        text = self.candidates(topic, stance, history, user_msg, 1, summary, timeout)[0]
+        body, ok = strip_tag_and_check(text, stance)
+        return f"[[STANCE:{stance}]] {body.strip()}" if ok else text
+
+    async def achat(self, topic: str, stance: str, history: List[Dict[str, str]], user_msg: str, summary: str = "", timeout: float | None = None) -> str:
+        text = (await self.acandidates(topic, stance, history, user_msg, 1, summary, timeout))[0]
+        body, ok = strip_tag_and_check(text, stance)
+        return f"[[STANCE:{stance}]] {body.strip()}" if ok else text
+
+    async def astream(self, topic: str, stance: str, history: List[Dict[str, str]], user_msg: str, summary: str = "", timeout: float | None = None) -> AsyncIterator[str]:
+        # No marker-repair loop here: the service normalizes the marker incrementally.
+        contents = self._contents(topic, stance, history, user_msg, summary)
+        model = self._model_for(topic, stance)
+        try:
+            resp = await model.generate_content_async(contents, generation_config=self._config(), request_options=self._options(timeout), stream=True)
+            last = None
+            async for chunk in resp:
+                last = chunk
+                parts = chunk.candidates[0].content.parts if chunk.candidates else []
+                text = "".join(getattr(p, "text", "") for p in parts)
+                if text:
+                    yield text
+            # Usage is cumulative: the final chunk holds the totals
+            self._record_usage(last)
         except Exception as e:
-            raise ProviderError(str(e))
+            raise _map_error(e)
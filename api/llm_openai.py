@@ -1,101 +1,157 @@
-from typing import List, Dict, Tuple
-import re
-from openai import OpenAI
+from typing import List, Dict, AsyncIterator
+import os
+import httpx
+from openai import OpenAI, AsyncOpenAI, NOT_GIVEN
 import openai as openai_pkg
 
+from api.context import ContextBuilder
+from api.postprocess import strip_tag_and_check
+from api import tracing
+from api.prompts import PromptUsage, prefix_key, system_prompt
 from api.errors import (
     ProviderError, RateLimited, AuthError, PermissionError,
     BadRequestError, UpstreamTimeout, Unavailable, UpstreamNetwork,
 )
+from api.limits import parse_duration
 
-# Prompt contract: single role + hard caps to keep the model on-rails.
-SYSTEM_TEMPLATE = (
-    "Role: debate bot.\n"
-    "Fixed topic: '{topic}'.\n"
-    "Your FIXED stance: '{stance}'. NEVER change it.\n"
-    "Mandatory rules:\n"
-    "1) Always start with the exact line: [[STANCE:{stance}]]\n"
-    "2) Consistently defend that stance in every turn.\n"
-    "3) Be respectful and persuasive; use evidence, analogies, and questions.\n"
-    "4) Max 180 words. Stay strictly on topic.\n"
-    "Write the answer in English."
-)
-
-# Extra guardrail to avoid malformed stance tokens from the model.
-GUARD_TEMPLATE = (
-    "Critical guard: The stance marker MUST be exactly one of: [[STANCE:pro]] or [[STANCE:contra]]. "
-    "Any other token (e.g., [[STANCE:st]]) is invalid and you must rewrite immediately."
-)
+def _retry_after(e: Exception) -> float | None:
+    response = getattr(e, "response", None)
+    return parse_duration(response.headers.get("retry-after")) if response is not None else None
 
-def _strip_tag_and_check(text: str, stance: str) -> Tuple[str, bool]:
-    text = (text or "").strip()
-    m = re.match(r"\s*\[\[STANCE\s*:\s*(pro|contra)\s*\]\]\s*", text, re.I)
-    declared = m.group(1).lower() if m else None
-    body = text[m.end():].lstrip() if m else text
-    ok = (declared == stance)
-    return body, ok
+# Error mapping: convert OpenAI SDK exceptions to our domain errors.
+def _map_error(e: Exception) -> ProviderError:
+    if isinstance(e, ProviderError):
+        return e
+    if isinstance(e, openai_pkg.RateLimitError):
+        return RateLimited(str(e), retry_after=_retry_after(e))
+    if isinstance(e, openai_pkg.AuthenticationError):
+        return AuthError(str(e))
+    if isinstance(e, openai_pkg.PermissionDeniedError):
+        return PermissionError(str(e))
+    if isinstance(e, openai_pkg.BadRequestError):
+        return BadRequestError(str(e))
+    if isinstance(e, openai_pkg.APITimeoutError):
+        return UpstreamTimeout(str(e))
+    if isinstance(e, openai_pkg.APIConnectionError):
+        return UpstreamNetwork(str(e))
+    if isinstance(e, openai_pkg.APIStatusError):
+        sc = getattr(e, "status_code", None)
+        if sc == 429: return RateLimited(str(e), retry_after=_retry_after(e))
+        if sc == 401: return AuthError(str(e))
+        if sc == 403: return PermissionError(str(e))
+        if sc in (500, 502): return Unavailable(str(e))
+        if sc == 503: return Unavailable(str(e))
+        if sc == 504: return UpstreamTimeout(str(e))
+    return ProviderError(str(e))
 
 class OpenAILLM:
-    def __init__(self, api_key: str, model: str = "gpt-4o-mini"):
-        self.client = OpenAI(api_key=api_key)
+    def __init__(
+        self,
+        api_key: str,
+        model: str = "gpt-4o-mini",
+        base_url: str | None = None,
+        http_client: httpx.Client | None = None,
+        async_http_client: httpx.AsyncClient | None = None,
+        timeout: httpx.Timeout | float | None = None,
+    ):
+        # http_client/async_http_client: shared pools from api.transport (None = SDK default)
+        self.base_url = base_url or os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+        tmo = timeout if timeout is not None else NOT_GIVEN
+        self.client = OpenAI(api_key=api_key, base_url=self.base_url, http_client=http_client, timeout=tmo, max_retries=0)
+        self.aclient = AsyncOpenAI(api_key=api_key, base_url=self.base_url, http_client=async_http_client, timeout=tmo, max_retries=0)
         self.model = model
+        # Read timeout the deadline is clamped to (retries live in api.deadline, not the SDK)
+        self.timeout_s = timeout.read if isinstance(timeout, httpx.Timeout) else timeout
+        # Token budget for history (CONTEXT_BUDGET[_OPENAI]); the rest goes into the summary
+        self.context = ContextBuilder("openai", model)
+        # Prompt / cached / completion tokens reported by the API
+        self.usage = PromptUsage("openai", model)
+        self.cache_key = os.getenv("OPENAI_PROMPT_CACHE_KEY", "1") == "1"
 
-    def chat(self, topic: str, stance: str, history: List[Dict[str, str]], user_msg: str) -> str:
-        msgs = [
-            {"role": "system", "content": SYSTEM_TEMPLATE.format(topic=topic, stance=stance)},
-            {"role": "system", "content": GUARD_TEMPLATE},
-            {"role": "system", "content": "Always answer in English. If the user asks to change language, politely refuse and continue in English."},
-        ]
+    @tracing.traced("prompt")
+    def _messages(self, topic: str, stance: str, history: List[Dict[str, str]], user_msg: str, summary: str = "") -> List[Dict[str, str]]:
+        # Stable prefix first (provider prompt caching); everything that changes goes after it
+        msgs = [{"role": "system", "content": system_prompt(topic, stance)}]
+        summary_text, history = self.context.build(history, user_msg, summary)
         for m in history:
             role = "assistant" if m["role"] == "bot" else "user"
             msgs.append({"role": role, "content": m["message"]})
+        if summary_text:
+            msgs.append({"role": "system", "content": summary_text})
         msgs.append({"role": "user", "content": user_msg})
+        return msgs
+
+    def _record_usage(self, usage) -> None:
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        self.usage.record(usage.prompt_tokens, getattr(details, "cached_tokens", None), usage.completion_tokens)
+
+    def _cache_args(self, topic: str, stance: str) -> Dict[str, str]:
+        # Requests sharing a prefix land on the same cache shard
+        return {"prompt_cache_key": prefix_key(topic, stance)} if self.cache_key else {}
+
+    def _timeout_args(self, timeout: float | None) -> Dict[str, float]:
+        # Remaining turn budget, never above the configured read timeout
+        if timeout is None:
+            return {}
+        return {"timeout": timeout if self.timeout_s is None else min(timeout, self.timeout_s)}
+
+    def _create_args(self, topic: str, stance: str, msgs: List[Dict[str, str]], n: int = 1, timeout: float | None = None) -> Dict[str, object]:
+        args = dict(model=self.model, messages=msgs, temperature=0.5, max_tokens=256,
+                    **self._cache_args(topic, stance), **self._timeout_args(timeout))
+        if n > 1:
+            args["n"] = n
+        return args
+
+    def _texts(self, comp) -> List[str]:
+        self._record_usage(comp.usage)
+        return [(c.message.content or "").strip() for c in comp.choices]
 
+    def candidates(self, topic: str, stance: str, history: List[Dict[str, str]], user_msg: str, n: int = 1, summary: str = "", timeout: float | None = None) -> List[str]:
+        # n choices share one prompt (and one prompt-token bill); the service picks one
+        msgs = self._messages(topic, stance, history, user_msg, summary)
         try:
-            last_text = ""
-            for _ in range(2):
-                comp = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=msgs,
-                    temperature=0.5,
-                    max_tokens=256,
-                )
-                text = (comp.choices[0].message.content or "").strip()
-                last_text = text
-                body, ok = _strip_tag_and_check(text, stance)
-                if ok:
-                    return f"[[STANCE:{stance}]] {body.strip()}"
+            return self._texts(self.client.chat.completions.create(**self._create_args(topic, stance, msgs, n, timeout)))
+        except Exception as e:
+            raise _map_error(e)
 
-                msgs.append({
-                    "role": "user",
-                    "content": (
-                        f"Your previous reply did not start with the exact marker or used the wrong one. "
-                        f"Rewrite in ENGLISH, do not change topic or stance, and START with [[STANCE:{stance}]]. "
-                        f"Keep it under 180 words. Stay on the original topic."
-                    ),
-                })
-            return last_text.strip()
-# Error mapping: convert OpenAI SDK exceptions to our domain errors.
-        except openai_pkg.RateLimitError as e:
-            raise RateLimited(str(e))
-        except openai_pkg.AuthenticationError as e:
-            raise AuthError(str(e))
-        except openai_pkg.PermissionDeniedError as e:
-            raise PermissionError(str(e))
-        except openai_pkg.BadRequestError as e:
-            raise BadRequestError(str(e))
-        except openai_pkg.APITimeoutError as e:
-            raise UpstreamTimeout(str(e))
-        except openai_pkg.APIConnectionError as e:
-            raise UpstreamNetwork(str(e))
-        except openai_pkg.APIStatusError as e:
-            sc = getattr(e, "status_code", None)
-            if sc == 429: raise RateLimited(str(e))
-            if sc == 401: raise AuthError(str(e))
-            if sc == 403: raise PermissionError(str(e))
-            if sc in (500, 502): raise Unavailable(str(e))
-            if sc == 503: raise Unavailable(str(e))
-            if sc == 504: raise UpstreamTimeout(str(e))
-            raise ProviderError(str(e))
+    async def acandidates(self, topic: str, stance: str, history: List[Dict[str, str]], user_msg: str, n: int = 1, summary: str = "", timeout: float | None = None) -> List[str]:
+        msgs = self._messages(topic, stance, history, user_msg, summary)
+        try:
+            return self._texts(await self.aclient.chat.completions.create(**self._create_args(topic, stance, msgs, n, timeout)))
+        except Exception as e:
+            raise _map_error(e)
+
+    def chat(self, topic: str, stance: str, history: List[Dict[str, str]], user_msg: str, summary: str = "", timeout: float | None = None) -> str:
+        # Single call; repairs are budgeted by the service (api.generation)
+        text = self.candidates(topic, stance, history, user_msg, 1, summary, timeout)[0]
+        body, ok = strip_tag_and_check(text, stance)
+        return f"[[STANCE:{stance}]] {body.strip()}" if ok else text
+
+    async def achat(self, topic: str, stance: str, history: List[Dict[str, str]], user_msg: str, summary: str = "", timeout: float | None = None) -> str:
+        text = (await self.acandidates(topic, stance, history, user_msg, 1, summary, timeout))[0]
+        body, ok = strip_tag_and_check(text, stance)
+        return f"[[STANCE:{stance}]] {body.strip()}" if ok else text
+
+    async def astream(self, topic: str, stance: str, history: List[Dict[str, str]], user_msg: str, summary: str = "", timeout: float | None = None) -> AsyncIterator[str]:
+        # No marker-repair loop here: the service normalizes the marker incrementally.
+        msgs = self._messages(topic, stance, history, user_msg, summary)
+        try:
+            stream = await self.aclient.chat.completions.create(
+                model=self.model,
+                messages=msgs,
+                temperature=0.5,
+                max_tokens=256,
+                stream=True,
+                stream_options={"include_usage": True},
+                **self._cache_args(topic, stance),
+                **self._timeout_args(timeout),
+            )
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    self._record_usage(chunk.usage)   # last chunk, no choices
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
         except Exception as e:
-            raise ProviderError(str(e))
+            raise _map_error(e)
@@ -0,0 +1,241 @@
+# api/metrics.py
+"""
+Process metrics in the Prometheus text exposition format (GET /metrics).
+
+No client library and no locks on the hot path: every metric keeps one dict
+per thread, so a writer only ever touches its own shard (asyncio tasks share
+the loop thread's shard, and never yield in the middle of an update). The
+scrape merges the shards. Values are per process; with several uvicorn
+workers each one reports its own.
+"""
+import time
+from bisect import bisect_left
+from threading import get_ident
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from api.errors import ProviderError
+
+Labels = Tuple[str, ...]
+
+# Seconds: provider round trips run from ~100 ms to tens of seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Store operations: memory is microseconds, a DB commit milliseconds
+STORE_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._shards: Dict[int, Dict[Labels, object]] = {}
+
+    def _shard(self) -> Dict[Labels, object]:
+        shard = self._shards.get(get_ident())
+        if shard is None:
+            shard = self._shards.setdefault(get_ident(), {})
+        return shard
+
+    def _label_str(self, values: Labels, extra: str = "") -> str:
+        pairs = [f'{k}="{_escape(str(v))}"' for k, v in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def _merged(self) -> Dict[Labels, object]:
+        out: Dict[Labels, object] = {}
+        for shard in list(self._shards.values()):
+            for key, value in list(shard.items()):
+                out[key] = self._add(out.get(key), value)
+        return out
+
+    @staticmethod
+    def _add(a, b):
+        return b if a is None else a + b
+
+    def samples(self) -> Iterator[str]:
+        for key, value in sorted(self._merged().items()):
+            yield f"{self.name}{self._label_str(key)} {_fmt(value)}"
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._merged().get(labels, 0)
+
+
+class Gauge(Counter):
+    """Up/down value; inc and dec may happen on different threads (shards sum up)."""
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: str) -> None:
+        shard = self._shard()
+        row = shard.get(labels)
+        if row is None:
+            # Per-bucket counts (last one is +Inf), then the sum
+            row = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        row[bisect_left(self.buckets, value)] += 1
+        row[-1] += value
+
+    @staticmethod
+    def _add(a, b):
+        return list(b) if a is None else [x + y for x, y in zip(a, b)]
+
+    def count(self, *labels: str) -> int:
+        row = self._merged().get(labels)
+        return sum(row[:-1]) if row else 0
+
+    def samples(self) -> Iterator[str]:
+        for key, row in sorted(self._merged().items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), row):
+                cumulative += n
+                le = 'le="%s"' % _fmt(bound)
+                yield f"{self.name}_bucket{self._label_str(key, le)} {cumulative}"
+            yield f"{self.name}_sum{self._label_str(key)} {_fmt(row[-1])}"
+            yield f"{self.name}_count{self._label_str(key)} {cumulative}"
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: List[_Metric] = []
+
+    def add(self, metric: _Metric) -> _Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+TURN_SECONDS = REGISTRY.add(Histogram("rickbot_turn_seconds", "Whole debate turn, by path (sync, async, stream).", ("path",)))
+TURNS_IN_FLIGHT = REGISTRY.add(Gauge("rickbot_turns_in_flight", "Turns being served right now, by path.", ("path",)))
+PROVIDER_SECONDS = REGISTRY.add(Histogram(
+    "rickbot_provider_request_seconds",
+    "One provider call (one attempt), by provider, model and outcome (ok, error, cancelled).",
+    ("provider", "model", "outcome"),
+))
+PROVIDER_IN_FLIGHT = REGISTRY.add(Gauge("rickbot_provider_requests_in_flight", "Provider calls awaiting an answer.", ("provider",)))
+PROVIDER_ERRORS = REGISTRY.add(Counter("rickbot_provider_errors_total", "Provider failures by ProviderError subclass.", ("provider", "error")))
+RETRIES = REGISTRY.add(Counter(
+    "rickbot_retries_total",
+    "Extra provider calls, by reason: upstream (retryable error), not_english, empty.",
+    ("provider", "reason"),
+))
+TOKENS = REGISTRY.add(Counter(
+    "rickbot_tokens_total",
+    "Tokens from the providers' usage fields, by kind (prompt, cached_prompt, completion).",
+    ("provider", "model", "kind"),
+))
+STORE_SECONDS = REGISTRY.add(Histogram(
+    "rickbot_store_op_seconds", "Conversation store calls, by backend and operation.", ("backend", "op"), STORE_BUCKETS,
+))
+
+
+class timed:
+    """Times a block into `histogram` (labels...); usable around sync code and awaits alike."""
+
+    __slots__ = ("histogram", "labels", "t0")
+
+    def __init__(self, histogram: Histogram, *labels: str) -> None:
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self) -> "timed":
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.histogram.observe(time.perf_counter() - self.t0, *self.labels)
+
+
+class in_flight(timed):
+    """timed + a gauge raised for the duration of the block."""
+
+    __slots__ = ("gauge",)
+
+    def __init__(self, histogram: Histogram, gauge: Gauge, *labels: str) -> None:
+        super().__init__(histogram, *labels)
+        self.gauge = gauge
+
+    def __enter__(self) -> "in_flight":
+        self.gauge.inc(*self.labels)
+        return super().__enter__()
+
+    def __exit__(self, *exc) -> None:
+        super().__exit__(*exc)
+        self.gauge.dec(*self.labels)
+
+
+class provider_call:
+    """One provider attempt: in-flight gauge, latency by outcome, errors by ProviderError subclass."""
+
+    __slots__ = ("provider", "model", "t0")
+
+    def __init__(self, provider: str, model: str) -> None:
+        self.provider = provider
+        self.model = model
+
+    def __enter__(self) -> "provider_call":
+        PROVIDER_IN_FLIGHT.inc(self.provider)
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type: Optional[type], exc, tb) -> None:
+        elapsed = time.perf_counter() - self.t0
+        PROVIDER_IN_FLIGHT.dec(self.provider)
+        if exc_type is None or issubclass(exc_type, GeneratorExit):
+            outcome = "ok"   # GeneratorExit: the consumer stopped reading (word limit)
+        elif not issubclass(exc_type, Exception):
+            outcome = "cancelled"   # hedge loser, deadline (wait_for), client gone
+        else:
+            outcome = "error"
+            error(self.provider, exc)
+        PROVIDER_SECONDS.observe(elapsed, self.provider, self.model, outcome)
+
+
+def error(provider: str, exc: BaseException) -> None:
+    name = type(exc).__name__ if isinstance(exc, ProviderError) else "Other"
+    PROVIDER_ERRORS.inc(provider, name)
+
+
+def render() -> str:
+    return REGISTRY.render()
@@ -1,10 +1,28 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, scoped_session, declarative_base
 
-DB_URL = os.getenv("DB_URL", "sqlite:///./conversations.db")
+# docker-compose / .env use DATABASE_URL; DB_URL wins if both are set
+DB_URL = os.getenv("DB_URL") or os.getenv("DATABASE_URL") or "sqlite:///./conversations.db"
+IS_SQLITE = DB_URL.startswith("sqlite")
 
-connect_args = {"check_same_thread": False} if DB_URL.startswith("sqlite") else {}
+# SQLite production profile: WAL lets readers run alongside the single writer,
+# synchronous=NORMAL is durable across app crashes in WAL mode (set
+# SQLITE_SYNCHRONOUS=FULL to also survive power loss), and busy_timeout makes
+# other processes wait for the write lock instead of failing "database is locked".
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    f"PRAGMA synchronous={os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')}",
+    f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+    f"PRAGMA mmap_size={int(os.getenv('SQLITE_MMAP_BYTES', str(256 << 20)))}",
+    # Negative cache_size is in KiB
+    f"PRAGMA cache_size=-{int(os.getenv('SQLITE_CACHE_KB', '65536'))}",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA foreign_keys=ON",
+)
+
+connect_args = {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000} if IS_SQLITE else {}
 engine = create_engine(
     DB_URL,
     echo=False,
@@ -13,5 +31,13 @@ engine = create_engine(
     connect_args=connect_args,
 )
 
+if IS_SQLITE:
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        for pragma in SQLITE_PRAGMAS:
+            cur.execute(pragma)
+        cur.close()
+
 SessionLocal = scoped_session(sessionmaker(bind=engine, autocommit=False, autoflush=False, future=True))
 Base = declarative_base()
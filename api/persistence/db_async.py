@@ -0,0 +1,51 @@
+import os
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from .db import DB_URL, SQLITE_BUSY_TIMEOUT_MS, SQLITE_PRAGMAS
+
+# Sync URL -> async driver: aiosqlite locally, asyncpg in production
+_ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+}
+
+
+def async_url(url: str) -> str:
+    scheme, sep, rest = url.partition("://")
+    if "+" in scheme:
+        # Explicit driver (e.g. postgresql+psycopg): keep the dialect, swap the driver
+        scheme = scheme.split("+", 1)[0]
+    return _ASYNC_DRIVERS.get(scheme, scheme) + sep + rest
+
+
+def make_async_engine(url: str = DB_URL) -> AsyncEngine:
+    """
+    Pool sized for the event loop: DB_POOL_SIZE connections kept open,
+    DB_MAX_OVERFLOW extra under bursts, and DB_POOL_TIMEOUT seconds to wait
+    for one before failing the request.
+    """
+    url = async_url(url)
+    is_sqlite = url.startswith("sqlite")
+    kwargs = {"echo": False, "pool_pre_ping": True}
+    if ":memory:" not in url and url.rstrip("/") != "sqlite+aiosqlite:":
+        kwargs.update(
+            pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
+            max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "20")),
+            pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+            pool_recycle=int(os.getenv("DB_POOL_RECYCLE_S", "1800")),
+        )
+    if is_sqlite:
+        kwargs["connect_args"] = {"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}
+    engine = create_async_engine(url, **kwargs)
+
+    if is_sqlite:
+        @event.listens_for(engine.sync_engine, "connect")
+        def _sqlite_pragmas(dbapi_conn, _record):
+            cur = dbapi_conn.cursor()
+            for pragma in SQLITE_PRAGMAS:
+                cur.execute(pragma)
+            cur.close()
+
+    return engine
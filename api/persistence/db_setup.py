@@ -1,16 +1,46 @@
 # db_setup.py
+import json
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
+from sqlalchemy import insert, inspect, text
+
 from api.persistence.db import engine
-from api.persistence.models import Base
+from api.persistence.models import Base, Message
+
+def migrate_legacy_history():
+    """
+    Migra bases creadas antes de la tabla `messages`: añade
+    conversations.message_count / summary y copia el JSON `history` a filas.
+    """
+    cols = {c["name"] for c in inspect(engine).get_columns("conversations")}
+    with engine.begin() as conn:
+        if "message_count" not in cols:
+            conn.execute(text("ALTER TABLE conversations ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0"))
+        if "summary" not in cols:
+            conn.execute(text("ALTER TABLE conversations ADD COLUMN summary TEXT"))
+        rows = conn.execute(text(
+            "SELECT id, history FROM conversations c WHERE message_count = 0 "
+            "AND NOT EXISTS (SELECT 1 FROM messages m WHERE m.conversation_id = c.id)"
+        )).all()
+        for cid, history in rows:
+            if isinstance(history, str):
+                history = json.loads(history)
+            if not history:
+                continue
+            conn.execute(
+                insert(Message),
+                [{"conversation_id": cid, "seq": i + 1, "role": m["role"], "text": m["message"]} for i, m in enumerate(history)],
+            )
+            conn.execute(text("UPDATE conversations SET message_count = :n WHERE id = :cid"), {"n": len(history), "cid": cid})
 
 def create_db_tables():
     """Crea las tablas de la base de datos."""
     print("Creating database tables...")
     Base.metadata.create_all(bind=engine)
+    migrate_legacy_history()
     print("Tables created successfully!")
 
 if __name__ == "__main__":
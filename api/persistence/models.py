@@ -1,7 +1,7 @@
 # api/persistence/models.py
 from datetime import datetime
 from sqlalchemy.orm import mapped_column, Mapped
-from sqlalchemy import String, Text, DateTime
+from sqlalchemy import String, Text, DateTime, Integer, ForeignKey
 
 try:
     from sqlalchemy import JSON
@@ -20,7 +20,27 @@ class Conversation(Base):
     stance: Mapped[str] = mapped_column(String(10), nullable=False)     
     provider: Mapped[str] = mapped_column(String(20), nullable=False)
 
+    # Legacy blob from before the messages table; no longer written (see db_setup)
     history: Mapped[list] = mapped_column(JSON, nullable=False, default=list)
+    # Highest Message.seq; bumped atomically by the upsert that appends a turn
+    message_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+    # Rolling summary of the messages that left the context window (api.context.fold)
+    summary: Mapped[str | None] = mapped_column(Text, nullable=True)
 
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class Message(Base):
+    __tablename__ = "messages"
+
+    # (conversation_id, seq) is the primary key, so it doubles as the ordered index
+    conversation_id: Mapped[str] = mapped_column(
+        String(32), ForeignKey("conversations.id", ondelete="CASCADE"), primary_key=True
+    )
+    seq: Mapped[int] = mapped_column(Integer, primary_key=True)
+
+    role: Mapped[str] = mapped_column(String(8), nullable=False)
+    text: Mapped[str] = mapped_column(Text, nullable=False)
+
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
@@ -1,51 +1,278 @@
+import asyncio
 import uuid
-from typing import Optional
-from sqlalchemy import select
-from sqlalchemy.exc import SQLAlchemyError
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import insert, select, true, update
+from sqlalchemy.engine import Connection
+
+from .db import engine
+from .models import Conversation, Message
+from .writer import GroupCommitWriter
+from api.storage_memory import ConversationState
+
+
+def upsert_insert(dialect: str):
+    """Native INSERT ... ON CONFLICT for SQLite/PostgreSQL; None elsewhere."""
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        return None
+    return dialect_insert
+
+
+def load_stmt(cid: str, limit: int):
+    """Conversation row LEFT JOINed with its last `limit` messages: one round trip."""
+    recent = (
+        select(Message.seq, Message.role, Message.text)
+        .where(Message.conversation_id == cid)
+        .order_by(Message.seq.desc())
+        .limit(limit)
+        .subquery()
+    )
+    return (
+        select(Conversation.topic, Conversation.stance, Conversation.provider, Conversation.history,
+               Conversation.summary, Conversation.message_count, recent.c.seq, recent.c.role, recent.c.text)
+        .select_from(Conversation)
+        .outerjoin(recent, true())
+        .where(Conversation.id == cid)
+    )
+
+
+def rows_to_state(rows, limit: int) -> Optional[ConversationState]:
+    if not rows:
+        return None
+    first = rows[0]
+    msgs = sorted((r for r in rows if r.seq is not None), key=lambda r: r.seq)
+    history = [{"role": r.role, "message": r.text} for r in msgs]
+    if not history and first.history:
+        # Conversation written before the messages table existed
+        history = list(first.history)[-limit:]
+    state: ConversationState = {
+        "topic": first.topic,
+        "stance": first.stance,
+        "provider": first.provider,
+        "history": history,
+    }
+    if first.summary:
+        state["summary"] = first.summary
+    state["message_count"] = max(first.message_count or 0, msgs[-1].seq if msgs else len(history))
+    return state
+
+
+def page_stmt(cid: str, before: Optional[int], limit: int):
+    """
+    Keyset page of the transcript: the `limit` messages right before seq
+    `before` (newest page when None), walking the (conversation_id, seq) key.
+    Joined to the conversation row so an unknown id is told apart from an
+    empty page in the same round trip.
+    """
+    page = select(Message.seq, Message.role, Message.text).where(Message.conversation_id == cid)
+    if before is not None:
+        page = page.where(Message.seq < before)
+    page = page.order_by(Message.seq.desc()).limit(limit).subquery()
+    return (
+        select(Conversation.id, page.c.seq, page.c.role, page.c.text)
+        .select_from(Conversation)
+        .outerjoin(page, true())
+        .where(Conversation.id == cid)
+    )
+
+
+def rows_to_page(rows) -> Optional[List[Dict]]:
+    if not rows:
+        return None
+    msgs = sorted((r for r in rows if r.seq is not None), key=lambda r: r.seq)
+    return [{"seq": r.seq, "role": r.role, "message": r.text} for r in msgs]
+
+
+def append_stmts(dialect_insert, cid: str, state: ConversationState, messages: List[Dict[str, str]]):
+    """(upsert RETURNING message_count, rows(last_seq) -> message rows)."""
+    now = datetime.utcnow()
+    n = len(messages)
+    upsert = dialect_insert(Conversation).values(
+        id=cid,
+        topic=state["topic"],
+        stance=state["stance"],
+        provider=state["provider"],
+        history=[],
+        message_count=n,
+        summary=state.get("summary"),
+        created_at=now,
+        updated_at=now,
+    )
+    upsert = upsert.on_conflict_do_update(
+        index_elements=[Conversation.id],
+        set_={"message_count": Conversation.message_count + n, "summary": upsert.excluded.summary, "updated_at": now},
+    ).returning(Conversation.message_count)
+
+    def rows(last: int) -> List[Dict]:
+        return [
+            {"conversation_id": cid, "seq": last - n + i + 1, "role": m["role"], "text": m["message"], "created_at": now}
+            for i, m in enumerate(messages)
+        ]
+    return upsert, (rows if messages else None)
+
+
+def _meta(state: ConversationState, now: datetime) -> Dict[str, object]:
+    return {
+        "topic": state["topic"],
+        "stance": state["stance"],
+        "provider": state["provider"],
+        "summary": state.get("summary"),
+        "updated_at": now,
+    }
+
+
+def _message_rows(cid: str, first_seq: int, messages: List[Dict[str, str]], now: datetime) -> List[Dict]:
+    return [
+        {"conversation_id": cid, "seq": first_seq + i, "role": m["role"], "text": m["message"], "created_at": now}
+        for i, m in enumerate(messages)
+    ]
+
+
+def append_op(dialect_insert, cid: str, state: ConversationState, messages: List[Dict[str, str]]):
+    """
+    Connection -> None that persists one turn after the last seq. One upsert
+    where the dialect has it; elsewhere UPDATE the row (INSERT it when new)
+    and read the bumped message_count back.
+    """
+    if dialect_insert is not None:
+        upsert, rows = append_stmts(dialect_insert, cid, state, messages)
+
+        def op(conn: Connection) -> None:
+            last = conn.execute(upsert).scalar_one()
+            if rows:
+                conn.execute(insert(Message), rows(last))
+        return op
+
+    now = datetime.utcnow()
+    n = len(messages)
+
+    def op(conn: Connection) -> None:
+        bump = (
+            update(Conversation)
+            .where(Conversation.id == cid)
+            .values(message_count=Conversation.message_count + n, summary=state.get("summary"), updated_at=now)
+        )
+        if conn.execute(bump).rowcount:
+            last = conn.execute(select(Conversation.message_count).where(Conversation.id == cid)).scalar_one()
+        else:
+            conn.execute(insert(Conversation).values(id=cid, history=[], message_count=n, created_at=now, **_meta(state, now)))
+            last = n
+        if messages:
+            conn.execute(insert(Message), _message_rows(cid, last - n + 1, messages, now))
+    return op
+
+
+def set_op(cid: str, state: ConversationState):
+    """
+    Connection -> None for a whole-state write that never rewrites the
+    transcript: upserts the conversation row and inserts only the messages
+    the table does not have yet. state["history"] is the newest tail of the
+    transcript and state["message_count"] the seq of its last message
+    (len(history) for a state that never had one), so the missing messages
+    are the ones past the stored message_count. Lined up by position, not
+    by text: repeated messages (the canned fallback, "Why?") are common.
+    """
+    history = list(state["history"] or [])
+    total = state.get("message_count", len(history))
+    now = datetime.utcnow()
+
+    def op(conn: Connection) -> None:
+        if conn.execute(update(Conversation).where(Conversation.id == cid).values(**_meta(state, now))).rowcount:
+            last = conn.execute(select(Conversation.message_count).where(Conversation.id == cid)).scalar_one()
+        else:
+            conn.execute(insert(Conversation).values(id=cid, history=[], message_count=0, created_at=now, **_meta(state, now)))
+            last = 0
+        if total <= last:
+            return   # nothing newer than what is stored (a stale or repeated write)
+        new = history[len(history) - min(len(history), total - last):]
+        if new:
+            conn.execute(insert(Message), _message_rows(cid, total - len(new) + 1, new, now))
+        conn.execute(update(Conversation).where(Conversation.id == cid).values(message_count=total))
+    return op
+
 
-from .db import SessionLocal
-from .models import Conversation
-from api.storage_memory import ConversationState  
 class DBConversationStore:
+    """
+    Conversation metadata lives in `conversations`, every message is one row
+    in `messages` keyed by (conversation_id, seq).
+
+    - get(): one SELECT joining the metadata with the last `history_limit` rows;
+      aget() runs it in a worker thread for the async endpoints.
+    - append(): one upsert bumping message_count (RETURNING the new value),
+      then an INSERT of just the new rows. Cost per turn does not grow with
+      the conversation length.
+    - set(): for callers that only know whole states; upserts the row and
+      inserts the messages it is missing, older rows are never touched.
+    - messages(): keyset pages over the whole transcript, which is never
+      trimmed; only get() is limited to the context window.
+
+    Writes run on a Connection inside one transaction, either directly or
+    through a GroupCommitWriter; `aappend` waits for the commit without
+    blocking the event loop.
+    """
+
+    def __init__(self, history_limit: int = 10, writer: Optional[GroupCommitWriter] = None) -> None:
+        self.history_limit = history_limit
+        # Optional group-commit writer: batches commits from many conversations
+        self.writer = writer
+        self._insert = upsert_insert(engine.dialect.name)
+
     def new_id(self) -> str:
         return uuid.uuid4().hex
 
     def get(self, cid: str) -> Optional[ConversationState]:
-        session = SessionLocal()
-        try:
-            row = session.get(Conversation, cid)
-            if not row:
-                return None
-            return {
-                "topic": row.topic,
-                "stance": row.stance,
-                "provider": row.provider,
-                "history": list(row.history or []),
-            }
-        finally:
-            session.close()
+        with engine.connect() as conn:
+            rows = conn.execute(load_stmt(cid, self.history_limit)).all()
+        return rows_to_state(rows, self.history_limit)
+
+    async def aget(self, cid: str) -> Optional[ConversationState]:
+        # A slow read must not stall every other turn on the event loop
+        return await asyncio.to_thread(self.get, cid)
+
+    def messages(self, cid: str, before: Optional[int] = None, limit: int = 50) -> Optional[List[Dict]]:
+        """Full-transcript page, oldest first; None if the conversation does not exist."""
+        with engine.connect() as conn:
+            return rows_to_page(conn.execute(page_stmt(cid, before, limit)).all())
+
+    def _write(self, op) -> None:
+        if self.writer is not None:
+            self.writer.write(op)
+            return
+        with engine.begin() as conn:
+            op(conn)
+
+    async def _awrite(self, op) -> None:
+        if self.writer is not None:
+            # Wait for the group commit without blocking the event loop
+            await asyncio.wrap_future(self.writer.submit(op))
+            return
+        await asyncio.to_thread(self._write, op)
+
+    def append(self, cid: str, state: ConversationState, messages: List[Dict[str, str]]) -> None:
+        """Persists one turn: upsert the conversation row, insert only the new messages."""
+        self._write(append_op(self._insert, cid, state, messages))
+
+    async def aappend(self, cid: str, state: ConversationState, messages: List[Dict[str, str]]) -> None:
+        await self._awrite(append_op(self._insert, cid, state, messages))
 
     def set(self, cid: str, state: ConversationState) -> None:
-        session = SessionLocal()
-        try:
-            row = session.get(Conversation, cid)
-            if row is None:
-                row = Conversation(
-                    id=cid,
-                    topic=state["topic"],
-                    stance=state["stance"],
-                    provider=state["provider"],
-                    history=list(state["history"] or []),
-                )
-                session.add(row)
-            else:
-                row.topic = state["topic"]
-                row.stance = state["stance"]
-                row.provider = state["provider"]
-                row.history = list(state["history"] or [])
-            session.commit()
-        except SQLAlchemyError:
-            session.rollback()
-            raise
-        finally:
-            session.close()
+        self._write(set_op(cid, state))
+
+    def write_batch(self, items: List[Tuple[str, ConversationState, Optional[List[Dict[str, str]]]]]) -> None:
+        """
+        Persists many conversations in one transaction. Each item is
+        (cid, state, new_messages); new_messages=None writes the whole state (see set()).
+        """
+        ops = [
+            set_op(cid, state) if messages is None else append_op(self._insert, cid, state, messages)
+            for cid, state, messages in items
+        ]
+
+        def op(conn: Connection) -> None:
+            for each in ops:
+                each(conn)
+        self._write(op)
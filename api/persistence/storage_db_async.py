@@ -0,0 +1,62 @@
+import uuid
+from typing import Dict, List, Optional
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from .models import Base, Message
+from .storage_db import append_op, append_stmts, load_stmt, page_stmt, rows_to_page, rows_to_state, set_op, upsert_insert
+from api.storage_memory import ConversationState
+
+
+class AsyncDBConversationStore:
+    """
+    Same schema and contract as DBConversationStore (new_id/get/set/append),
+    but `get`, `set` and `append` are coroutines running on an async engine
+    (aiosqlite / asyncpg), so DB round trips never hold a worker thread.
+    """
+
+    def __init__(self, engine: AsyncEngine, history_limit: int = 10) -> None:
+        self.engine = engine
+        self.history_limit = history_limit
+        self._insert = upsert_insert(engine.dialect.name)
+
+    async def create_tables(self) -> None:
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    def new_id(self) -> str:
+        return uuid.uuid4().hex
+
+    async def get(self, cid: str) -> Optional[ConversationState]:
+        async with self.engine.connect() as conn:
+            rows = (await conn.execute(load_stmt(cid, self.history_limit))).all()
+        return rows_to_state(rows, self.history_limit)
+
+    async def messages(self, cid: str, before: Optional[int] = None, limit: int = 50) -> Optional[List[Dict]]:
+        async with self.engine.connect() as conn:
+            rows = (await conn.execute(page_stmt(cid, before, limit))).all()
+        return rows_to_page(rows)
+
+    async def append(self, cid: str, state: ConversationState, messages: List[Dict[str, str]]) -> None:
+        """Persists one turn: upsert the conversation row, insert only the new messages."""
+        if self._insert is None:
+            # No native upsert: the portable UPDATE-then-INSERT version
+            async with self.engine.begin() as conn:
+                await conn.run_sync(append_op(None, cid, state, messages))
+            return
+        upsert, rows = append_stmts(self._insert, cid, state, messages)
+        async with self.engine.begin() as conn:
+            last = (await conn.execute(upsert)).scalar_one()
+            if rows:
+                await conn.execute(insert(Message), rows(last))
+
+    async def set(self, cid: str, state: ConversationState) -> None:
+        """Upserts the row and inserts only the missing messages (see storage_db.set_op)."""
+        async with self.engine.begin() as conn:
+            await conn.run_sync(set_op(cid, state))
+
+    def pool_stats(self) -> Dict[str, object]:
+        return {"driver": self.engine.dialect.driver, "pool": self.engine.pool.status()}
+
+    async def aclose(self) -> None:
+        await self.engine.dispose()
@@ -0,0 +1,251 @@
+# api/persistence/storage_tiered.py
+"""
+Write-behind store: a bounded in-memory hot tier in front of DBConversationStore.
+
+- get(): served from the hot tier; on a miss, from the pending writes, then
+  read-through from the database (and cached).
+- append()/set(): update the hot tier and mark the conversation dirty; a
+  flusher thread persists every dirty conversation in one transaction each
+  `flush_interval` seconds. The database is off the turn's critical path.
+- Backpressure: at most `max_dirty` conversations wait for a flush. A new
+  conversation arriving past that bound kicks an early flush and waits for it.
+- Failed writes stay queued, ahead of newer turns, and keep their dirty slot
+  (so a database that keeps failing ends in backpressure, not lost turns);
+  past `max_attempts` they are logged as stuck and reported in stats().
+- close(): final flush, then stops the thread (call it on shutdown).
+
+Trade-off: a crash loses at most the last `flush_interval` of turns.
+"""
+import asyncio
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+
+from api.storage_memory import ConversationState, InMemoryConversationStore
+
+log = logging.getLogger(__name__)
+
+
+class _Pending:
+    """What the database is missing for one conversation."""
+    __slots__ = ("state", "messages", "attempts")
+
+    def __init__(self, state: ConversationState, messages: Optional[List[Dict[str, str]]]) -> None:
+        self.state = state
+        # New messages to append; None means "rewrite the whole state"
+        self.messages = messages
+        self.attempts = 0
+
+    def then(self, later: "_Pending") -> "_Pending":
+        """This (older) entry followed by `later`."""
+        if later.messages is None:
+            return later
+        msgs = None if self.messages is None else self.messages + later.messages
+        merged = _Pending(later.state, msgs)
+        merged.attempts = self.attempts
+        return merged
+
+
+def _snapshot(state: ConversationState) -> ConversationState:
+    return {**state, "history": list(state["history"])}
+
+
+class WriteBehindStore:
+    def __init__(
+        self,
+        backing,
+        hot: Optional[InMemoryConversationStore] = None,
+        flush_interval: float = 0.5,
+        max_dirty: int = 10000,
+        max_attempts: int = 5,
+    ) -> None:
+        self.backing = backing
+        self.hot = hot or InMemoryConversationStore()
+        self.flush_interval = flush_interval
+        self.max_dirty = max_dirty
+        self.max_attempts = max_attempts
+        self.flushes = 0
+        self.flushed = 0
+        self.failures = 0
+        self.stuck = 0
+        self.waits = 0
+        self.read_through = 0
+        self.last_error: Optional[str] = None
+        self._last_flush_s = 0.0
+        self._dirty: Dict[str, _Pending] = {}
+        self._inflight: Dict[str, _Pending] = {}
+        self._cond = threading.Condition()
+        self._kick = threading.Event()
+        # One flush at a time, so a conversation's writes land in order
+        self._flushing = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="db-write-behind", daemon=True)
+        self._thread.start()
+
+    def new_id(self) -> str:
+        return self.backing.new_id()
+
+    def get(self, cid: str) -> Optional[ConversationState]:
+        state = self.hot.get(cid)
+        if state is not None:
+            return state
+        with self._cond:
+            pending = self._dirty.get(cid) or self._inflight.get(cid)
+            if pending is not None:
+                state = _snapshot(pending.state)
+        if state is None:
+            state = self.backing.get(cid)
+            self.read_through += 1
+            if state is None:
+                return None
+        self.hot.set(cid, state)
+        return state
+
+    async def aget(self, cid: str) -> Optional[ConversationState]:
+        state = self.hot.get(cid)
+        if state is not None:
+            return state
+        return await asyncio.to_thread(self.get, cid)
+
+    def messages(self, cid: str, before: Optional[int] = None, limit: int = 50) -> Optional[List[Dict]]:
+        """Transcript page from the database; pending turns are flushed first so it is complete."""
+        self.flush()
+        return self.backing.messages(cid, before=before, limit=limit)
+
+    def _mark(self, cid: str, entry: _Pending, wait: bool) -> bool:
+        """Queues `entry`; False when the dirty set is full and wait=False."""
+        with self._cond:
+            while cid not in self._dirty and len(self._dirty) >= self.max_dirty:
+                if not wait:
+                    return False
+                self.waits += 1
+                self._kick.set()
+                self._cond.wait(self.flush_interval or 0.05)
+            old = self._dirty.get(cid)
+            self._dirty[cid] = old.then(entry) if old is not None else entry
+            return True
+
+    def append(self, cid: str, state: ConversationState, messages: List[Dict[str, str]]) -> None:
+        self.hot.set(cid, state)
+        self._mark(cid, _Pending(_snapshot(state), list(messages)), wait=True)
+
+    async def aappend(self, cid: str, state: ConversationState, messages: List[Dict[str, str]]) -> None:
+        self.hot.set(cid, state)
+        entry = _Pending(_snapshot(state), list(messages))
+        if not self._mark(cid, entry, wait=False):
+            # Dirty set full: wait for the flusher off the event loop
+            await asyncio.to_thread(self._mark, cid, entry, True)
+
+    def set(self, cid: str, state: ConversationState) -> None:
+        self.hot.set(cid, state)
+        self._mark(cid, _Pending(_snapshot(state), None), wait=True)
+
+    # Per-conversation turn locks come from the hot tier
+    @contextmanager
+    def lock(self, cid: str) -> Iterator[None]:
+        with self.hot.lock(cid):
+            yield
+
+    @asynccontextmanager
+    async def alock(self, cid: str) -> AsyncIterator[None]:
+        async with self.hot.alock(cid):
+            yield
+
+    def _run(self) -> None:
+        while True:
+            self._kick.wait(self.flush_interval)
+            self._kick.clear()
+            self.flush()
+            if self._closed:
+                return
+
+    def flush(self) -> None:
+        """Persists everything dirty right now (one transaction)."""
+        with self._flushing:
+            self._flush()
+
+    def _flush(self) -> None:
+        with self._cond:
+            if not self._dirty:
+                return
+            batch, self._dirty = self._dirty, {}
+            self._inflight = batch
+            self._cond.notify_all()
+        t0 = time.perf_counter()
+        try:
+            self.backing.write_batch([(cid, p.state, p.messages) for cid, p in batch.items()])
+        except Exception:
+            # One bad conversation must not hold back the rest: replay each on its own
+            failed = {}
+            for cid, pending in batch.items():
+                try:
+                    self.backing.write_batch([(cid, pending.state, pending.messages)])
+                except Exception as e:
+                    self.failures += 1
+                    self.last_error = repr(e)
+                    failed[cid] = pending
+                else:
+                    self.flushed += 1
+            self._requeue(failed)
+        else:
+            self.flushed += len(batch)
+        self.flushes += 1
+        self._last_flush_s = time.perf_counter() - t0
+        with self._cond:
+            self._inflight = {}
+            self._cond.notify_all()
+
+    def _requeue(self, batch: Dict[str, _Pending]) -> None:
+        # Failed entries go back in front of anything queued since. Never dropped:
+        # the turns were acknowledged, and a gap would shift every later seq.
+        with self._cond:
+            for cid, pending in batch.items():
+                pending.attempts += 1
+                if pending.attempts == self.max_attempts:
+                    self.stuck += 1
+                    log.error("write-behind: conversation %s failed %d flushes, still queued: %s",
+                              cid, pending.attempts, self.last_error)
+                newer = self._dirty.get(cid)
+                self._dirty[cid] = pending.then(newer) if newer is not None else pending
+
+    def close(self, timeout: float = 10.0) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._kick.set()
+        self._thread.join(timeout)
+        self.flush()
+        with self._cond:
+            lost = list(self._dirty)
+        for cid in lost:
+            log.error("write-behind: conversation %s not persisted at shutdown: %s", cid, self.last_error)
+        if self.writer is not None:
+            self.writer.close()
+
+    @property
+    def writer(self):
+        """The backing store's group-commit writer, if any (/health db_writer, shutdown)."""
+        return getattr(self.backing, "writer", None)
+
+    def footprint(self) -> Dict[str, object]:
+        return self.hot.footprint()
+
+    def stats(self) -> Dict[str, object]:
+        with self._cond:
+            dirty, inflight = len(self._dirty), len(self._inflight)
+        return {
+            "dirty": dirty,
+            "inflight": inflight,
+            "max_dirty": self.max_dirty,
+            "flush_interval_s": self.flush_interval,
+            "flushes": self.flushes,
+            "flushed": self.flushed,
+            "failures": self.failures,
+            "stuck": self.stuck,
+            "backpressure_waits": self.waits,
+            "read_through": self.read_through,
+            "last_flush_ms": round(self._last_flush_s * 1000, 2),
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,130 @@
+# api/persistence/writer.py
+"""
+Group-commit writer: one thread owns all writes and folds the operations that
+arrive within a short window (from any number of conversations) into a single
+transaction. SQLite only ever sees one writer, so there is no lock contention,
+and many turns share one fsync.
+
+Durability: `submit()` resolves its future only after the transaction holding
+that operation has committed, so callers that wait on it (the store does)
+return exactly when their write is on disk.
+"""
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, List, Tuple
+
+from sqlalchemy.engine import Connection, Engine
+
+WriteOp = Callable[[Connection], Any]
+
+_STOP = object()
+
+
+class GroupCommitWriter:
+    def __init__(self, engine: Engine, max_batch: int = 128, max_delay: float = 0.005) -> None:
+        self.engine = engine
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.commits = 0
+        self.ops = 0
+        self.failures = 0
+        self._latency: Deque[float] = deque(maxlen=1000)
+        self._sizes: Deque[int] = deque(maxlen=1000)
+        self._q: "queue.Queue" = queue.Queue()
+        self._closed = False
+        # The closed check and the enqueue happen together: nothing lands behind _STOP
+        self._closing = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="db-group-commit", daemon=True)
+        self._thread.start()
+
+    def submit(self, op: WriteOp) -> Future:
+        fut: Future = Future()
+        with self._closing:
+            if self._closed:
+                raise RuntimeError("writer is closed")
+            self._q.put((op, fut))
+        return fut
+
+    def write(self, op: WriteOp) -> Any:
+        """Blocks until the op is committed; re-raises its error."""
+        return self.submit(op).result()
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Flushes everything already queued, then stops the thread."""
+        with self._closing:
+            if self._closed:
+                return
+            self._closed = True
+            self._q.put(_STOP)
+        self._thread.join(timeout)
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            item = self._q.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._q.get(timeout=remaining) if remaining > 0 else self._q.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._commit(batch)
+
+    def _commit(self, batch: List[Tuple[WriteOp, Future]]) -> None:
+        t0 = time.perf_counter()
+        try:
+            with self.engine.begin() as conn:
+                results = [op(conn) for op, _ in batch]
+        except Exception:
+            # One bad op must not fail its neighbours: replay each on its own
+            self._commit_individually(batch)
+            return
+        self._record(t0, len(batch))
+        for (_, fut), res in zip(batch, results):
+            fut.set_result(res)
+
+    def _commit_individually(self, batch: List[Tuple[WriteOp, Future]]) -> None:
+        for op, fut in batch:
+            t0 = time.perf_counter()
+            try:
+                with self.engine.begin() as conn:
+                    res = op(conn)
+            except Exception as e:
+                self.failures += 1
+                fut.set_exception(e)
+                continue
+            self._record(t0, 1)
+            fut.set_result(res)
+
+    def _record(self, t0: float, size: int) -> None:
+        self._latency.append(time.perf_counter() - t0)
+        self._sizes.append(size)
+        self.commits += 1
+        self.ops += size
+
+    def stats(self) -> Dict[str, float]:
+        lat = sorted(self._latency)
+
+        def pct(q: float) -> float:
+            return round(lat[min(len(lat) - 1, int(q * len(lat)))] * 1000, 2) if lat else 0.0
+
+        return {
+            "commits": self.commits,
+            "ops": self.ops,
+            "failures": self.failures,
+            "queued": self._q.qsize(),
+            "avg_batch": round(sum(self._sizes) / len(self._sizes), 2) if self._sizes else 0.0,
+            "commit_p50_ms": pct(0.50),
+            "commit_p99_ms": pct(0.99),
+        }
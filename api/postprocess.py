@@ -0,0 +1,153 @@
+# api/postprocess.py
+"""
+Reply post-processing, shared by the adapters and the service.
+
+Every reply gets the same treatment: parse the leading [[STANCE:...]] marker,
+replace it with the conversation's own (canonical form), add the first-turn
+banner when asked, and cut to the word limit (marker and banner included).
+`finalize` does all of it with one anchored regex match and one bounded
+split; `ReplyStream` is the incremental version for the streaming path and
+ends with the same text.
+"""
+import re
+from typing import List, Optional, Tuple
+
+WORD_LIMIT = 180
+
+# Anchored: only a marker at the very start counts
+MARKER = re.compile(r"\s*\[\[STANCE\s*:\s*([^\]]*)\]\]\s*", re.I)
+_CANONICAL = {"pro": "[[STANCE:pro]]", "contra": "[[STANCE:contra]]"}
+
+
+def marker(stance: str) -> str:
+    return _CANONICAL.get(stance) or f"[[STANCE:{stance}]]"
+
+
+def declared(text: str) -> Optional[str]:
+    """Stance named by the leading marker (lower-case), or None if there is no marker."""
+    m = MARKER.match(text or "")
+    return m.group(1).strip().lower() if m else None
+
+
+def has_marker(text: str, stance: str) -> bool:
+    return declared(text) == stance
+
+
+def parse(text: str) -> Tuple[Optional[str], str]:
+    """(declared stance or None, body without the marker)."""
+    t = text or ""
+    m = MARKER.match(t)
+    if m is None:
+        return None, t.strip()
+    return m.group(1).strip().lower(), t[m.end():].rstrip()
+
+
+def strip_tag_and_check(text: str, stance: str) -> Tuple[str, bool]:
+    """(body, marker named `stance`) — what the adapters need to decide on a reply."""
+    found, body = parse(text)
+    return body, found == stance
+
+
+def truncate(text: str, limit: int = WORD_LIMIT) -> str:
+    """First `limit` words joined by single spaces; stops splitting past the limit."""
+    words = (text or "").split(None, limit)
+    if len(words) > limit:
+        words.pop()
+    return " ".join(words)
+
+
+def opening_banner(topic: str, stance: str) -> str:
+    """Banner informativo del primer turno (tema/postura)."""
+    stance_word = "pro" if stance == "pro" else "contra"
+    return f"Fixed topic: {topic}. Fixed stance: {stance_word}."
+
+
+def _prefix(stance: str, banner: Optional[str], text: str) -> Tuple[str, int]:
+    # (marker [+ banner], words used); the banner is skipped if the text already carries it
+    head = marker(stance)
+    if banner and banner.lower() not in text.lower():
+        words = banner.split()
+        return head + " " + " ".join(words), 1 + len(words)
+    return head, 1
+
+
+def finalize(text: str, stance: str, banner: Optional[str] = None, limit: int = WORD_LIMIT) -> str:
+    """Canonical marker + optional banner + body, at most `limit` words in total."""
+    _, body = parse(text)
+    head, used = _prefix(stance, banner, body)
+    if used >= limit:
+        return truncate(head, limit)
+    budget = limit - used
+    words = body.split(None, budget)
+    if len(words) > budget:
+        words.pop()
+    return head + " " + " ".join(words) if words else head
+
+
+class ReplyStream:
+    """
+    Versión incremental de finalize(): retiene solo lo necesario (el marcador
+    inicial y la palabra en curso) y emite el resto en cuanto llega; el texto
+    final coincide con la ruta no-streaming.
+    """
+
+    def __init__(self, stance: str, banner: Optional[str] = None, limit: int = WORD_LIMIT) -> None:
+        self.stance = stance
+        self.banner = banner
+        self.limit = limit
+        self.done = False
+        self._head: Optional[str] = ""
+        self._pending = ""
+        self._words = 0
+        self._out: List[str] = []
+
+    @property
+    def text(self) -> str:
+        return "".join(self._out)
+
+    def feed(self, delta: str) -> str:
+        if self.done or not delta:
+            return ""
+        if self._head is not None:
+            self._head += delta
+            head = self._head.lstrip()
+            # Wait until the marker is complete (or clearly absent)
+            if not head or (head.startswith("[") and "]]" not in head and len(head) < 40):
+                return ""
+            return self._release_head()
+        return self._push(delta)
+
+    def close(self) -> str:
+        if self.done:
+            return ""
+        out = self._release_head() if self._head is not None else ""
+        if self._pending:
+            out += self._push(" ")
+        return out
+
+    def _release_head(self) -> str:
+        raw, self._head = self._head or "", None
+        tail = " " if raw[len(raw.rstrip()):] else ""
+        _, body = parse(raw)
+        head, _ = _prefix(self.stance, self.banner, body)
+        return self._push(head + " " + body + tail)
+
+    def _push(self, text: str) -> str:
+        data = self._pending + text
+        tokens = data.split()
+        if data and not data[-1].isspace() and tokens:
+            self._pending = tokens.pop()
+        else:
+            self._pending = ""
+        emitted = []
+        for tok in tokens:
+            if self._words >= self.limit:
+                break
+            emitted.append((" " if self._words else "") + tok)
+            self._words += 1
+        if self._words >= self.limit:
+            self.done = True
+            self._pending = ""
+        chunk = "".join(emitted)
+        self._out.append(chunk)
+        return chunk
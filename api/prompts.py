@@ -0,0 +1,84 @@
+# api/prompts.py
+"""
+Prompt prefix shared by every adapter.
+
+Providers cache prompt prefixes (OpenAI / DeepSeek automatically, Gemini for
+`system_instruction`), but only when the prefix is byte-identical from one call
+to the next. So the fixed rules of a conversation are one system prompt, built
+once per (topic, stance) and always sent first; everything that changes
+(history, summary, user message) comes after it.
+"""
+import hashlib
+import threading
+from functools import lru_cache
+from typing import Dict, Optional
+
+from api import metrics
+
+# Prompt contract: single role + hard caps to keep the model on-rails.
+SYSTEM_TEMPLATE = (
+    "Role: debate bot.\n"
+    "Fixed topic: '{topic}'.\n"
+    "Your FIXED stance: '{stance}'. NEVER change it.\n"
+    "Mandatory rules:\n"
+    "1) Always start with the exact line: [[STANCE:{stance}]]\n"
+    "2) Consistently defend that stance in every turn.\n"
+    "3) Be respectful and persuasive; use evidence, analogies, and questions.\n"
+    "4) Max 180 words. Stay strictly on topic.\n"
+    "Write the answer in English."
+)
+
+# Extra guardrail to avoid malformed stance tokens from the model.
+GUARD_TEMPLATE = (
+    "Critical guard: The stance marker MUST be exactly one of: [[STANCE:pro]] or [[STANCE:contra]]. "
+    "Any other token (e.g., [[STANCE:st]]) is invalid and you must rewrite immediately."
+)
+
+ENGLISH_RULE = "Always answer in English. If the user asks to change language, politely refuse and continue in English."
+
+
+@lru_cache(maxsize=4096)
+def system_prompt(topic: str, stance: str) -> str:
+    """The conversation's fixed prefix; the same string object for every turn."""
+    return "\n\n".join((SYSTEM_TEMPLATE.format(topic=topic, stance=stance), GUARD_TEMPLATE, ENGLISH_RULE))
+
+
+@lru_cache(maxsize=4096)
+def prefix_key(topic: str, stance: str) -> str:
+    """Stable id of the prefix (OpenAI `prompt_cache_key` routes equal prefixes to the same cache)."""
+    return hashlib.sha1(system_prompt(topic, stance).encode("utf-8")).hexdigest()[:16]
+
+
+class PromptUsage:
+    """Token counters from the providers' usage fields, including prefix-cache hits."""
+
+    def __init__(self, provider: str = "", model: str = "", prefix_cache: bool = True) -> None:
+        # False when the client does nothing to get the prefix cached (/health says so)
+        self.prefix_cache = prefix_cache
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self._lock = threading.Lock()
+        # Labels for rickbot_tokens_total in /metrics
+        self._labels = (provider, model)
+
+    def record(self, prompt: Optional[int], cached: Optional[int], completion: Optional[int]) -> None:
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt or 0
+            self.cached_tokens += cached or 0
+            self.completion_tokens += completion or 0
+        for kind, n in (("prompt", prompt), ("cached_prompt", cached), ("completion", completion)):
+            if n:
+                metrics.TOKENS.inc(*self._labels, kind, amount=n)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "prefix_cache": self.prefix_cache,
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cache_hit_ratio": round(self.cached_tokens / self.prompt_tokens, 3) if self.prompt_tokens else 0.0,
+        }
@@ -0,0 +1,322 @@
+# api/routing.py
+"""
+Opt-in cross-provider routing for a single turn.
+
+The conversation stays pinned to `state["provider"]`; the router only decides
+who answers *this* call:
+
+- "pinned":   no routing, the pinned provider or an error (default).
+- "failover": skip providers whose circuit is open and move to the next one on
+              Unavailable / UpstreamTimeout / UpstreamNetwork / RateLimited
+              (including our own limiter's AdmissionRejected, which moves on
+              without counting against the provider's circuit).
+- "hedge":    failover, plus if the pinned provider has not answered by its
+              observed p95 latency, fire the same prompt at a backup and keep
+              whichever valid reply lands first.
+
+`ProviderSelector` is the other half: it scores every provider/model from live
+latency and error rates and picks the provider for *new* conversations.
+"""
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+from api.errors import AdmissionRejected, ProviderError, RateLimited, Unavailable, UpstreamNetwork, UpstreamTimeout
+
+FAILOVER_ERRORS = (Unavailable, UpstreamTimeout, UpstreamNetwork, RateLimited)
+POLICIES = {"pinned", "failover", "hedge"}
+
+
+class CircuitBreaker:
+    """closed -> open after N consecutive failures; half-open probe after `reset_after` seconds."""
+
+    def __init__(self, failure_threshold: int = 5, reset_after: float = 30.0, clock: Callable[[], float] = time.monotonic) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.clock = clock
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if self.clock() - self.opened_at >= self.reset_after:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        st = self.state
+        if st == "closed":
+            return True
+        if st == "half-open" and not self._probing:
+            self._probing = True   # let exactly one probe through
+            return True
+        return False
+
+    def release_probe(self) -> None:
+        self._probing = False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._probing = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = self.clock()
+
+
+class LatencyWindow:
+    """Last N successful call latencies, for the hedge trigger."""
+
+    def __init__(self, size: int = 200) -> None:
+        self.samples: Deque[float] = deque(maxlen=size)
+
+    def add(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class ProviderScore:
+    """Time-decayed EWMA of latency and error rate plus a rolling latency window."""
+
+    def __init__(self, model: str, half_life: float, clock: Callable[[], float]) -> None:
+        self.model = model
+        self.half_life = half_life
+        self.clock = clock
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.window = LatencyWindow()
+        self.calls = 0
+        self.errors = 0
+        self._ts: Optional[float] = None
+
+    def _weight(self, now: float) -> float:
+        # Weight of the new sample grows with the time since the last one,
+        # so a degraded provider dominates its score within a few seconds.
+        if self._ts is None or self.half_life <= 0:
+            return 1.0
+        return 1.0 - 0.5 ** (max(now - self._ts, 0.0) / self.half_life)
+
+    def record(self, seconds: float, ok: bool) -> None:
+        now = self.clock()
+        w = max(self._weight(now), 0.2)   # never ignore a sample entirely under bursty load
+        self._ts = now
+        self.calls += 1
+        self.error_rate += w * ((0.0 if ok else 1.0) - self.error_rate)
+        if ok:
+            self.latency = seconds if self.latency is None else self.latency + w * (seconds - self.latency)
+            self.window.add(seconds)
+        else:
+            self.errors += 1
+
+    def score(self) -> float:
+        """Expected seconds per good reply; lower is better, unknown providers score 0 (explore)."""
+        if self.latency is None:
+            return 0.0
+        return self.latency / max(1.0 - self.error_rate, 0.05)
+
+
+class ProviderSelector:
+    def __init__(
+        self,
+        models: Dict[str, str],
+        half_life: float = 10.0,
+        max_error_rate: float = 0.5,
+        explore: float = 0.05,
+        adaptive: bool = True,
+        clock: Callable[[], float] = time.monotonic,
+        rng: Callable[[], float] = random.random,
+    ) -> None:
+        # adaptive=False: only keep scores (for /health), always pick the fallback
+        self.adaptive = adaptive
+        self.max_error_rate = max_error_rate
+        self.explore = explore
+        self.rng = rng
+        self.scores = {p: ProviderScore(m, half_life, clock) for p, m in models.items()}
+
+    def record(self, provider: str, seconds: float, ok: bool) -> None:
+        score = self.scores.get(provider)
+        if score is not None:
+            score.record(seconds, ok)
+
+    def healthy(self) -> List[str]:
+        return [p for p, s in self.scores.items() if s.error_rate < self.max_error_rate]
+
+    def pick(self, fallback: str) -> str:
+        if not self.adaptive:
+            return fallback
+        candidates = self.healthy() or [fallback]
+        if len(candidates) > 1 and self.rng() < self.explore:
+            # Occasional exploration keeps stats fresh for providers that recovered
+            return candidates[int(self.rng() * len(candidates)) % len(candidates)]
+        return min(candidates, key=lambda p: (self.scores[p].score() if p in self.scores else 0.0, p != fallback))
+
+    def stats(self) -> Dict[str, Dict[str, object]]:
+        return {
+            p: {
+                "model": s.model,
+                "ewma_ms": round((s.latency or 0.0) * 1000),
+                "p95_ms": round((s.window.percentile(0.95) or 0.0) * 1000),
+                "error_rate": round(s.error_rate, 3),
+                "calls": s.calls,
+                "errors": s.errors,
+                "healthy": s.error_rate < self.max_error_rate,
+            }
+            for p, s in self.scores.items()
+        }
+
+
+CallFn = Callable[[str], Awaitable[str]]
+
+
+class Router:
+    def __init__(
+        self,
+        providers: Sequence[str],
+        policy: str = "pinned",
+        failure_threshold: int = 5,
+        reset_after: float = 30.0,
+        hedge_delay: float = 2.0,
+        min_samples: int = 20,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        if policy not in POLICIES:
+            raise ValueError(f"unknown routing policy: {policy}")
+        self.providers = list(providers)
+        self.policy = policy
+        self.hedge_delay = hedge_delay
+        self.min_samples = min_samples
+        self.clock = clock
+        self.breakers = {p: CircuitBreaker(failure_threshold, reset_after, clock) for p in providers}
+        self.latency = {p: LatencyWindow() for p in providers}
+        self.hedges = 0
+        self.failovers = 0
+
+    def _order(self, pinned: str) -> List[str]:
+        if self.policy == "pinned":
+            return [pinned]
+        return [pinned] + [p for p in self.providers if p != pinned]
+
+    def _hedge_after(self, provider: str) -> float:
+        window = self.latency[provider]
+        p95 = window.percentile(0.95) if len(window.samples) >= self.min_samples else None
+        return p95 if p95 is not None else self.hedge_delay
+
+    async def _timed(self, provider: str, call: CallFn) -> Tuple[str, str]:
+        t0 = self.clock()
+        try:
+            reply = await call(provider)
+        except AdmissionRejected:
+            self.breakers[provider].release_probe()   # local backpressure; no verdict on the provider
+            raise
+        except FAILOVER_ERRORS:
+            self.breakers[provider].record_failure()
+            raise
+        except BaseException:
+            # Lost the hedge race, or an error that says nothing about availability
+            # (auth, bad request, a bug): no verdict, but never keep the probe claimed
+            self.breakers[provider].release_probe()
+            raise
+        self.breakers[provider].record_success()
+        self.latency[provider].add(self.clock() - t0)
+        return provider, reply
+
+    async def call(self, pinned: str, call: CallFn, valid: Callable[[str], bool] = lambda _: True) -> Tuple[str, str]:
+        """Returns (provider that answered, raw reply)."""
+        queue = self._order(pinned)
+        pending: Dict[asyncio.Task, str] = {}
+        fallback: Optional[Tuple[str, str]] = None
+        last_error: Optional[ProviderError] = None
+
+        def launch(first: bool = False) -> bool:
+            # Breakers are asked lazily so a half-open probe is only claimed when used
+            while queue:
+                provider = queue.pop(0)
+                if self.policy == "pinned" or self.breakers[provider].allow():
+                    pending[asyncio.ensure_future(self._timed(provider, call))] = provider
+                    return True
+            if first:   # everything open: still try the pinned one
+                pending[asyncio.ensure_future(self._timed(pinned, call))] = pinned
+                return True
+            return False
+
+        launch(first=True)
+        try:
+            while pending:
+                hedge_at = None
+                if self.policy == "hedge" and queue and len(pending) == 1:
+                    hedge_at = self._hedge_after(next(iter(pending.values())))
+                done, _ = await asyncio.wait(pending, timeout=hedge_at, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if launch():
+                        self.hedges += 1
+                    continue
+                for task in done:
+                    pending.pop(task)
+                    try:
+                        provider, reply = task.result()
+                    except FAILOVER_ERRORS as e:
+                        last_error = e
+                        if not pending and launch():
+                            self.failovers += 1
+                        continue
+                    if valid(reply):
+                        return provider, reply
+                    fallback = fallback or (provider, reply)
+                if fallback and not pending:
+                    return fallback
+            if fallback:
+                return fallback
+            raise last_error or Unavailable()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "policy": self.policy,
+            "hedges": self.hedges,
+            "failovers": self.failovers,
+            "providers": {
+                p: {
+                    "circuit": self.breakers[p].state,
+                    "p95_ms": round((self.latency[p].percentile(0.95) or 0.0) * 1000),
+                }
+                for p in self.providers
+            },
+        }
+
+
+def from_env(providers: Sequence[str]) -> Router:
+    """ROUTING_POLICY, BREAKER_FAILURES, BREAKER_RESET_S, HEDGE_DELAY_S."""
+    return Router(
+        providers,
+        policy=os.getenv("ROUTING_POLICY", "pinned").lower(),
+        failure_threshold=int(os.getenv("BREAKER_FAILURES", "5")),
+        reset_after=float(os.getenv("BREAKER_RESET_S", "30")),
+        hedge_delay=float(os.getenv("HEDGE_DELAY_S", "2.0")),
+    )
+
+
+def selector_from_env(models: Dict[str, str], adaptive: bool = False) -> ProviderSelector:
+    """SELECTOR_HALF_LIFE_S, SELECTOR_MAX_ERROR_RATE, SELECTOR_EXPLORE."""
+    return ProviderSelector(
+        models,
+        adaptive=adaptive,
+        half_life=float(os.getenv("SELECTOR_HALF_LIFE_S", "10")),
+        max_error_rate=float(os.getenv("SELECTOR_MAX_ERROR_RATE", "0.5")),
+        explore=float(os.getenv("SELECTOR_EXPLORE", "0.05")),
+    )
@@ -12,4 +12,12 @@ class MessageItem(BaseModel):
 class ConversationOut(BaseModel):
     conversation_id: str
     message: List[MessageItem]
-   
\ No newline at end of file
+   
+class TranscriptItem(MessageItem):
+    seq: int
+
+class TranscriptPage(BaseModel):
+    conversation_id: str
+    messages: List[TranscriptItem]
+    # Pass as ?before= to get the previous page; None on the first page
+    next_before: Optional[int] = None
@@ -1,8 +1,24 @@
-from typing import List, Dict, Tuple, Optional
-import re
+from typing import List, Dict, Tuple, Optional, AsyncIterator, Any
+import asyncio
+import inspect
+import os
+import time
+from contextlib import aclosing, contextmanager, nullcontext
 from .storage_memory import InMemoryConversationStore, ConversationState
+from .limits import COMPLETION_TOKENS, ProviderLimiter, estimate_tokens
+from .routing import Router, ProviderSelector
+from .errors import AdmissionRejected, ProviderError
+from .cache import ResponseCache, cache_key
+from . import context, metrics, tracing
+from .langid import is_english
+from .postprocess import ReplyStream, finalize, has_marker, opening_banner, parse, truncate
+from .generation import GenerationPolicy, GenerationStats, choose
+from .deadline import Deadline, RetryPolicy
 
-HISTORY_CAP = 10
+# Messages kept on the conversation; older ones are folded into state["summary"].
+# What actually reaches the model is bounded in tokens by api.context.
+HISTORY_CAP = int(os.getenv("HISTORY_CAP", "10"))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "300"))
 
 
 class ConversationNotFound(Exception):
@@ -10,64 +26,87 @@ class ConversationNotFound(Exception):
 
  
 
-def _normalize_marker(text: str, stance: str) -> str:
-    """
-    Asegura que la respuesta empiece con [[STANCE:pro|contra]] y que
-    coincida con la postura fija de la conversación.
-    """
-    t = (text or "").strip()
-
-    # Fix if the wrong marker came from the model
-    if re.match(r"^\s*\[\[STANCE\s*:\s*contra\]\]\s*", t, re.I) and stance == "pro":
-        t = re.sub(r"^\s*\[\[STANCE\s*:\s*contra\]\]\s*", f"[[STANCE:{stance}]] ", t, flags=re.I)
-        return t.strip()
-    if re.match(r"^\s*\[\[STANCE\s*:\s*pro\]\]\s*", t, re.I) and stance == "contra":
-        t = re.sub(r"^\s*\[\[STANCE\s*:\s*pro\]\]\s*", f"[[STANCE:{stance}]] ", t, flags=re.I)
-        return t.strip()
-
-     # Add it if missing
-    if not re.match(r"^\s*\[\[STANCE\s*:\s*(pro|contra)\]\]\s*", t, re.I):
-        t = f"[[STANCE:{stance}]] " + t
+def _model_name(llm: object) -> str:
+    name = getattr(llm, "model_name", None) or getattr(llm, "model", None)
+    return name if isinstance(name, str) else type(llm).__name__
 
-    return t.strip()
 
+async def _achat(llm: object, **kwargs) -> str:
+    """
+    Llama al adaptador sin bloquear el event loop: usa `achat` si existe,
+    si no corre el `chat` sync en un hilo (p.ej. FakeLLM en tests).
+    """
+    achat = getattr(llm, "achat", None)
+    if achat is not None:
+        return await achat(**kwargs)
+    return await asyncio.to_thread(llm.chat, **kwargs)
 
-def _truncate_words(text: str, limit: int = 180) -> str:
-    """Corta a 180 palabras máx (la regla del reto)."""
-    words = (text or "").split()
-    return " ".join(words[:limit]).strip()
 
+async def _astream(provider: str, llm: object, **kwargs) -> AsyncIterator[str]:
+    """Deltas del proveedor; sin `astream` se emite la respuesta completa de una vez."""
+    with tracing.span(f"upstream.{provider}"), metrics.provider_call(provider, _model_name(llm)):
+        astream = getattr(llm, "astream", None)
+        if astream is None:
+            yield await _achat(llm, **kwargs)
+            return
+        async for delta in astream(**kwargs):
+            yield delta
 
-def _opening_banner(topic: str, stance: str) -> str:
-    """Banner informativo del primer turno (tema/postura)."""
-    stance_word = "pro" if stance == "pro" else "contra"
-    return f"Fixed topic: {topic}. Fixed stance: {stance_word}."
 
+def _candidates(provider: str, llm: object, n: int, **kwargs) -> List[str]:
+    """n replies in one round trip when the adapter supports it; otherwise one `chat`."""
+    with tracing.span(f"upstream.{provider}"), metrics.provider_call(provider, _model_name(llm)):
+        many = getattr(llm, "candidates", None)
+        if many is not None:
+            return many(n=n, **kwargs)
+        return [llm.chat(**kwargs)]
 
-def _seems_english(text: str) -> bool:
-    """
-    Heurística simple para detectar si la salida parece inglés.
-    No es perfecto, pero funciona para bloquear español accidental.
-    """
-    low = (text or "").lower()
-    if re.search(r"[áéíóúñ¡¿]", low):
-        return False
-    es_hits = sum(w in low for w in [" el ", " la ", " los ", " las ", " que ", " de ", " y ", " en ", " por ", " para ", " con "])
-    en_hits = sum(w in low for w in [" the ", " and ", " of ", " to ", " in ", " for ", " with ", " on "])
-    return en_hits >= es_hits
 
+async def _acandidates(provider: str, llm: object, n: int, **kwargs) -> List[str]:
+    with tracing.span(f"upstream.{provider}"), metrics.provider_call(provider, _model_name(llm)):
+        many = getattr(llm, "acandidates", None)
+        if many is not None:
+            return await many(n=n, **kwargs)
+        return [await _achat(llm, **kwargs)]
 
 
 
 class ConversationService:
-    def __init__(self, store: InMemoryConversationStore, llms: Dict[str, object], default_provider: str = "gemini") -> None:
+    def __init__(
+        self,
+        store: InMemoryConversationStore,
+        llms: Dict[str, object],
+        default_provider: str = "gemini",
+        limiters: Optional[Dict[str, ProviderLimiter]] = None,
+        router: Optional[Router] = None,
+        selector: Optional[ProviderSelector] = None,
+        cache: Optional[ResponseCache] = None,
+        policy: Optional[GenerationPolicy] = None,
+        retry: Optional[RetryPolicy] = None,
+    ) -> None:
         self.store = store
         self.llms = llms
+        # Optional per-provider admission control and cross-provider routing (async paths only)
+        self.limiters = limiters or {}
+        self.router = router
+        # Optional latency-aware choice of provider for new conversations
+        self.selector = selector
+        # Optional cache of opening replies (empty history only)
+        self.cache = cache
+        # Candidates per call and repair rounds, for every path (adapters no longer retry)
+        self.policy = policy or GenerationPolicy()
+        self.generation = GenerationStats()
+        # The one place provider calls are retried (default: no retries), within the turn's Deadline
+        self.retry = retry or RetryPolicy(max_attempts=1)
+        # Stores whose get/set/append are coroutines (async DB engines) only serve async turns
+        self._async_store = inspect.iscoroutinefunction(getattr(store, "get", None))
+        self._backend = type(store).__name__
+        self._params: Dict[str, Tuple[set, bool]] = {}
          # If the given default provider is invalid, pick the first available one
         self.default_provider = default_provider if default_provider in llms else next(iter(llms))
 
     def _bootstrap(self, opening_msg: str, provider: Optional[str], stance: Optional[str]) -> Tuple[str, ConversationState]:
-        prov = provider or self.default_provider
+        prov = provider or (self.selector.pick(self.default_provider) if self.selector else self.default_provider)
         if prov not in self.llms:
             raise ValueError(f"unsupported provider: {prov}")
         st = stance if stance in {"pro", "contra"} else "pro"
@@ -80,82 +119,508 @@ class ConversationService:
             "provider": prov,       # proveedor fijo
             "history": []
         }
-        self.store.set(cid, state)
+        # Stores with append() create the row together with the first turn
+        # (streams, which hand the id out first, save it in _acreate)
+        if not hasattr(self.store, "append"):
+            with self._store_op("set"):
+                self.store.set(cid, state)
         return cid, state
 
-    def handle(
+    async def _acreate(self, cid: str, state: ConversationState) -> None:
+        """Saves a new conversation before its id is handed out (a stream's meta event comes before the turn)."""
+        if not hasattr(self.store, "append"):
+            return   # _bootstrap already saved it
+        with self._store_op("set"):
+            if self._async_store:
+                await self.store.set(cid, state)
+            else:
+                await asyncio.to_thread(self.store.set, cid, state)
+
+    def _resolve(
         self,
         cid: Optional[str],
         user_msg: str,
-        provider: Optional[str] = None,
-        stance: Optional[str] = None
-    ) -> Tuple[str, List[Dict[str, str]]]:
-
+        provider: Optional[str],
+        stance: Optional[str],
+    ) -> Tuple[str, ConversationState, bool]:
         if cid is not None:
-            state = self.store.get(cid)
+            with self._store_op("get"):
+                state = self.store.get(cid)
             if not state:
                 raise ConversationNotFound(cid)
-            first_turn = False
+            return cid, state, False
+        cid, state = self._bootstrap(opening_msg=user_msg, provider=provider, stance=stance)
+        return cid, state, True
+
+    async def _aresolve(
+        self,
+        cid: Optional[str],
+        user_msg: str,
+        provider: Optional[str],
+        stance: Optional[str],
+    ) -> Tuple[str, ConversationState, bool]:
+        # Async stores, or sync stores with an async read path (write-behind tier)
+        aget = self.store.get if self._async_store else getattr(self.store, "aget", None)
+        if cid is not None and aget is not None:
+            with self._store_op("get"):
+                state = await aget(cid)
+            if not state:
+                raise ConversationNotFound(cid)
+            return cid, state, False
+        return self._resolve(cid, user_msg, provider, stance)
+
+    @staticmethod
+    def _english_retry_msg(user_msg: str, stance: str) -> str:
+        return (
+            user_msg
+            + "\n\nIMPORTANT: Answer ONLY in ENGLISH. "
+              f"Start with [[STANCE:{stance}]], keep it under 180 words, "
+              "and do not change topic or stance."
+        )
+
+    @staticmethod
+    def _usable(bot_norm: str) -> bool:
+        # A reply needs a body past the marker; short text is never rejected by is_english
+        return bool(parse(bot_norm)[1]) and is_english(bot_norm)
+
+    @staticmethod
+    def _fallback_reply(state: ConversationState) -> str:
+        bot_norm = (
+            f"[[STANCE:{state['stance']}]] I must reply in English and keep the fixed stance on "
+            f"'{state['topic']}'. Could you share your strongest objection so I can address it directly?"
+        )
+        return truncate(bot_norm)
+
+    def _finish(
+        self,
+        cid: str,
+        state: ConversationState,
+        user_msg: str,
+        bot_norm: str,
+        first_turn: bool,
+    ) -> Tuple[str, List[Dict[str, str]]]:
+        turn = self._compose(state, user_msg, bot_norm, first_turn)
+        return self._persist(cid, state, turn)
+
+    async def _afinish(
+        self,
+        cid: str,
+        state: ConversationState,
+        user_msg: str,
+        bot_norm: str,
+        first_turn: bool,
+    ) -> Tuple[str, List[Dict[str, str]]]:
+        turn = self._compose(state, user_msg, bot_norm, first_turn)
+        if self._async_store:
+            with self._store_op("append"):
+                await self.store.append(cid, state, turn)
+            return cid, state["history"]
+        aappend = getattr(self.store, "aappend", None)
+        if aappend is not None:
+            with self._store_op("append"):
+                await aappend(cid, state, turn)   # e.g. waits for a group commit off the loop
+            return cid, state["history"]
+        return self._persist(cid, state, turn)
+
+    def _persist(self, cid: str, state: ConversationState, turn: List[Dict[str, str]]) -> Tuple[str, List[Dict[str, str]]]:
+        append = getattr(self.store, "append", None)
+        if append is not None:
+            with self._store_op("append"):
+                append(cid, state, turn)   # write only the new rows
         else:
-            cid, state = self._bootstrap(opening_msg=user_msg, provider=provider, stance=stance)
-            first_turn = True
+            with self._store_op("set"):
+                self.store.set(cid, state)
+        return cid, state["history"]
 
-        llm = self.llms[state["provider"]]
+    @contextmanager
+    def _store_op(self, op: str):
+        with tracing.span(f"store.{op}"), metrics.timed(metrics.STORE_SECONDS, self._backend, op):
+            yield
+
+    def _compose(
+        self,
+        state: ConversationState,
+        user_msg: str,
+        bot_norm: str,
+        first_turn: bool,
+    ) -> List[Dict[str, str]]:
+        # Add banner only on the first turn
+        if first_turn:
+            bot_norm = finalize(bot_norm, state["stance"], opening_banner(state["topic"], state["stance"]))
+
+        #Save history (keep only last 10 entries)
+        turn = [
+            {"role": "user", "message": user_msg},
+            {"role": "bot",  "message": bot_norm},
+        ]
+        state["message_count"] = state.get("message_count", len(state["history"])) + len(turn)
+        state["history"].extend(turn)
+        evicted = state["history"][:-HISTORY_CAP]
+        if evicted:
+            state["summary"] = context.fold(state.get("summary", ""), evicted, SUMMARY_MAX_TOKENS)
+            state["history"] = state["history"][-HISTORY_CAP:]
+        return turn
 
-        #Ask the LLM for a reply
-        bot_raw = llm.chat(
+    def _accepts(self, provider: str, name: str) -> bool:
+        # Older/custom adapters may not take every keyword (summary, timeout)
+        params = self._params.get(provider)
+        if params is None:
+            llm = self.llms[provider]
+            method = getattr(llm, "chat", None) or getattr(llm, "achat", None) or getattr(llm, "astream")
+            sig = inspect.signature(method).parameters
+            params = self._params[provider] = (
+                set(sig),
+                any(p.kind is inspect.Parameter.VAR_KEYWORD for p in sig.values()),
+            )
+        names, var_kw = params
+        return var_kw or name in names
+
+    def _extra(self, provider: str, state: ConversationState) -> Dict[str, str]:
+        summary = state.get("summary")
+        return {"summary": summary} if summary and self._accepts(provider, "summary") else {}
+
+    def _timeout(self, provider: str, timeout: Optional[float]) -> Dict[str, float]:
+        return {"timeout": timeout} if timeout is not None and self._accepts(provider, "timeout") else {}
+
+    def _opening_key(self, state: ConversationState, first_turn: bool) -> Optional[str]:
+        if self.cache is None or not first_turn or state["history"]:
+            return None
+        return cache_key(state["provider"], _model_name(self.llms[state["provider"]]), state["topic"], state["stance"], state["history"])
+
+    def _remember(self, key: Optional[str], bot_norm: str) -> None:
+        # A cached opening answers every new conversation on the topic for the whole TTL:
+        # only real candidates with a body (callers pass key=None after a fallback)
+        if key and parse(bot_norm)[1]:
+            self.cache.put(key, bot_norm)
+
+    async def _arecall(self, key: Optional[str]) -> Optional[str]:
+        # The SQLite backend reads from disk: never on the event loop
+        return await self.cache.aget(key) if key else None
+
+    async def _aremember(self, key: Optional[str], bot_norm: str) -> None:
+        if key and parse(bot_norm)[1]:
+            await self.cache.aput(key, bot_norm)
+
+    def _admit(self, provider: str, state: ConversationState, user_msg: str, deadline: Deadline, n: int = 1):
+        """Admission for one upstream round trip asking for n candidates (every attempt and repair round gets its own)."""
+        limiter = self.limiters.get(provider)
+        if limiter is None:
+            return nullcontext()
+        # Adapters without a native `n` (DeepSeek) send one request per candidate, each with the whole prompt
+        requests = n if getattr(self.llms[provider], "fans_out", False) else 1
+        prompt = estimate_tokens(state["topic"], state.get("summary", ""), user_msg, *(m["message"] for m in state["history"]), completion=0)
+        return limiter.admit(prompt * requests + n * COMPLETION_TOKENS, max_wait=deadline.remaining(), requests=requests)
+
+    async def _aupstream(self, provider: str, state: ConversationState, msg: str, deadline: Deadline, timeout: Optional[float]) -> List[str]:
+        """One admitted candidates round trip."""
+        n = self.policy.candidates
+        kw = self._call_kwargs(provider, state, msg)
+        async with self._admit(provider, state, msg, deadline, n):
+            return await _acandidates(provider, self.llms[provider], n, **kw, **self._timeout(provider, timeout))
+
+    async def _aupstream_stream(self, provider: str, state: ConversationState, msg: str, deadline: Deadline, timeout: Optional[float]) -> AsyncIterator[str]:
+        """One admitted stream; the slot is held until the stream is closed."""
+        kw = self._call_kwargs(provider, state, msg)
+        async with self._admit(provider, state, msg, deadline):
+            async for delta in _astream(provider, self.llms[provider], **kw, **self._timeout(provider, timeout)):
+                yield delta
+
+    def _call_kwargs(self, provider: str, state: ConversationState, user_msg: str) -> Dict[str, Any]:
+        return dict(
             topic=state["topic"],
             stance=state["stance"],
             history=state["history"],
-            user_msg=user_msg
+            user_msg=user_msg,
+            **self._extra(provider, state),
         )
 
-        #Normalize stance marker and enforce word limit
-        bot_norm = _normalize_marker(bot_raw, state["stance"])
-        bot_norm = _truncate_words(bot_norm, 180)
-
-        # Ensure response is English, retry if needed
-        if not _seems_english(bot_norm):
-            hard_user_msg = (
-                user_msg
-                + "\n\nIMPORTANT: Answer ONLY in ENGLISH. "
-                  f"Start with [[STANCE:{state['stance']}]], keep it under 180 words, "
-                  "and do not change topic or stance."
+    def _rounds(self, state: ConversationState, user_msg: str, repair: bool):
+        """(prompt, rounds) for a generation; repair=True when a first round already failed elsewhere."""
+        if repair:
+            return self._english_retry_msg(user_msg, state["stance"]), self.policy.max_repairs
+        return user_msg, self.policy.max_calls
+
+    def _generate(self, state: ConversationState, user_msg: str, deadline: Deadline) -> Optional[str]:
+        """Sync counterpart of _agenerate (same policy, same counters); None when every round failed."""
+        provider = state["provider"]
+        llm = self.llms[provider]
+        msg, rounds = self._rounds(state, user_msg, repair=False)
+        rejected: Dict[str, int] = {}
+        texts: List[str] = []
+        seen = 0
+        reason = None
+        for r in range(1, rounds + 1):
+            if r > 1 and deadline.expired:
+                break   # no budget left for a repair round: fall back
+            if reason:
+                metrics.RETRIES.inc(provider, reason)
+            kw = self._call_kwargs(provider, state, msg)
+            texts = self.retry.run(
+                lambda t: _candidates(provider, llm, self.policy.candidates, **kw, **self._timeout(provider, t)),
+                deadline,
+                provider,
             )
-            bot_retry = llm.chat(
-                topic=state["topic"],
-                stance=state["stance"],
-                history=state["history"],
-                user_msg=hard_user_msg,
+            seen += len(texts)
+            idx, fixed, rej = choose(texts, state["stance"], is_english)
+            for k, v in rej.items():
+                rejected[k] = rejected.get(k, 0) + v
+            if idx is not None:
+                self.generation.record(r, idx, fixed, seen, rejected)
+                return texts[idx]
+            msg = self._english_retry_msg(user_msg, state["stance"])
+            reason = "not_english" if rej.get("not_english") else "empty"
+        self.generation.record(rounds, None, False, seen, rejected)
+        return None   # the caller falls back
+
+    async def _agenerate(self, provider: str, state: ConversationState, user_msg: str, deadline: Deadline, repair: bool = False) -> Optional[str]:
+        msg, rounds = self._rounds(state, user_msg, repair)
+        first = 2 if repair else 1
+        rejected: Dict[str, int] = {}
+        texts: List[str] = []
+        seen = 0
+        reason = "not_english" if repair else None   # the streamed reply failed the English check
+        for r in range(first, first + rounds):
+            if r > 1 and deadline.expired:
+                break   # no budget left for a repair round: fall back
+            if reason:
+                metrics.RETRIES.inc(provider, reason)
+            # Every attempt is admitted on its own: retries and repairs are upstream requests too
+            texts = await self.retry.arun(
+                lambda t, msg=msg: self._aupstream(provider, state, msg, deadline, t),
+                deadline,
+                provider,
             )
-            bot_norm = _normalize_marker(bot_retry, state["stance"])
-            bot_norm = _truncate_words(bot_norm, 180)
+            seen += len(texts)
+            idx, fixed, rej = choose(texts, state["stance"], is_english)
+            for k, v in rej.items():
+                rejected[k] = rejected.get(k, 0) + v
+            if idx is not None:
+                self.generation.record(r, idx, fixed, seen, rejected)
+                return texts[idx]
+            msg = self._english_retry_msg(user_msg, state["stance"])
+            reason = "not_english" if rej.get("not_english") else "empty"
+        self.generation.record(rounds, None, False, seen, rejected)
+        return None   # the caller falls back
 
-            #  Fallback if still not English
-            if not _seems_english(bot_norm):
-                bot_norm = (
-                    f"[[STANCE:{state['stance']}]] I must reply in English and keep the fixed stance on "
-                    f"'{state['topic']}'. Could you share your strongest objection so I can address it directly?"
-                )
-                bot_norm = _truncate_words(bot_norm, 180)
+    @contextmanager
+    def _scored(self, provider: str):
+        """One selector sample per provider call: seconds until it answered, ok or ProviderError.
 
-        # Add banner only on the first turn
+        Yields a callback the stream path uses to stop the clock at the first delta."""
+        t0 = time.perf_counter()
+        answered: List[float] = []
+
+        def first_byte() -> None:
+            if not answered:
+                answered.append(time.perf_counter() - t0)
+
+        try:
+            yield first_byte
+        except AdmissionRejected:
+            raise   # our own queue turned it away: no sample for the provider
+        except ProviderError:
+            if self.selector and not answered:
+                self.selector.record(provider, time.perf_counter() - t0, ok=False)
+            raise
+        if self.selector:
+            first_byte()
+            self.selector.record(provider, answered[0], ok=True)
+
+    async def _acall_provider(self, provider: str, state: ConversationState, user_msg: str, deadline: Deadline, repair: bool = False) -> Optional[str]:
+        with self._scored(provider):
+            return await self._agenerate(provider, state, user_msg, deadline, repair)
+
+    async def _acall(self, state: ConversationState, user_msg: str, deadline: Deadline, repair: bool = False) -> Optional[str]:
+        """Raw reply, or None when no usable candidate came back (the caller falls back)."""
+        if repair and deadline.expired:
+            self.generation.record(0, None, False, 0, {})
+            return None   # no budget for a repair round
+        if self.router is None:
+            return await self._acall_provider(state["provider"], state, user_msg, deadline, repair)
+        # The conversation stays pinned; a backup may answer this one call (same deadline)
+        _, reply = await self.router.call(
+            state["provider"],
+            lambda p: self._acall_provider(p, state, user_msg, deadline, repair),
+            valid=lambda text: text is not None and is_english(text) and has_marker(text, state["stance"]),
+        )
+        return reply
+
+    def _locked(self, cid: Optional[str]):
+        # Turns on the same conversation read-modify-write its history, so they
+        # run one at a time; new conversations (cid None) cannot collide.
+        lock = getattr(self.store, "lock", None)
+        return lock(cid) if cid is not None and lock is not None else nullcontext()
+
+    def _alocked(self, cid: Optional[str]):
+        alock = getattr(self.store, "alock", None)
+        return alock(cid) if cid is not None and alock is not None else nullcontext()
+
+    def handle(
+        self,
+        cid: Optional[str],
+        user_msg: str,
+        provider: Optional[str] = None,
+        stance: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> Tuple[str, List[Dict[str, str]]]:
+        """Sync turn: blocks the calling thread for every upstream call."""
+        if self._async_store:
+            raise TypeError("this store is async-only: use ahandle/astream")
+        with metrics.in_flight(metrics.TURN_SECONDS, metrics.TURNS_IN_FLIGHT, "sync"), tracing.span("turn"), self._locked(cid):
+            return self._handle(cid, user_msg, provider, stance, deadline or Deadline())
+
+    async def ahandle(
+        self,
+        cid: Optional[str],
+        user_msg: str,
+        provider: Optional[str] = None,
+        stance: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> Tuple[str, List[Dict[str, str]]]:
+        """Async turn: same rules as `handle`, but never holds a thread while the provider works."""
+        with metrics.in_flight(metrics.TURN_SECONDS, metrics.TURNS_IN_FLIGHT, "async"), tracing.span("turn"):
+            async with self._alocked(cid):
+                return await self._ahandle(cid, user_msg, provider, stance, deadline or Deadline())
+
+    def _handle(
+        self,
+        cid: Optional[str],
+        user_msg: str,
+        provider: Optional[str],
+        stance: Optional[str],
+        deadline: Deadline,
+    ) -> Tuple[str, List[Dict[str, str]]]:
+        cid, state, first_turn = self._resolve(cid, user_msg, provider, stance)
+
+        key = self._opening_key(state, first_turn)
+        cached = self.cache.get(key) if key else None
+        if cached is not None:
+            return self._finish(cid, state, user_msg, cached, first_turn)
+
+        # Ask for candidates and keep the best one (retry budget lives in self.policy)
+        with self._scored(state["provider"]):
+            bot_raw = self._generate(state, user_msg, deadline)
+
+        #Normalize stance marker and enforce word limit
+        with tracing.span("postprocess"):
+            bot_norm = finalize(bot_raw or "", state["stance"])
+            english = bot_raw is not None and self._usable(bot_norm)
+
+        #  Fallback if no candidate was English (or had a body)
+        if not english:
+            bot_norm = self._fallback_reply(state)
+            key = None  # never cache the canned fallback
+
+        self._remember(key, bot_norm)
+        return self._finish(cid, state, user_msg, bot_norm, first_turn)
+
+    async def _ahandle(
+        self,
+        cid: Optional[str],
+        user_msg: str,
+        provider: Optional[str],
+        stance: Optional[str],
+        deadline: Deadline,
+    ) -> Tuple[str, List[Dict[str, str]]]:
+        cid, state, first_turn = await self._aresolve(cid, user_msg, provider, stance)
+
+        key = self._opening_key(state, first_turn)
+        cached = await self._arecall(key)
+        if cached is not None:
+            return await self._afinish(cid, state, user_msg, cached, first_turn)
+
+        bot_raw = await self._acall(state, user_msg, deadline)
+        with tracing.span("postprocess"):
+            bot_norm = finalize(bot_raw or "", state["stance"])
+            english = bot_raw is not None and self._usable(bot_norm)
+        if not english:
+            bot_norm = self._fallback_reply(state)
+            key = None
+
+        await self._aremember(key, bot_norm)
+        return await self._afinish(cid, state, user_msg, bot_norm, first_turn)
+
+    async def astream(
+        self,
+        cid: Optional[str],
+        user_msg: str,
+        provider: Optional[str] = None,
+        stance: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Streaming turn. Yields ("meta", {...}) first, then ("delta", text) chunks,
+        and finally ("done", {...}) with the persisted history. The "done" payload
+        is authoritative: it differs from the deltas only if the English check
+        forced a retry/fallback after the stream finished.
+        """
+        with metrics.in_flight(metrics.TURN_SECONDS, metrics.TURNS_IN_FLIGHT, "stream"), tracing.span("turn"):
+            async with self._alocked(cid):
+                async for event in self._astream(cid, user_msg, provider, stance, deadline or Deadline()):
+                    yield event
+
+    async def _astream(
+        self,
+        cid: Optional[str],
+        user_msg: str,
+        provider: Optional[str],
+        stance: Optional[str],
+        deadline: Deadline,
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        cid, state, first_turn = await self._aresolve(cid, user_msg, provider, stance)
         if first_turn:
-            banner = _opening_banner(state["topic"], state["stance"])
-            if banner.lower() not in bot_norm.lower():
-                bot_norm = re.sub(
-                    r"^\s*\[\[STANCE:[^\]]+\]\]\s*",
-                    lambda m: m.group(0) + " " + banner + " ",
-                    bot_norm,
-                )
-            bot_norm = _truncate_words(bot_norm, 180)  # re-trunca por si creció
+            await self._acreate(cid, state)
+        yield "meta", {"conversation_id": cid, "provider": state["provider"], "stance": state["stance"]}
 
-        #Save history (keep only last 10 entries)
-        state["history"].extend([
-            {"role": "user", "message": user_msg},
-            {"role": "bot",  "message": bot_norm},
-        ])
-        state["history"] = state["history"][-HISTORY_CAP:]
-        self.store.set(cid, state)
+        key = self._opening_key(state, first_turn)
+        cached = await self._arecall(key)
+        if cached is not None:
+            cid, history = await self._afinish(cid, state, user_msg, cached, first_turn)
+            yield "delta", history[-1]["message"]
+            yield "done", {"conversation_id": cid, "message": history}
+            return
 
-        return cid, state["history"]
+        banner = opening_banner(state["topic"], state["stance"]) if first_turn else None
+        reply = ReplyStream(state["stance"], banner=banner)
+        raw: List[str] = []
+        # Retried only until the first delta; every delta must land within the deadline.
+        # Closed on exit so an early break frees the admission slot right away.
+        deltas = self.retry.aiter(
+            lambda t: self._aupstream_stream(state["provider"], state, user_msg, deadline, t),
+            deadline,
+            state["provider"],
+        )
+        with self._scored(state["provider"]) as first_byte:
+            async with aclosing(deltas):
+                async for delta in deltas:
+                    first_byte()   # the selector scores streams by time to first delta
+                    raw.append(delta)
+                    chunk = reply.feed(delta)
+                    if chunk:
+                        yield "delta", chunk
+                    if reply.done:
+                        break
+        chunk = reply.close()
+        if chunk:
+            yield "delta", chunk
+        bot_norm = reply.text
+        with tracing.span("postprocess"):
+            full = "".join(raw)
+            cacheable = finalize(full, state["stance"])
+            # The English check needs the whole reply, so it runs once the stream ends.
+            # Checked without the banner: the topic may be in another language.
+            english = self._usable(cacheable)
+
+        # The stream was round one; repairs come out of the same budget.
+        if english:
+            self.generation.record(1, 0, not has_marker(full, state["stance"]), 1, {})
+        else:
+            bot_retry = await self._acall(state, user_msg, deadline, repair=True)
+            bot_norm = cacheable = finalize(bot_retry or "", state["stance"])
+            if bot_retry is None or not self._usable(bot_norm):
+                bot_norm = self._fallback_reply(state)
+                key = None
+
+        await self._aremember(key, cacheable)  # pre-banner text, like the other paths
+        cid, history = await self._afinish(cid, state, user_msg, bot_norm, first_turn)
+        yield "done", {"conversation_id": cid, "message": history}
@@ -1,21 +1,283 @@
+import asyncio
+import sys
+import threading
+import time
 import uuid
-from typing import Dict, List, Optional, TypedDict
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Callable, Dict, Iterator, List, NotRequired, Optional, Tuple, TypedDict
 
 class ConversationState(TypedDict):
     topic: str
-    stance: str 
+    stance: str
     provider: str
     history: List[Dict]
+    # Rolling summary of messages that left the history window (api.context)
+    summary: NotRequired[str]
+    # Messages ever written (seq of the newest one): lines whole-state writes up with a stored transcript
+    message_count: NotRequired[int]
+
+
+class _Message:
+    # One history entry; role strings are interned so every record shares them
+    __slots__ = ("role", "message")
+
+    def __init__(self, role: str, message: str) -> None:
+        self.role = sys.intern(role)
+        self.message = message
+
+
+class _Record:
+    __slots__ = ("topic", "stance", "provider", "messages", "summary", "count", "touched", "size")
+
+    def __init__(self, state: ConversationState, touched: float) -> None:
+        self.topic = state["topic"]
+        self.stance = sys.intern(state["stance"])
+        self.provider = sys.intern(state["provider"])
+        self.messages: Tuple[_Message, ...] = tuple(_Message(m["role"], m["message"]) for m in state["history"])
+        self.summary = state.get("summary") or None
+        self.count = state.get("message_count")
+        self.touched = touched
+        self.size = _RECORD_OVERHEAD + sys.getsizeof(self.topic) + sys.getsizeof(self.summary or "") + sum(
+            _MESSAGE_OVERHEAD + sys.getsizeof(m.message) for m in self.messages
+        )
+
+    def to_state(self) -> ConversationState:
+        state: ConversationState = {
+            "topic": self.topic,
+            "stance": self.stance,
+            "provider": self.provider,
+            "history": [{"role": m.role, "message": m.message} for m in self.messages],
+        }
+        if self.summary:
+            state["summary"] = self.summary
+        if self.count is not None:
+            state["message_count"] = self.count
+        return state
+
+
+# Approximate per-object cost: slotted instance + dict entry / tuple slot
+_MESSAGE_OVERHEAD = sys.getsizeof(_Message("user", "")) + 8
+_RECORD_OVERHEAD = 256
+
+
+class _Budget:
+    """Conversation count and bytes summed over every shard, so the limits are global."""
+
+    def __init__(self, max_conversations: Optional[int], max_bytes: Optional[int]) -> None:
+        self.max_conversations = max_conversations
+        self.max_bytes = max_bytes
+        self.count = 0
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def add(self, count: int, size: int) -> None:
+        with self.lock:
+            self.count += count
+            self.bytes += size
+
+    def over(self) -> bool:
+        return (self.max_conversations is not None and self.count > self.max_conversations) or (
+            self.max_bytes is not None and self.bytes > self.max_bytes
+        )
+
+
+class _Shard:
+    """One slice of the keyspace with its own LRU order, byte count and lock."""
+
+    def __init__(self, budget: _Budget, idle_ttl: Optional[float]) -> None:
+        self.budget = budget
+        self.idle_ttl = idle_ttl
+        self.bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.db: "OrderedDict[str, _Record]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, cid: str, now: float) -> Optional[ConversationState]:
+        with self.lock:
+            rec = self.db.get(cid)
+            if rec is None:
+                return None
+            if self.idle_ttl is not None and now - rec.touched > self.idle_ttl:
+                self._drop(cid)
+                self.expirations += 1
+                return None
+            rec.touched = now
+            self.db.move_to_end(cid)
+            return rec.to_state()
+
+    def set(self, cid: str, rec: _Record, now: float) -> None:
+        with self.lock:
+            old = self.db.pop(cid, None)
+            self.db[cid] = rec
+            self.bytes += rec.size - (old.size if old is not None else 0)
+            self.budget.add(0 if old is not None else 1, rec.size - (old.size if old is not None else 0))
+            self._expire(now)
+
+    def _drop(self, cid: str) -> None:
+        rec = self.db.pop(cid)
+        self.bytes -= rec.size
+        self.budget.add(-1, -rec.size)
+
+    def _expire(self, now: float) -> None:
+        # Oldest-touched first, so we can stop at the first live record
+        if self.idle_ttl is None:
+            return
+        while self.db:
+            cid, rec = next(iter(self.db.items()))
+            if now - rec.touched <= self.idle_ttl:
+                break
+            self._drop(cid)
+            self.expirations += 1
+
+    def _victim(self, keep: str) -> Optional[str]:
+        for cid in self.db:
+            if cid != keep:
+                return cid
+        return None
+
+    def oldest(self, keep: str) -> Optional[float]:
+        """When this shard's least recently used record (other than `keep`) was touched."""
+        with self.lock:
+            cid = self._victim(keep)
+            return self.db[cid].touched if cid is not None else None
+
+    def evict(self, keep: str) -> bool:
+        with self.lock:
+            cid = self._victim(keep)
+            if cid is None:
+                return False
+            self._drop(cid)
+            self.evictions += 1
+            return True
+
+
+class _KeyedLocks:
+    """
+    One lock per conversation, created on first use and dropped when nobody
+    holds or waits for it. The registry itself is striped, so taking a
+    conversation lock never touches a global mutex.
+    """
+
+    def __init__(self, stripes: int, factory: Callable[[], object]) -> None:
+        self.factory = factory
+        self._stripes = [(threading.Lock(), {}) for _ in range(stripes)]
+
+    def _stripe(self, cid: str):
+        return self._stripes[hash(cid) % len(self._stripes)]
+
+    def checkout(self, cid: str):
+        guard, table = self._stripe(cid)
+        with guard:
+            entry = table.get(cid)
+            if entry is None:
+                entry = table[cid] = [self.factory(), 0]
+            entry[1] += 1
+            return entry[0]
+
+    def checkin(self, cid: str) -> None:
+        guard, table = self._stripe(cid)
+        with guard:
+            entry = table[cid]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del table[cid]
+
 
 class InMemoryConversationStore:
-    def __init__(self) -> None:
-        self._db: Dict[str, ConversationState] = {}
+    """
+    Process-local store. With no limits it behaves like a plain dict; with
+    `max_conversations` / `max_bytes` it evicts least-recently-used
+    conversations, and `idle_ttl` drops conversations nobody touched for that
+    many seconds. Conversations are kept as slotted records, not dicts.
+
+    The keyspace is split into `shards`, each with its own lock and LRU order.
+    Limits are global: the shards share one count/byte budget, and a write
+    that goes over it evicts the least recently used head across all shards.
+    `lock(cid)` / `alock(cid)`
+    serialize whole turns on one conversation without blocking others.
+    """
+
+    def __init__(
+        self,
+        max_conversations: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        idle_ttl: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+        shards: int = 16,
+    ) -> None:
+        self.max_conversations = max_conversations
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.clock = clock
+        self._budget = _Budget(max_conversations, max_bytes)
+        self._shards = [_Shard(self._budget, idle_ttl) for _ in range(shards)]
+        # One evictor at a time, so concurrent writes never evict more than needed
+        self._evicting = threading.Lock()
+        self._locks = _KeyedLocks(shards, threading.Lock)
+        self._alocks = _KeyedLocks(shards, asyncio.Lock)
+
+    def _shard(self, cid: str) -> _Shard:
+        return self._shards[hash(cid) % len(self._shards)]
 
     def new_id(self) -> str:
         return uuid.uuid4().hex
 
     def get(self, cid: str) -> Optional[ConversationState]:
-        return self._db.get(cid)
+        return self._shard(cid).get(cid, self.clock())
 
     def set(self, cid: str, state: ConversationState) -> None:
-        self._db[cid] = state
+        now = self.clock()
+        # Build the compact record outside the shard lock
+        self._shard(cid).set(cid, _Record(state, now), now)
+        if self._budget.over():
+            self._evict(keep=cid)
+
+    def _evict(self, keep: str) -> None:
+        # Shard locks are taken one at a time, never nested
+        with self._evicting:
+            while self._budget.over():
+                heads = [(t, sh) for sh in self._shards for t in (sh.oldest(keep),) if t is not None]
+                if not heads or not min(heads, key=lambda h: h[0])[1].evict(keep):
+                    break
+
+    @contextmanager
+    def lock(self, cid: str) -> Iterator[None]:
+        """Serializes sync turns on one conversation (threadpool endpoints)."""
+        lk = self._locks.checkout(cid)
+        try:
+            with lk:
+                yield
+        finally:
+            self._locks.checkin(cid)
+
+    @asynccontextmanager
+    async def alock(self, cid: str) -> AsyncIterator[None]:
+        """Serializes async turns on one conversation, in arrival order."""
+        lk = self._alocks.checkout(cid)
+        try:
+            async with lk:
+                yield
+        finally:
+            self._alocks.checkin(cid)
+
+    @property
+    def bytes(self) -> int:
+        return sum(sh.bytes for sh in self._shards)
+
+    @property
+    def evictions(self) -> int:
+        return sum(sh.evictions for sh in self._shards)
+
+    def footprint(self) -> Dict[str, Optional[float]]:
+        return {
+            "conversations": sum(len(sh.db) for sh in self._shards),
+            "bytes": self.bytes,
+            "max_conversations": self.max_conversations,
+            "max_bytes": self.max_bytes,
+            "idle_ttl_s": self.idle_ttl,
+            "shards": len(self._shards),
+            "evictions": self.evictions,
+            "expirations": sum(sh.expirations for sh in self._shards),
+        }
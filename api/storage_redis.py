@@ -0,0 +1,168 @@
+import json
+import os
+import uuid
+from typing import Dict, List, Optional
+
+from .storage_memory import ConversationState
+
+
+class RedisConversationStore:
+    """
+    Out-of-process store speaking the Redis protocol, so every uvicorn worker
+    (and every host) sees the same conversations.
+
+    - `<prefix>:<cid>`      hash: topic / stance / provider / summary
+    - `<prefix>:<cid>:msgs` list: one JSON [role, message] per entry,
+                            LTRIMmed to the last `history_limit`
+    - `<prefix>:<cid>:log`  list: the same entries, never trimmed or rewritten (full
+                            transcript; seq = list index + 1)
+
+    Reads and writes are single pipelined round trips; writes run as
+    MULTI/EXEC so concurrent turns from different workers never interleave
+    inside one append. `ttl` (seconds) expires idle conversations.
+    """
+
+    def __init__(self, client, history_limit: int = 10, ttl: Optional[int] = None, prefix: str = "rickbot:conv") -> None:
+        # client: redis.asyncio.Redis (or a compatible stand-in such as fakeredis)
+        self.client = client
+        self.history_limit = history_limit
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _keys(self, cid: str):
+        meta = f"{self.prefix}:{cid}"
+        return meta, meta + ":msgs"
+
+    def _log_key(self, cid: str) -> str:
+        return f"{self.prefix}:{cid}:log"
+
+    @staticmethod
+    def _encode(m: Dict[str, str]) -> str:
+        return json.dumps([m["role"], m["message"]], ensure_ascii=False, separators=(",", ":"))
+
+    def new_id(self) -> str:
+        return uuid.uuid4().hex
+
+    async def get(self, cid: str) -> Optional[ConversationState]:
+        meta_key, msgs_key = self._keys(cid)
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.hgetall(meta_key)
+            pipe.lrange(msgs_key, -self.history_limit, -1)
+            meta, raw = await pipe.execute()
+        if not meta:
+            return None
+        meta = {_str(k): _str(v) for k, v in meta.items()}
+        history = [dict(zip(("role", "message"), json.loads(r))) for r in raw]
+        state: ConversationState = {
+            "topic": meta["topic"],
+            "stance": meta["stance"],
+            "provider": meta["provider"],
+            "history": history,
+        }
+        if meta.get("summary"):
+            state["summary"] = meta["summary"]
+        return state
+
+    async def messages(self, cid: str, before: Optional[int] = None, limit: int = 50) -> Optional[List[Dict]]:
+        """Transcript page, oldest first; None if the conversation does not exist."""
+        meta_key, _ = self._keys(cid)
+        log_key = self._log_key(cid)
+        if before is not None and before <= 1:
+            return [] if await self.client.exists(meta_key) else None
+        if before is None:
+            start, end = -limit, -1
+        else:
+            # A cursor past the end means "newest page", as in the other stores
+            async with self.client.pipeline(transaction=False) as pipe:
+                pipe.exists(meta_key)
+                pipe.llen(log_key)
+                exists, total = await pipe.execute()
+            if not exists:
+                return None
+            before = min(before, total + 1)
+            # seq s lives at index s-1, so a keyset page is a plain index range
+            start, end = max(0, before - 1 - limit), before - 2
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.exists(meta_key)
+            pipe.llen(log_key)
+            pipe.lrange(log_key, start, end)
+            exists, total, raw = await pipe.execute()
+        if not exists:
+            return None
+        last = total if before is None else before - 1
+        first = last - len(raw) + 1
+        return [
+            dict(zip(("role", "message"), json.loads(r)), seq=first + i)
+            for i, r in enumerate(raw)
+        ]
+
+    def _write_meta(self, pipe, cid: str, state: ConversationState) -> None:
+        meta_key, _ = self._keys(cid)
+        pipe.hset(meta_key, mapping={
+            "topic": state["topic"],
+            "stance": state["stance"],
+            "provider": state["provider"],
+            "summary": state.get("summary") or "",
+        })
+
+    def _tail(self, pipe, cid: str) -> None:
+        meta_key, msgs_key = self._keys(cid)
+        pipe.ltrim(msgs_key, -self.history_limit, -1)
+        if self.ttl:
+            pipe.expire(meta_key, self.ttl)
+            pipe.expire(msgs_key, self.ttl)
+            pipe.expire(self._log_key(cid), self.ttl)
+
+    async def append(self, cid: str, state: ConversationState, messages: List[Dict[str, str]]) -> None:
+        """Pushes only the new messages and trims the list, in one MULTI/EXEC."""
+        _, msgs_key = self._keys(cid)
+        async with self.client.pipeline(transaction=True) as pipe:
+            self._write_meta(pipe, cid, state)
+            if messages:
+                encoded = [self._encode(m) for m in messages]
+                pipe.rpush(msgs_key, *encoded)
+                pipe.rpush(self._log_key(cid), *encoded)
+            self._tail(pipe, cid)
+            await pipe.execute()
+
+    async def set(self, cid: str, state: ConversationState) -> None:
+        """Rewrites the meta and the capped window; the transcript log is only seeded, never rewritten."""
+        _, msgs_key = self._keys(cid)
+        log_key = self._log_key(cid)
+        history = list(state["history"] or [])
+        encoded = [self._encode(m) for m in history]
+        seed = bool(encoded) and not await self.client.exists(log_key)
+        async with self.client.pipeline(transaction=True) as pipe:
+            self._write_meta(pipe, cid, state)
+            pipe.delete(msgs_key)
+            if encoded:
+                pipe.rpush(msgs_key, *encoded)
+            if seed:
+                pipe.rpush(log_key, *encoded)   # a conversation created by set()
+            self._tail(pipe, cid)
+            await pipe.execute()
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+def _str(v) -> str:
+    return v.decode("utf-8") if isinstance(v, bytes) else v
+
+
+def from_env(history_limit: int = 10) -> RedisConversationStore:
+    """REDIS_URL, REDIS_TTL_S (unset = keep forever), REDIS_PREFIX, REDIS_MAX_CONNECTIONS."""
+    import redis.asyncio as redis
+
+    client = redis.Redis.from_url(
+        os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+        max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", "100")),
+        decode_responses=True,
+    )
+    ttl = os.getenv("REDIS_TTL_S")
+    return RedisConversationStore(
+        client,
+        history_limit=history_limit,
+        ttl=int(ttl) if ttl else None,
+        prefix=os.getenv("REDIS_PREFIX", "rickbot:conv"),
+    )
@@ -0,0 +1,262 @@
+# api/tracing.py
+"""
+Request-scoped timing: where did this turn's time go?
+
+An endpoint opens a `Trace` (tracing.request); code below it marks spans with
+`span("store.get")` and friends. Spans nest through a ContextVar, so they
+follow the request into asyncio tasks and worker threads (to_thread and
+run_in_threadpool copy the context). Outside a request `span` does nothing
+beyond one ContextVar read.
+
+When the trace closes:
+
+- `server_timing()` sums the spans by name for the `Server-Timing` header
+  (TRACE_SERVER_TIMING=0 turns it off);
+- with TRACE_EXPORT_PATH set, it is appended to that file as one line of
+  OTLP/JSON (`resourceSpans`), which OpenTelemetry collectors and viewers read;
+- with PROFILE_EVERY_N and/or PROFILE_SLOW_MS set, a sampling profiler has been
+  watching the request's thread and its stacks are written to PROFILE_DIR in
+  collapsed format (flamegraph.pl, speedscope) for every Nth request and for
+  any request slower than the threshold.
+
+Both files are written by a background thread (`writer`), never on the
+request's own thread or the event loop.
+"""
+import functools
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
+
+from api.background import BackgroundWriter
+
+SERVER_TIMING = os.getenv("TRACE_SERVER_TIMING", "1") == "1"
+EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "")
+PROFILE_EVERY_N = int(os.getenv("PROFILE_EVERY_N", "0"))
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", "profiles"))
+
+# (span id, parent id, name, start, end, error) — times from perf_counter
+SpanRecord = Tuple[str, str, str, float, float, Optional[str]]
+
+F = TypeVar("F", bound=Callable)
+
+_trace: ContextVar[Optional["Trace"]] = ContextVar("trace", default=None)
+_parent: ContextVar[str] = ContextVar("span_parent", default="")
+_ids = itertools.count(1)
+_requests = itertools.count(1)
+
+
+class Trace:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.trace_id = os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.spans: List[SpanRecord] = []
+        # Wall clock once, perf_counter for every duration
+        self.wall_ns = time.time_ns()
+        self.t0 = time.perf_counter()
+        self.t1: Optional[float] = None
+        self.error: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        return (self.t1 if self.t1 is not None else time.perf_counter()) - self.t0
+
+    def server_timing(self) -> str:
+        """`name;dur=ms` per span name (summed), `;desc="xN"` when it ran N>1 times, then the total."""
+        totals: Dict[str, List[float]] = {}
+        for _, _, name, start, end, _ in list(self.spans):
+            entry = totals.setdefault(name, [0.0, 0])
+            entry[0] += end - start
+            entry[1] += 1
+        parts = [
+            f'{name};desc="x{n}";dur={secs * 1000:.1f}' if n > 1 else f"{name};dur={secs * 1000:.1f}"
+            for name, (secs, n) in totals.items()
+        ]
+        parts.append(f"total;dur={self.duration * 1000:.1f}")
+        return ", ".join(parts)
+
+    def _nanos(self, t: float) -> str:
+        return str(self.wall_ns + int((t - self.t0) * 1e9))
+
+    def otlp(self) -> Dict[str, object]:
+        """The trace as an OTLP/JSON export request (one resource, one scope)."""
+        def record(span_id, parent, name, start, end, error):
+            out = {
+                "traceId": self.trace_id,
+                "spanId": span_id,
+                "name": name,
+                "kind": 2 if span_id == self.span_id else 1,   # SERVER root, INTERNAL children
+                "startTimeUnixNano": self._nanos(start),
+                "endTimeUnixNano": self._nanos(end),
+                "status": {"code": 2, "message": error} if error else {"code": 0},
+            }
+            if parent:
+                out["parentSpanId"] = parent
+            return out
+
+        root = (self.span_id, "", self.name, self.t0, self.t0 + self.duration, self.error)
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "rickbot"}}]},
+                "scopeSpans": [{
+                    "scope": {"name": "api.tracing"},
+                    "spans": [record(*s) for s in [root, *self.spans]],
+                }],
+            }],
+        }
+
+
+class span:
+    """Times a block as a child of the current span; a no-op outside a request."""
+
+    __slots__ = ("name", "trace", "id", "parent", "t0")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __enter__(self) -> "span":
+        self.trace = _trace.get()
+        if self.trace is not None:
+            self.id = f"{next(_ids):016x}"
+            self.parent = _parent.get() or self.trace.span_id
+            _parent.set(self.id)
+            self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if self.trace is None:
+            return
+        # Not a reset(token): async generators may close in another context
+        _parent.set(self.parent)
+        error = exc_type.__name__ if exc_type is not None and issubclass(exc_type, Exception) else None
+        self.trace.spans.append((self.id, self.parent, self.name, self.t0, time.perf_counter(), error))
+
+
+def traced(name: str) -> Callable[[F], F]:
+    """Decorator form of `span` for sync functions."""
+    def wrap(fn: F) -> F:
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return inner   # type: ignore[return-value]
+    return wrap
+
+
+class _Sampler:
+    """
+    One daemon thread that, while any request is being profiled, reads the
+    stack of each profiled request's thread every PROFILE_INTERVAL_MS. On the
+    event loop that thread is shared, so concurrent requests see each other's
+    samples; time spent in `select` is time spent waiting on I/O.
+    """
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self.active: Dict[int, Tuple[int, Counter]] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, key: int) -> None:
+        self.active[key] = (threading.get_ident(), Counter())
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+            self._thread.start()
+
+    def stop(self, key: int) -> Counter:
+        return self.active.pop(key, (0, Counter()))[1]
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            if not self.active:
+                continue
+            frames = sys._current_frames()
+            for tid, samples in list(self.active.values()):
+                frame = frames.get(tid)
+                if frame is not None:
+                    samples[_collapse(frame)] += 1
+
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+_sampler = _Sampler(PROFILE_INTERVAL_MS / 1000) if (PROFILE_EVERY_N or PROFILE_SLOW_MS) else None
+writer = BackgroundWriter("trace-export")
+
+
+class request:
+    """
+    Opens a Trace for one request and makes it current: `with request(name) as trace`.
+    A streaming body runs after the endpoint has returned: open it with
+    finish=False, enter it again around the body, and call finish() at the end.
+    """
+
+    __slots__ = ("trace", "seq", "auto_finish", "_tokens")
+
+    def __init__(self, name: str, finish: bool = True) -> None:
+        self.trace = Trace(name)
+        self.seq = next(_requests)
+        self.auto_finish = finish
+        if _sampler is not None:
+            _sampler.start(self.seq)
+
+    def __enter__(self) -> Trace:
+        self._tokens = (_trace.set(self.trace), _parent.set(""))
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        try:
+            _trace.reset(self._tokens[0])
+            _parent.reset(self._tokens[1])
+        except ValueError:   # a streaming body finalized from another context
+            _trace.set(None)
+            _parent.set("")
+        if exc_type is not None and self.trace.error is None:
+            self.trace.error = exc_type.__name__
+        if self.auto_finish:
+            self.finish()
+
+    def finish(self) -> Trace:
+        trace = self.trace
+        if trace.t1 is not None:
+            return trace
+        trace.t1 = time.perf_counter()
+        if EXPORT_PATH:
+            writer.submit(_export, trace)
+        if _sampler is not None:
+            samples = _sampler.stop(self.seq)
+            slow = PROFILE_SLOW_MS and trace.duration * 1000 >= PROFILE_SLOW_MS
+            nth = PROFILE_EVERY_N and self.seq % PROFILE_EVERY_N == 0
+            if samples and (slow or nth):
+                writer.submit(_dump_profile, trace, samples)
+        return trace
+
+
+def _export(trace: Trace) -> None:
+    # Runs on the writer thread, one trace at a time
+    line = json.dumps(trace.otlp(), separators=(",", ":"))
+    with open(EXPORT_PATH, "a", encoding="utf-8") as f:
+        f.write(line + "\n")
+
+
+def _dump_profile(trace: Trace, samples: Counter) -> None:
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    path = PROFILE_DIR / f"{int(trace.wall_ns // 1_000_000)}-{trace.trace_id[:8]}-{int(trace.duration * 1000)}ms.collapsed"
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, n in samples.most_common():
+            f.write(f"{stack} {n}\n")
@@ -0,0 +1,126 @@
+# api/transport.py
+"""
+Shared HTTP transport for the OpenAI-compatible providers (OpenAI, DeepSeek).
+
+One sync and one async `httpx` client are shared by every adapter, so TCP/TLS
+connections are reused across providers' requests instead of each SDK client
+keeping its own cold pool. Pool sizes, keep-alive and HTTP/2 come from env:
+
+    HTTP_MAX_CONNECTIONS      max open connections (default 100)
+    HTTP_MAX_KEEPALIVE        idle connections kept in the pool (default 20)
+    HTTP_KEEPALIVE_EXPIRY     seconds an idle connection is kept (default 120)
+    HTTP2                     1 = negotiate HTTP/2 (needs the `h2` package)
+    HTTP_WARM_CONNECTIONS     connections opened per host on startup (default 2)
+    <PROVIDER>_TIMEOUT        per-provider request timeout in seconds, e.g. OPENAI_TIMEOUT
+"""
+import asyncio
+import os
+from typing import Callable, Dict, Iterable, List, Optional
+
+import httpx
+
+DEFAULT_TIMEOUTS = {"openai": 30.0, "deepseek": 45.0, "gemini": 30.0}
+CONNECT_TIMEOUT = 5.0
+
+_client: Optional[httpx.Client] = None
+_async_client: Optional[httpx.AsyncClient] = None
+_response_hooks: List[Callable[[str, httpx.Headers], None]] = []
+
+
+def on_response(hook: Callable[[str, httpx.Headers], None]) -> None:
+    """Registers hook(host, headers) for every upstream response (e.g. rate-limit headers)."""
+    _response_hooks.append(hook)
+
+
+def _dispatch(response: httpx.Response) -> None:
+    for hook in _response_hooks:
+        hook(response.request.url.host, response.headers)
+
+
+async def _adispatch(response: httpx.Response) -> None:
+    _dispatch(response)
+
+
+def _env_float(name: str, default: float) -> float:
+    raw = os.getenv(name)
+    return float(raw) if raw else default
+
+
+def _http2_enabled() -> bool:
+    if os.getenv("HTTP2", "0") != "1":
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=int(_env_float("HTTP_MAX_CONNECTIONS", 100)),
+        max_keepalive_connections=int(_env_float("HTTP_MAX_KEEPALIVE", 20)),
+        keepalive_expiry=_env_float("HTTP_KEEPALIVE_EXPIRY", 120.0),
+    )
+
+
+def provider_timeout(provider: str) -> httpx.Timeout:
+    """Read/write/pool budget for one provider; connect stays short everywhere."""
+    total = _env_float(f"{provider.upper()}_TIMEOUT", DEFAULT_TIMEOUTS.get(provider, 30.0))
+    return httpx.Timeout(total, connect=min(CONNECT_TIMEOUT, total))
+
+
+def http_client() -> httpx.Client:
+    global _client
+    if _client is None:
+        _client = httpx.Client(
+            limits=limits(),
+            http2=_http2_enabled(),
+            timeout=provider_timeout("default"),
+            event_hooks={"response": [_dispatch]},
+        )
+    return _client
+
+
+def async_http_client() -> httpx.AsyncClient:
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(
+            limits=limits(),
+            http2=_http2_enabled(),
+            timeout=provider_timeout("default"),
+            event_hooks={"response": [_adispatch]},
+        )
+    return _async_client
+
+
+async def warm_up(base_urls: Iterable[str], per_host: Optional[int] = None) -> Dict[str, bool]:
+    """
+    Opens `per_host` pooled connections to each base URL (DNS + TCP + TLS) so
+    the first real turn does not pay for them. Any HTTP status counts as warm:
+    only the connection matters, not the (unauthenticated) response.
+    """
+    n = per_host if per_host is not None else int(_env_float("HTTP_WARM_CONNECTIONS", 2))
+    client = async_http_client()
+
+    async def _touch(url: str) -> bool:
+        try:
+            await client.get(url, timeout=httpx.Timeout(CONNECT_TIMEOUT))
+            return True
+        except httpx.HTTPError:
+            return False
+
+    urls = list(dict.fromkeys(base_urls))
+    results = await asyncio.gather(*(_touch(u) for u in urls for _ in range(max(n, 1))))
+    per_url = max(n, 1)
+    return {u: any(results[i * per_url:(i + 1) * per_url]) for i, u in enumerate(urls)}
+
+
+async def aclose() -> None:
+    global _client, _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+    if _client is not None:
+        _client.close()
+        _client = None
@@ -0,0 +1,74 @@
+"""
+Accuracy and throughput of the English check: the old stop-word heuristic vs
+the trigram identifier (api.langid), on the labelled corpus in bench/data.
+
+    PYTHONPATH=. python bench/bench_langid.py [--n 20000] [--threshold 0.9]
+
+"false retry" = English reply flagged as not English (costs an extra round);
+"missed" = non-English reply accepted.
+"""
+import argparse
+import json
+import re
+import timeit
+from pathlib import Path
+
+from api import langid
+
+EVAL = Path(__file__).parent / "data" / "langid_eval.jsonl"
+
+
+def legacy_seems_english(text):
+    low = (text or "").lower()
+    if re.search(r"[áéíóúñ¡¿]", low):
+        return False
+    es_hits = sum(w in low for w in [" el ", " la ", " los ", " las ", " que ", " de ", " y ", " en ", " por ", " para ", " con "])
+    en_hits = sum(w in low for w in [" the ", " and ", " of ", " to ", " in ", " for ", " with ", " on "])
+    return en_hits >= es_hits
+
+
+def load(path=EVAL):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def score(name, check, rows):
+    english = [r for r in rows if r["lang"] == "en"]
+    other = [r for r in rows if r["lang"] != "en"]
+    false_retry = sum(not check(r["text"]) for r in english)
+    missed = sum(check(r["text"]) for r in other)
+    correct = len(rows) - false_retry - missed
+    print(f"  {name:<28} accuracy {correct / len(rows):6.1%}   false retries {false_retry:>2}/{len(english)}"
+          f"   missed {missed:>2}/{len(other)}")
+
+
+def throughput(name, fn, texts, n):
+    number = max(1, n // len(texts))
+    per = timeit.timeit(lambda: fn(texts), number=number) / (number * len(texts))
+    print(f"  {name:<28} {per * 1e6:8.2f} µs/text   {1 / per:10.0f} texts/s")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=20000, help="texts per measurement")
+    ap.add_argument("--threshold", type=float, default=langid.THRESHOLD)
+    args = ap.parse_args()
+    rows = load()
+    texts = [r["text"] for r in rows]
+    model = langid.MODEL
+
+    print(f"English check ({len(rows)} labelled texts)")
+    score("stop words (before)", legacy_seems_english, rows)
+    score(f"trigrams, threshold {args.threshold}", lambda t: model.is_english(t, threshold=args.threshold), rows)
+    detected = model.detect_batch(texts)
+    exact = sum(lang == r["lang"] for (lang, _), r in zip(detected, rows))
+    print(f"  {'trigrams, exact language':<28} accuracy {exact / len(rows):6.1%}")
+    print("throughput")
+    throughput("stop words (before)", lambda ts: [legacy_seems_english(t) for t in ts], texts, args.n)
+    throughput("is_english", lambda ts: [model.is_english(t) for t in ts], texts, args.n)
+    throughput("detect", lambda ts: [model.detect(t) for t in ts], texts, args.n)
+    throughput("detect_batch", model.detect_batch, texts, args.n)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Micro-benchmark: per-reply post-processing cost, before and after api.postprocess.
+
+    PYTHONPATH=. python bench/bench_postprocess.py [--n 20000]
+
+"before" is the pipeline as it was (adapter tag check, _normalize_marker,
+_truncate_words, _seems_english, banner regex + second truncation), copied
+here verbatim so the comparison keeps working after the old helpers are gone.
+"""
+import argparse
+import random
+import re
+import timeit
+
+from api.langid import is_english
+from api.postprocess import ReplyStream, finalize, opening_banner, strip_tag_and_check
+
+# --- before -------------------------------------------------------------------
+
+def legacy_strip_tag_and_check(text, stance):
+    t = (text or "").strip()
+    m = re.match(r"\s*\[\[STANCE\s*:\s*([^\]]+)\]\]\s*", t, re.I)
+    declared = m.group(1).lower().strip() if m else None
+    body = t[m.end():].lstrip() if m else t
+    ok = declared in {"pro", "contra"} and declared == stance
+    return body, ok
+
+
+def legacy_normalize_marker(text, stance):
+    t = (text or "").strip()
+    if re.match(r"^\s*\[\[STANCE\s*:\s*contra\]\]\s*", t, re.I) and stance == "pro":
+        t = re.sub(r"^\s*\[\[STANCE\s*:\s*contra\]\]\s*", f"[[STANCE:{stance}]] ", t, flags=re.I)
+        return t.strip()
+    if re.match(r"^\s*\[\[STANCE\s*:\s*pro\]\]\s*", t, re.I) and stance == "contra":
+        t = re.sub(r"^\s*\[\[STANCE\s*:\s*pro\]\]\s*", f"[[STANCE:{stance}]] ", t, flags=re.I)
+        return t.strip()
+    if not re.match(r"^\s*\[\[STANCE\s*:\s*(pro|contra)\]\]\s*", t, re.I):
+        t = f"[[STANCE:{stance}]] " + t
+    return t.strip()
+
+
+def legacy_truncate_words(text, limit=180):
+    words = (text or "").split()
+    return " ".join(words[:limit]).strip()
+
+
+def legacy_seems_english(text):
+    low = (text or "").lower()
+    if re.search(r"[áéíóúñ¡¿]", low):
+        return False
+    es_hits = sum(w in low for w in [" el ", " la ", " los ", " las ", " que ", " de ", " y ", " en ", " por ", " para ", " con "])
+    en_hits = sum(w in low for w in [" the ", " and ", " of ", " to ", " in ", " for ", " with ", " on "])
+    return en_hits >= es_hits
+
+
+def legacy_pipeline(raw, stance, banner):
+    body, ok = legacy_strip_tag_and_check(raw, stance)
+    text = f"[[STANCE:{stance}]] {body.strip()}" if ok else raw.strip()
+    norm = legacy_truncate_words(legacy_normalize_marker(text, stance), 180)
+    english = legacy_seems_english(norm)
+    if banner and banner.lower() not in norm.lower():
+        norm = re.sub(r"^\s*\[\[STANCE:[^\]]+\]\]\s*", lambda m: m.group(0) + " " + banner + " ", norm)
+    return legacy_truncate_words(norm, 180), english
+
+# --- after --------------------------------------------------------------------
+
+def pipeline(raw, stance, banner):
+    body, ok = strip_tag_and_check(raw, stance)
+    text = f"[[STANCE:{stance}]] {body}" if ok else raw
+    norm = finalize(text, stance)
+    english = is_english(norm)
+    return (finalize(norm, stance, banner) if banner else norm), english
+
+
+def stream(raw, stance, banner, size=6):
+    s = ReplyStream(stance, banner=banner)
+    for i in range(0, len(raw), size):
+        s.feed(raw[i:i + size])
+    s.close()
+    return s.text
+
+# ------------------------------------------------------------------------------
+
+WORDS = ("the evidence shows that cats and dogs differ in how they bond with people, "
+         "which matters for anyone choosing a pet; consider the data on care costs, "
+         "space, time and temperament before you decide.").split()
+
+
+def replies(count, rng):
+    out = []
+    for i in range(count):
+        body = " ".join(rng.choice(WORDS) for _ in range(rng.randint(120, 260)))
+        head = ("[[STANCE:pro]] ", "[[STANCE:contra]] ", "", "[[STANCE:st]] ")[i % 4]
+        out.append(head + body)
+    return out
+
+
+def bench(name, fn, samples, n):
+    per = timeit.timeit(lambda: [fn(s) for s in samples], number=max(1, n // len(samples))) / (max(1, n // len(samples)) * len(samples))
+    print(f"  {name:<34} {per * 1e6:8.2f} µs/reply")
+    return per
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=20000, help="replies per measurement")
+    args = ap.parse_args()
+    samples = replies(200, random.Random(1))
+    banner = opening_banner("Cats are better than dogs", "pro")
+
+    print("stage")
+    bench("tag check (before)", lambda s: legacy_strip_tag_and_check(s, "pro"), samples, args.n)
+    bench("tag check (after)", lambda s: strip_tag_and_check(s, "pro"), samples, args.n)
+    bench("marker + truncate (before)", lambda s: legacy_truncate_words(legacy_normalize_marker(s, "pro")), samples, args.n)
+    bench("finalize (after)", lambda s: finalize(s, "pro"), samples, args.n)
+    bench("seems_english (before)", legacy_seems_english, samples, args.n)
+    bench("langid.is_english (after)", is_english, samples, args.n)
+    print("whole reply")
+    for label, b in (("later turn", None), ("first turn (banner)", banner)):
+        before = bench(f"{label} (before)", lambda s: legacy_pipeline(s, "pro", b), samples, args.n)
+        after = bench(f"{label} (after)", lambda s: pipeline(s, "pro", b), samples, args.n)
+        print(f"  {'':<34} x{before / after:.2f}")
+    print("incremental")
+    bench("ReplyStream, 6-char deltas", lambda s: stream(s, "pro", None), samples, args.n // 10)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Micro-benchmarks for the per-turn text work the service does besides calling
+the provider: post-processing, the English check, context building, token
+estimates, cache keys and the prompt prefix.
+
+    PYTHONPATH=. python bench/bench_text.py [--n 20000]
+
+Reply post-processing against the old pipeline lives in bench_postprocess.py,
+and the English check's accuracy in bench_langid.py; this covers one whole
+turn's helpers at a glance, for spotting regressions.
+"""
+import argparse
+import random
+import timeit
+
+from api import context, langid
+from api.cache import cache_key
+from api.limits import estimate_tokens
+from api.postprocess import ReplyStream, finalize, opening_banner
+from api.prompts import prefix_key, system_prompt
+
+WORDS = ("the evidence shows that cats and dogs differ in how they bond with people, "
+         "which matters for anyone choosing a pet; consider the data on care costs, "
+         "space, time and temperament before you decide.").split()
+TOPIC = "Cats are better than dogs"
+
+
+def reply(rng: random.Random, words: int) -> str:
+    return "[[STANCE:pro]] " + " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def history(rng: random.Random, turns: int):
+    out = []
+    for i in range(turns):
+        out.append({"role": "user", "message": " ".join(rng.choice(WORDS) for _ in range(25))})
+        out.append({"role": "bot", "message": reply(rng, 150)})
+    return out
+
+
+def bench(name: str, fn, n: int) -> None:
+    per = timeit.timeit(fn, number=n) / n
+    print(f"  {name:<36} {per * 1e6:9.2f} µs")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=20000, help="calls per measurement")
+    args = ap.parse_args()
+    rng = random.Random(1)
+    raw = reply(rng, 200)
+    hist = history(rng, 5)
+    long_hist = history(rng, 20)
+    builder = context.ContextBuilder("openai", "gpt-4o-mini")
+    banner = opening_banner(TOPIC, "pro")
+    n = args.n
+
+    print("reply")
+    bench("finalize", lambda: finalize(raw, "pro"), n)
+    bench("finalize + banner", lambda: finalize(raw, "pro", banner), n)
+    bench("ReplyStream (6-char deltas)", lambda: _stream(raw), n // 20)
+    bench("langid.is_english", lambda: langid.is_english(raw), n)
+    print("context")
+    bench("ContextBuilder.build (10 messages)", lambda: builder.build(hist, "why?", ""), n // 10)
+    bench("ContextBuilder.build (40 messages)", lambda: builder.build(long_hist, "why?", ""), n // 10)
+    bench("context.fold (2 evicted)", lambda: context.fold("", hist[:2]), n // 10)
+    bench("limits.estimate_tokens", lambda: estimate_tokens(TOPIC, "why?", *(m["message"] for m in hist)), n)
+    print("keys and prompt")
+    bench("cache_key (empty history)", lambda: cache_key("openai", "gpt-4o-mini", TOPIC, "pro", []), n)
+    bench("system_prompt (cached)", lambda: system_prompt(TOPIC, "pro"), n)
+    bench("prefix_key", lambda: prefix_key(TOPIC, "pro"), n)
+
+
+def _stream(raw: str) -> str:
+    s = ReplyStream("pro")
+    for i in range(0, len(raw), 6):
+        s.feed(raw[i:i + 6])
+    s.close()
+    return s.text
+
+
+if __name__ == "__main__":
+    main()
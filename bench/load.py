@@ -0,0 +1,195 @@
+"""
+Load test: concurrent synthetic debates against the real FastAPI app, with
+the providers pointed at the local mock (bench/mock_provider.py).
+
+    PYTHONPATH=. python bench/load.py [--debates 40] [--turns 4] [--concurrency 16]
+                                      [--latency lognormal:0.2:0.4] [--error-rate 0.01]
+                                      [--scenarios memory:async,db:sync,...]
+
+Each scenario runs in its own process (fastapi_app reads its configuration at
+import), on a fresh SQLite file for the DB stores:
+
+  storage  memory | db (sync engine, group commit) | db_async (aiosqlite)
+  path     async  POST /conversation    (ConversationService.ahandle)
+           stream POST /conversation/stream
+           sync   ConversationService.handle from a thread pool; the app has
+                  no sync endpoint any more, so this drives the service the
+                  app built, with the same store and providers
+
+Requests go through httpx's ASGI transport (no socket between client and
+app); provider calls are real HTTP to the mock. Reported per scenario: turn
+latency p50/p95/p99, turns/s, failed turns and the mock's request count.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+
+import mock_provider
+
+ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_SCENARIOS = "memory:async,memory:stream,memory:sync,db:async,db:sync,db_async:async"
+TOPICS = ["Cats are better than dogs", "Remote work beats the office", "Cities should ban cars", "Nuclear power is green"]
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    i = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[i]
+
+
+def summarize(latencies: List[float], failures: int, elapsed: float) -> Dict[str, float]:
+    lat = sorted(latencies)
+    return {
+        "turns": len(lat),
+        "failed": failures,
+        "p50_ms": percentile(lat, 0.50) * 1000,
+        "p95_ms": percentile(lat, 0.95) * 1000,
+        "p99_ms": percentile(lat, 0.99) * 1000,
+        "turns_per_s": len(lat) / elapsed if elapsed else 0.0,
+    }
+
+# --- child: one scenario against the app ----------------------------------------
+
+async def _debates_http(app, path: str, args) -> Dict[str, float]:
+    import httpx
+
+    latencies: List[float] = []
+    failures = 0
+    endpoint = "/conversation/stream" if path == "stream" else "/conversation"
+    sem = asyncio.Semaphore(args.concurrency)
+
+    async def debate(client, i: int) -> None:
+        nonlocal failures
+        cid = None
+        async with sem:
+            for turn in range(args.turns):
+                msg = TOPICS[i % len(TOPICS)] if cid is None else f"Objection {turn}: why?"
+                headers = {"X-Stance": "pro" if i % 2 else "contra"} if cid is None else {}
+                t0 = time.perf_counter()
+                r = await client.post(endpoint, json={"conversation_id": cid, "message": msg}, headers=headers)
+                if r.status_code != 200 or (path == "stream" and "event: done" not in r.text):
+                    failures += 1
+                    return
+                latencies.append(time.perf_counter() - t0)
+                if cid is None:
+                    cid = _conversation_id(r.text, path)
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=120) as client:
+            t0 = time.perf_counter()
+            await asyncio.gather(*(debate(client, i) for i in range(args.debates)))
+            elapsed = time.perf_counter() - t0
+    return summarize(latencies, failures, elapsed)
+
+
+def _conversation_id(text: str, path: str) -> str:
+    if path != "stream":
+        return json.loads(text)["conversation_id"]
+    for line in text.splitlines():
+        if line.startswith("data: ") and '"conversation_id"' in line:
+            return json.loads(line[6:])["conversation_id"]
+    raise ValueError("no conversation_id in stream")
+
+
+def _debates_sync(service, args) -> Dict[str, float]:
+    latencies: List[float] = []
+    failures = 0
+
+    def debate(i: int) -> None:
+        nonlocal failures
+        cid = None
+        for turn in range(args.turns):
+            msg = TOPICS[i % len(TOPICS)] if cid is None else f"Objection {turn}: why?"
+            t0 = time.perf_counter()
+            try:
+                cid, _ = service.handle(cid, msg, stance="pro" if i % 2 else "contra")
+            except Exception:
+                failures += 1
+                return
+            latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        list(pool.map(debate, range(args.debates)))
+    return summarize(latencies, failures, time.perf_counter() - t0)
+
+
+def child(args) -> None:
+    storage, path = args.child.split(":")
+    sys.path.insert(0, str(ROOT))
+    os.chdir(ROOT)   # the app mounts ./static
+    import fastapi_app
+
+    if path == "sync":
+        result = _debates_sync(fastapi_app._service, args)
+    else:
+        result = asyncio.run(_debates_http(fastapi_app.app, path, args))
+    print(json.dumps(result))
+
+# --- parent: mock provider + one process per scenario ------------------------------
+
+def scenario_env(storage: str, mock_url: str, tmp: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    for k in ("GEMINI_API_KEY", "API_KEY", "DEEPSEEK_API_KEY", "USE_REDIS", "DEFAULT_PROVIDER"):
+        env.pop(k, None)
+    env.update(
+        OPENAI_API_KEY="mock",
+        OPENAI_BASE_URL=mock_url + "/v1",
+        HTTP_WARMUP="0",
+        RESPONSE_CACHE="off",
+        TRACE_EXPORT_PATH="",
+        USE_DB="0",
+        DB_ASYNC="0",
+        PYTHONPATH=os.pathsep.join([str(ROOT), str(ROOT / "bench")]),
+    )
+    if storage in ("db", "db_async"):
+        env.update(USE_DB="1", DB_URL=f"sqlite:///{tmp}/{storage}.db", DB_ASYNC="1" if storage == "db_async" else "0")
+    return env
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--debates", type=int, default=40)
+    ap.add_argument("--turns", type=int, default=4)
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--scenarios", default=DEFAULT_SCENARIOS)
+    ap.add_argument("--child", help=argparse.SUPPRESS)
+    mock_provider.config_args(ap)
+    args = ap.parse_args()
+    if args.child:
+        return child(args)
+
+    url, server = mock_provider.start(mock_provider.config_from(args))
+    app_state = server.config.app.state
+    print(f"mock provider {url}  latency={args.latency}  error_rate={args.error_rate}  "
+          f"debates={args.debates} x {args.turns} turns  concurrency={args.concurrency}")
+    print(f"{'scenario':<18}{'turns':>6}{'failed':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'turns/s':>9}{'upstream':>9}")
+    passthrough = [f"--debates={args.debates}", f"--turns={args.turns}", f"--concurrency={args.concurrency}"]
+    with tempfile.TemporaryDirectory() as tmp:
+        for scenario in args.scenarios.split(","):
+            before = app_state.requests
+            proc = subprocess.run(
+                [sys.executable, __file__, f"--child={scenario}", *passthrough],
+                env=scenario_env(scenario.split(":")[0], url, tmp), capture_output=True, text=True,
+            )
+            if proc.returncode != 0:
+                print(f"{scenario:<18} failed:\n{proc.stderr.strip()[-2000:]}")
+                continue
+            r = json.loads(proc.stdout.strip().splitlines()[-1])
+            print(f"{scenario:<18}{r['turns']:>6}{r['failed']:>7}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}"
+                  f"{r['p99_ms']:>9.1f}{r['turns_per_s']:>9.1f}{app_state.requests - before:>9}")
+    server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
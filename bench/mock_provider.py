@@ -0,0 +1,176 @@
+"""
+Local OpenAI-compatible provider for load tests: latency, errors and streaming on demand.
+
+    PYTHONPATH=. python bench/mock_provider.py --port 9100 --latency lognormal:0.4:0.5 --error-rate 0.02
+
+then point an adapter at it (OPENAI_BASE_URL=http://127.0.0.1:9100/v1, or
+DEEPSEEK_BASE_URL=http://127.0.0.1:9100). Serves POST /v1/chat/completions and
+/chat/completions with `n`, `stream` and `stream_options.include_usage`.
+
+Latency is time to first token, drawn per request from --latency:
+  fixed:S | uniform:LO:HI | lognormal:MEDIAN:SIGMA   (seconds)
+after which the words arrive at --words-per-s (all at once when not streaming).
+--error-rate answers that fraction with --error-status (429 carries Retry-After);
+--spanish-rate answers in Spanish, which exercises the service's repair rounds.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+ENGLISH = ("the evidence points one way: cats and dogs differ in how they bond with people, and that "
+           "matters for anyone choosing a pet, so consider the data on care costs, space, time and "
+           "temperament before you decide, because the long run favours the calmer and cheaper option").split()
+SPANISH = ("la evidencia apunta en una sola dirección: los gatos y los perros se diferencian en cómo se "
+           "relacionan con las personas y eso importa para quien elige una mascota").split()
+_STANCE = re.compile(r"FIXED stance: '(\w+)'")
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    kind, _, rest = spec.partition(":")
+    args = [float(x) for x in rest.split(":") if x]
+    if kind == "fixed":
+        return lambda rng: args[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(args[0], args[1])
+    if kind == "lognormal":
+        mu = math.log(args[0])
+        return lambda rng: rng.lognormvariate(mu, args[1])
+    raise ValueError(f"unknown latency distribution: {spec}")
+
+
+@dataclass
+class MockConfig:
+    latency: str = "fixed:0.05"
+    words_per_s: float = 400.0
+    min_words: int = 60
+    max_words: int = 140
+    error_rate: float = 0.0
+    error_status: int = 503
+    spanish_rate: float = 0.0
+    seed: Optional[int] = None
+
+
+def make_app(cfg: MockConfig) -> FastAPI:
+    app = FastAPI(title="mock provider")
+    rng = random.Random(cfg.seed)
+    ttft = parse_latency(cfg.latency)
+    app.state.requests = 0
+
+    def reply(stance: str) -> str:
+        words = SPANISH if rng.random() < cfg.spanish_rate else ENGLISH
+        body = " ".join(rng.choice(words) for _ in range(rng.randint(cfg.min_words, cfg.max_words)))
+        return f"[[STANCE:{stance}]] {body[0].upper()}{body[1:]}."
+
+    def usage(messages: List[Dict], texts: List[str]) -> Dict[str, int]:
+        prompt = sum(len(str(m.get("content", ""))) for m in messages) // 4
+        completion = sum(len(t.split()) for t in texts)
+        return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+    async def chat(request: Request):
+        app.state.requests += 1
+        payload = await request.json()
+        messages = payload.get("messages", [])
+        m = _STANCE.search(str(messages[0].get("content", ""))) if messages else None
+        stance = m.group(1) if m else "pro"
+        model = payload.get("model", "mock")
+        await asyncio.sleep(ttft(rng))
+        if rng.random() < cfg.error_rate:
+            headers = {"retry-after": "1"} if cfg.error_status == 429 else {}
+            return JSONResponse({"error": {"message": "injected failure", "type": "mock"}}, cfg.error_status, headers)
+        cid = "chatcmpl-" + uuid.uuid4().hex[:12]
+
+        if not payload.get("stream"):
+            texts = [reply(stance) for _ in range(int(payload.get("n") or 1))]
+            await asyncio.sleep(max(len(t.split()) for t in texts) / cfg.words_per_s)
+            return {
+                "id": cid, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [
+                    {"index": i, "message": {"role": "assistant", "content": t}, "finish_reason": "stop"}
+                    for i, t in enumerate(texts)
+                ],
+                "usage": usage(messages, texts),
+            }
+
+        text = reply(stance)
+        include_usage = (payload.get("stream_options") or {}).get("include_usage")
+
+        def chunk(delta: Dict, finish: Optional[str] = None, **extra) -> str:
+            body = {"id": cid, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish}] if delta is not None else [],
+                    **extra}
+            return f"data: {json.dumps(body)}\n\n"
+
+        async def events():
+            words = text.split(" ")
+            yield chunk({"role": "assistant", "content": ""})
+            for i in range(0, len(words), 3):
+                piece = " ".join(words[i:i + 3]) + (" " if i + 3 < len(words) else "")
+                yield chunk({"content": piece})
+                await asyncio.sleep(3 / cfg.words_per_s)
+            yield chunk({}, "stop")
+            if include_usage:
+                yield chunk(None, usage=usage(messages, [text]))
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    app.post("/v1/chat/completions")(chat)
+    app.post("/chat/completions")(chat)
+    return app
+
+
+def start(cfg: MockConfig, host: str = "127.0.0.1", port: int = 0) -> "tuple[str, uvicorn.Server]":
+    """Serves in a daemon thread; returns (base URL, server). Set server.should_exit to stop it."""
+    server = uvicorn.Server(uvicorn.Config(make_app(cfg), host=host, port=port, log_level="warning", lifespan="off"))
+    thread = threading.Thread(target=server.run, name="mock-provider", daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    bound = server.servers[0].sockets[0].getsockname()[1]
+    return f"http://{host}:{bound}", server
+
+
+def config_args(ap: argparse.ArgumentParser) -> None:
+    ap.add_argument("--latency", default="fixed:0.05", help="time to first token: fixed:S | uniform:LO:HI | lognormal:MEDIAN:SIGMA")
+    ap.add_argument("--words-per-s", type=float, default=400.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--error-status", type=int, default=503)
+    ap.add_argument("--spanish-rate", type=float, default=0.0)
+    ap.add_argument("--seed", type=int, default=None)
+
+
+def config_from(args: argparse.Namespace) -> MockConfig:
+    return MockConfig(
+        latency=args.latency,
+        words_per_s=args.words_per_s,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        spanish_rate=args.spanish_rate,
+        seed=args.seed,
+    )
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="OpenAI-compatible mock provider")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=9100)
+    config_args(ap)
+    args = ap.parse_args()
+    parse_latency(args.latency)
+    uvicorn.run(make_app(config_from(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""
+Replays a traffic capture (CAPTURE_PATH, see api/capture.py) against an
+instance at several speeds and reports how latency and errors move.
+
+    PYTHONPATH=. python bench/replay.py traffic.jsonl [--speeds 1,5,20] [--target URL]
+                                        [--latency lognormal:0.4:0.5] [--error-rate 0.01]
+
+Without --target, each speed gets a fresh `uvicorn fastapi_app:app` whose
+OpenAI and DeepSeek providers both point at the local mock provider
+(bench/mock_provider.py, same latency/error options as bench/load.py). With
+--target, the instance is used as is (point its providers at a mock).
+
+Arrivals keep their captured offsets divided by the speed. A follow-up turn
+also waits for the previous turn of its conversation (it needs the new id),
+so turns that would overlap start late; "late" counts those over 1 s.
+Messages are filler text of the captured length. Captured providers the
+target does not serve are sent without the header (the target's default).
+Follow-ups whose opening is not in the capture cannot be replayed and are
+skipped.
+"""
+import argparse
+import asyncio
+import json
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+import httpx
+
+import mock_provider
+from load import ROOT, percentile, scenario_env
+
+FILLER = "why would that hold when the evidence on cost time and space points the other way".split()
+
+
+def load_capture(path: str) -> List[Dict]:
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return sorted(records, key=lambda r: r["t"])
+
+
+def filler(words: int, chars: int) -> str:
+    text = " ".join(FILLER[i % len(FILLER)] for i in range(max(1, words)))
+    return text[:max(1, chars)]
+
+
+def captured_status(rec: Dict) -> int:
+    return 502 if rec.get("stream_error") else rec.get("status", 200)
+
+
+def stats(latencies_ms: List[float], statuses: Counter) -> Dict[str, float]:
+    lat = sorted(latencies_ms)
+    total = sum(statuses.values())
+    errors = sum(n for s, n in statuses.items() if s != 200)
+    return {
+        "n": total,
+        "errors": errors,
+        "error_rate": errors / total if total else 0.0,
+        "p50": percentile(lat, 0.50),
+        "p95": percentile(lat, 0.95),
+        "p99": percentile(lat, 0.99),
+    }
+
+
+async def replay(records: List[Dict], url: str, speed: float, concurrency_cap: int) -> Dict[str, object]:
+    async with httpx.AsyncClient(base_url=url, timeout=120, limits=httpx.Limits(max_connections=concurrency_cap)) as client:
+        providers = set((await client.get("/health")).json().get("providers", []))
+        opened = {r["conv"] for r in records if r.get("new") and r.get("conv")}
+        live: Dict[str, str] = {}
+        previous: Dict[str, asyncio.Task] = {}
+        latencies: List[float] = []
+        statuses: Counter = Counter()
+        counts: Counter = Counter()
+        loop = asyncio.get_running_loop()
+        t0 = loop.time() - records[0]["t"] / speed
+
+        async def turn(rec: Dict, prev: Optional[asyncio.Task]) -> None:
+            due = t0 + rec["t"] / speed
+            await asyncio.sleep(max(0.0, due - loop.time()))
+            if prev is not None:
+                await asyncio.gather(prev, return_exceptions=True)
+            cid = None
+            if not rec.get("new"):
+                cid = live.get(rec.get("conv"))
+                if cid is None:
+                    counts["skipped"] += 1
+                    return
+            if loop.time() - due > 1.0:
+                counts["late"] += 1
+            headers = {}
+            if rec.get("provider"):
+                if rec["provider"].strip().lower() in providers:
+                    headers["X-LLM-Provider"] = rec["provider"]
+                else:
+                    counts["remapped"] += 1
+            for key, header in (("stance", "X-Stance"), ("timeout", "X-Request-Timeout")):
+                if rec.get(key):
+                    headers[header] = rec[key]
+            body = {"conversation_id": cid, "message": filler(rec.get("words", 5), rec.get("chars", 30))}
+            start = time.perf_counter()
+            try:
+                r = await client.post(rec["endpoint"], json=body, headers=headers)
+                status = r.status_code
+                if status == 200 and rec["endpoint"].endswith("/stream") and "event: error" in r.text:
+                    status = 502   # the stream started, then the provider failed
+            except httpx.HTTPError:
+                status = 599
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses[status] += 1
+            if status == 200 and rec.get("new") and rec.get("conv"):
+                live[rec["conv"]] = _conversation_id(r.text)
+
+        tasks = []
+        for rec in records:
+            if not rec.get("new") and rec.get("conv") not in opened:
+                counts["skipped"] += 1
+                continue
+            task = asyncio.ensure_future(turn(rec, previous.get(rec.get("conv"))))
+            if rec.get("conv"):
+                previous[rec["conv"]] = task
+            tasks.append(task)
+        await asyncio.gather(*tasks)
+        elapsed = loop.time() - t0
+    out = stats(latencies, statuses)
+    out.update(counts, elapsed=elapsed, turns_per_s=len(latencies) / elapsed if elapsed else 0.0)
+    return out
+
+
+def _conversation_id(text: str) -> str:
+    for line in text.splitlines():
+        line = line[6:] if line.startswith("data: ") else line
+        if '"conversation_id"' in line:
+            return json.loads(line)["conversation_id"]
+    return ""
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def launch_target(mock_url: str, tmp: str) -> "tuple[str, subprocess.Popen]":
+    port = _free_port()
+    env = scenario_env("memory", mock_url, tmp)
+    env.update(DEEPSEEK_API_KEY="mock", DEEPSEEK_BASE_URL=mock_url, CAPTURE_PATH="")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "fastapi_app:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env,
+    )
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(200):
+        try:
+            if httpx.get(url + "/health").status_code == 200:
+                return url, proc
+        except httpx.HTTPError:
+            pass
+        if proc.poll() is not None:
+            break
+        time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("target did not start")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("capture")
+    ap.add_argument("--speeds", default="1,5,20")
+    ap.add_argument("--target", help="base URL of a running instance (default: launch one per speed)")
+    ap.add_argument("--max-connections", type=int, default=512)
+    mock_provider.config_args(ap)
+    args = ap.parse_args()
+    records = load_capture(args.capture)
+    if not records:
+        sys.exit("empty capture")
+
+    captured = stats(
+        [r["latency_ms"] for r in records if r.get("latency_ms") is not None],
+        Counter(captured_status(r) for r in records),
+    )
+    span = records[-1]["t"] - records[0]["t"]
+    print(f"capture: {len(records)} requests over {span:.1f} s, "
+          f"{sum(1 for r in records if r.get('new'))} conversations")
+    mock_url = None
+    if not args.target:
+        mock_url, mock = mock_provider.start(mock_provider.config_from(args))
+        print(f"mock provider {mock_url}  latency={args.latency}  error_rate={args.error_rate}")
+
+    header = f"{'run':<10}{'n':>6}{'err%':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'Δp50':>8}{'Δp95':>8}{'Δp99':>8}{'Δerr%':>7}{'late':>6}{'skip':>6}{'turns/s':>9}"
+    print(header)
+    print(f"{'captured':<10}{captured['n']:>6}{captured['error_rate'] * 100:>7.1f}"
+          f"{captured['p50']:>9.1f}{captured['p95']:>9.1f}{captured['p99']:>9.1f}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for speed in (float(s) for s in args.speeds.split(",")):
+            url, proc = (args.target, None) if args.target else launch_target(mock_url, tmp)
+            try:
+                r = asyncio.run(replay(records, url, speed, args.max_connections))
+            finally:
+                if proc is not None:
+                    proc.terminate()
+                    proc.wait()
+            print(f"{f'{speed:g}x':<10}{r['n']:>6}{r['error_rate'] * 100:>7.1f}"
+                  f"{r['p50']:>9.1f}{r['p95']:>9.1f}{r['p99']:>9.1f}"
+                  f"{r['p50'] - captured['p50']:>+8.0f}{r['p95'] - captured['p95']:>+8.0f}{r['p99'] - captured['p99']:>+8.0f}"
+                  f"{(r['error_rate'] - captured['error_rate']) * 100:>+7.1f}"
+                  f"{r.get('late', 0):>6}{r.get('skipped', 0):>6}{r['turns_per_s']:>9.1f}")
+            if r.get("remapped"):
+                print(f"{'':<10}{r['remapped']} requests named a provider the target does not serve (sent to its default)")
+    if not args.target:
+        mock.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,17 @@
 import os
-from fastapi import FastAPI, HTTPException, Header
+import json
+from fastapi import FastAPI, HTTPException, Header, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv
 
-from api.schemas import ConversationIn, ConversationOut, MessageItem
+from api.schemas import ConversationIn, ConversationOut, MessageItem, TranscriptItem, TranscriptPage
 from api.storage_memory import InMemoryConversationStore
 from api.services import ConversationService, ConversationNotFound
+from api.errors import ProviderError
+from api import capture, metrics, tracing
 
 
 load_dotenv()
@@ -27,27 +31,85 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],  
 )
+# --- Opt-in traffic capture for bench/replay.py (CAPTURE_PATH=traffic.jsonl; no message text is kept)
+if capture.CAPTURE_PATH:
+    app.add_middleware(capture.CaptureMiddleware)
 # Serve static UI (index.html, assets, etc.)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 @app.get("/", include_in_schema=False)
 def root():
     return FileResponse("static/index.html")
-# --- Storage choice: memory vs DB
+# --- Storage choice: memory vs DB vs Redis
+def _env_num(name, cast):
+    raw = os.getenv(name)
+    return cast(raw) if raw else None
+
 use_db = os.getenv("USE_DB", "0") == "1"
+use_redis = os.getenv("USE_REDIS", "0") == "1"
+db_async = use_db and os.getenv("DB_ASYNC", "0") == "1" and not use_redis
+write_behind = use_db and os.getenv("DB_WRITE_BEHIND", "0") == "1" and not (use_redis or db_async)
+
+if use_redis:
+    # Shared by every worker process: run uvicorn with --workers N
+    from api import storage_redis
+    from api.services import HISTORY_CAP
 
-if use_db:
+    _store = storage_redis.from_env(history_limit=HISTORY_CAP)
+elif db_async:
+    # Async engine (aiosqlite / asyncpg); tables are created on startup
+    from api.persistence.db_async import make_async_engine
+    from api.persistence.storage_db_async import AsyncDBConversationStore
+    from api.services import HISTORY_CAP
+
+    _store = AsyncDBConversationStore(make_async_engine(), history_limit=HISTORY_CAP)
+elif use_db:
     from api.persistence.storage_db import DBConversationStore
-    from api.persistence.db import engine
+    from api.persistence.db import engine, IS_SQLITE
     from api.persistence.models import Base
+    from api.persistence.db_setup import migrate_legacy_history
+    from api.persistence.writer import GroupCommitWriter
+    from api.services import HISTORY_CAP
 
     Base.metadata.create_all(bind=engine)
-    _store = DBConversationStore()
+    migrate_legacy_history()
+    # SQLite has one writer anyway: funnel commits through a batching thread
+    _writer = None
+    if IS_SQLITE and os.getenv("DB_GROUP_COMMIT", "1") == "1":
+        _writer = GroupCommitWriter(
+            engine,
+            max_batch=int(os.getenv("DB_COMMIT_MAX_BATCH", "128")),
+            max_delay=float(os.getenv("DB_COMMIT_WINDOW_MS", "5")) / 1000,
+        )
+    _store = DBConversationStore(history_limit=HISTORY_CAP, writer=_writer)
+    if write_behind:
+        # Hot conversations served from memory; the DB is written in the background
+        from api.persistence.storage_tiered import WriteBehindStore
+
+        _store = WriteBehindStore(
+            _store,
+            hot=InMemoryConversationStore(
+                max_conversations=_env_num("HOT_MAX_CONVERSATIONS", int) or 10000,
+                idle_ttl=_env_num("HOT_IDLE_TTL_S", float) or 600.0,
+            ),
+            flush_interval=float(os.getenv("DB_FLUSH_INTERVAL_MS", "500")) / 1000,
+            max_dirty=int(os.getenv("DB_MAX_DIRTY", "10000")),
+        )
 else:
-    from api.storage_memory import InMemoryConversationStore
-    _store = InMemoryConversationStore()
+    # Bounded in production: LRU eviction + idle expiry (unset = unbounded)
+    _store = InMemoryConversationStore(
+        max_conversations=_env_num("MEMORY_MAX_CONVERSATIONS", int),
+        max_bytes=_env_num("MEMORY_MAX_BYTES", int),
+        idle_ttl=_env_num("MEMORY_IDLE_TTL_S", float),
+    )
+
+# Async stores (async DB engine, Redis) are awaited; sync ones run in the threadpool
+import inspect
+store_async = inspect.iscoroutinefunction(_store.get)
 
 # --- LLM providers wiring
+from api import transport
+
 _llms = {}
 
 # Gemini
@@ -57,6 +119,7 @@ if gemini_key:
     _llms["gemini"] = GeminiLLM(
         api_key=gemini_key,
         model=os.getenv("GEMINI_MODEL", "gemini-1.5-flash"),
+        timeout=transport.provider_timeout("gemini").read,
     )
 
 # OpenAI
@@ -66,6 +129,9 @@ if openai_key:
     _llms["openai"] = OpenAILLM(
         api_key=openai_key,
         model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
+        http_client=transport.http_client(),
+        async_http_client=transport.async_http_client(),
+        timeout=transport.provider_timeout("openai"),
     )
 
 # DeepSeek
@@ -75,21 +141,112 @@ if deepseek_key:
     _llms["deepseek"] = DeepSeekLLM(
         api_key=deepseek_key,
         model=os.getenv("DEEPSEEK_MODEL", "deepseek-chat"),
+        http_client=transport.http_client(),
+        async_http_client=transport.async_http_client(),
+        timeout=transport.provider_timeout("deepseek"),
     )
 
 if not _llms:
     raise RuntimeError("No LLM providers configured. Set GEMINI_API_KEY, OPENAI_API_KEY or DEEPSEEK_API_KEY.")
-# Pick default provider: env var first, fallback to Gemini or first available
-default_provider = os.getenv("DEFAULT_PROVIDER") or ("gemini" if "gemini" in _llms else next(iter(_llms)))
-_service = ConversationService(store=_store, llms=_llms, default_provider=default_provider)
+# Pick default provider: env var first, fallback to Gemini or first available.
+# DEFAULT_PROVIDER=auto routes new conversations to the currently fastest healthy provider.
+_default_env = (os.getenv("DEFAULT_PROVIDER") or "").strip().lower()
+adaptive_default = _default_env == "auto"
+default_provider = "" if adaptive_default else _default_env
+default_provider = default_provider or ("gemini" if "gemini" in _llms else next(iter(_llms)))
+# --- Per-provider admission control (in-flight cap + RPM/TPM buckets)
+from api import limits
+from urllib.parse import urlparse
+
+_limiters = {name: limits.from_env(name) for name in _llms}
+_limiter_by_host = {
+    urlparse(llm.base_url).hostname: _limiters[name]
+    for name, llm in _llms.items() if getattr(llm, "base_url", None)
+}
+
+def _observe_rate_headers(host, headers):
+    limiter = _limiter_by_host.get(host)
+    if limiter is not None:
+        limiter.observe(headers)
+
+transport.on_response(_observe_rate_headers)
+
+# --- Opt-in cross-provider failover / hedging (ROUTING_POLICY=pinned|failover|hedge)
+from api import routing
+
+_router = routing.from_env(list(_llms))
+_selector = routing.selector_from_env(
+    {name: getattr(llm, "model_name", None) or str(getattr(llm, "model", "")) for name, llm in _llms.items()},
+    adaptive=adaptive_default,
+)
+
+# --- Opening-turn response cache (RESPONSE_CACHE=off|memory|sqlite)
+from api import cache as response_cache
+from api import generation
+from api import deadline as deadlines
+
+_cache = response_cache.from_env()
+
+_service = ConversationService(
+    store=_store,
+    llms=_llms,
+    default_provider=default_provider,
+    limiters=_limiters,
+    router=_router if _router.policy != "pinned" else None,
+    selector=_selector,
+    cache=_cache,
+    policy=generation.from_env(),
+    retry=deadlines.from_env(),
+)
+
+# --- Connection warm-up: /health reports "starting" (503) until pools are open
+_warm = {"ready": os.getenv("HTTP_WARMUP", "1") != "1", "hosts": {}}
+
+@app.on_event("startup")
+async def _create_async_tables():
+    if db_async:
+        await _store.create_tables()
+
+@app.on_event("startup")
+async def _warm_up_transport():
+    urls = [llm.base_url for llm in _llms.values() if getattr(llm, "base_url", None)]
+    if not _warm["ready"]:
+        _warm["hosts"] = await transport.warm_up(urls)
+        _warm["ready"] = True
+
+# --- Tokenizers: BPE files load here, not inside the first request that counts tokens
+from api import context as _context
+_tokenizers = {}
+
+@app.on_event("startup")
+async def _load_tokenizers():
+    models = [llm.context.model for llm in _llms.values() if hasattr(llm, "context")]
+    _tokenizers.update(await run_in_threadpool(_context.preload, models))
+
+@app.on_event("shutdown")
+async def _close_transport():
+    await transport.aclose()
+    if write_behind:
+        _store.close()   # persist every dirty conversation (closes its writer too)
+    writer = getattr(_store, "writer", None)
+    if writer is not None:
+        writer.close()   # flush queued commits before exit
+    if store_async:
+        await _store.aclose()
+    for writer in (tracing.writer, capture.writer):
+        await run_in_threadpool(writer.close)   # write out queued traces/profiles/capture lines
+
+# --- Provider errors -> JSON with the mapped status code
+@app.exception_handler(ProviderError)
+async def _provider_error(request: Request, exc: ProviderError):
+    headers = {}
+    retry_after = getattr(exc, "retry_after", None)
+    if retry_after:
+        headers["Retry-After"] = str(int(retry_after + 0.999))
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail}, headers=headers)
 
 # --- API endpoints
-@app.post("/conversation", response_model=ConversationOut)
-def conversation(
-    payload: ConversationIn,
-    x_llm_provider: str | None = Header(default=None, alias="X-LLM-Provider"),
-    x_stance: str | None = Header(default=None, alias="X-Stance"),
-):
+def _bootstrap_hints(payload: ConversationIn, x_llm_provider: str | None, x_stance: str | None):
     provider = None
     stance_hint = None
     # Only allow provider/stance headers at conversation bootstrap
@@ -102,35 +259,168 @@ def conversation(
             if s not in {"pro", "contra"}:
                 raise HTTPException(status_code=400, detail="invalid stance; must be 'pro' or 'contra'")
             stance_hint = s
+    return provider, stance_hint
 
+
+def _deadline(x_request_timeout: str | None) -> deadlines.Deadline:
+    # Starts now, so time spent queued in the app counts against the budget too
     try:
-        cid, hist = _service.handle(
-            payload.conversation_id,
-            payload.message,
-            provider=provider,
-            stance=stance_hint,
-        )
+        return deadlines.turn_deadline(x_request_timeout)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid X-Request-Timeout; must be a positive number of seconds")
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/conversation", response_model=ConversationOut)
+async def conversation(
+    payload: ConversationIn,
+    response: Response,
+    x_llm_provider: str | None = Header(default=None, alias="X-LLM-Provider"),
+    x_stance: str | None = Header(default=None, alias="X-Stance"),
+    x_request_timeout: str | None = Header(default=None, alias="X-Request-Timeout"),
+):
+    deadline = _deadline(x_request_timeout)
+    provider, stance_hint = _bootstrap_hints(payload, x_llm_provider, x_stance)
+    with tracing.request("POST /conversation") as trace:
+        try:
+            cid, hist = await _service.ahandle(
+                payload.conversation_id,
+                payload.message,
+                provider=provider,
+                stance=stance_hint,
+                deadline=deadline,
+            )
+        except ConversationNotFound:
+            raise HTTPException(status_code=404, detail="conversation not found")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    if tracing.SERVER_TIMING:
+        response.headers["Server-Timing"] = trace.server_timing()
+    return ConversationOut(conversation_id=cid, message=[MessageItem(**m) for m in hist])
+
+@app.post("/conversation/stream")
+async def conversation_stream(
+    payload: ConversationIn,
+    x_llm_provider: str | None = Header(default=None, alias="X-LLM-Provider"),
+    x_stance: str | None = Header(default=None, alias="X-Stance"),
+    x_request_timeout: str | None = Header(default=None, alias="X-Request-Timeout"),
+):
+    deadline = _deadline(x_request_timeout)
+    provider, stance_hint = _bootstrap_hints(payload, x_llm_provider, x_stance)
+    # The body runs after this function returns: the trace is closed by body()
+    req = tracing.request("POST /conversation/stream", finish=False)
+    events = _service.astream(
+        payload.conversation_id,
+        payload.message,
+        provider=provider,
+        stance=stance_hint,
+        deadline=deadline,
+    )
+    # Pull the "meta" event here so lookup errors still map to proper HTTP codes
+    try:
+        with req:
+            first = await events.__anext__()
     except ConversationNotFound:
+        req.finish()
         raise HTTPException(status_code=404, detail="conversation not found")
     except ValueError as e:
+        req.finish()
         raise HTTPException(status_code=400, detail=str(e))
 
-    return ConversationOut(conversation_id=cid, message=[MessageItem(**m) for m in hist])
+    async def body():
+        try:
+            with req:
+                yield _sse(*first)
+                try:
+                    async for event, data in events:
+                        yield _sse(event, data)
+                except ProviderError as e:
+                    yield _sse("error", {"status_code": e.status_code, "detail": e.detail})
+        finally:
+            # Client gone mid-stream: close the turn now, so the provider stream
+            # and the conversation lock are released instead of left to the GC
+            try:
+                await events.aclose()
+            finally:
+                req.finish()
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    if tracing.SERVER_TIMING:
+        # Headers go out first: this covers the time to the first event only
+        headers["Server-Timing"] = req.trace.server_timing()
+    return StreamingResponse(body(), media_type="text/event-stream", headers=headers)
 
 @app.get("/health")
-def health():
-    storage = "db" if use_db else "memory"
-    return {"status": "ok", "providers": list(_llms.keys()), "default": default_provider, "storage": storage}
+def health(response: Response):
+    storage = "redis" if use_redis else ("db-async" if db_async else "db") if use_db else "memory"
+    if not _warm["ready"]:
+        response.status_code = 503
+        return {"status": "starting", "providers": list(_llms.keys()), "default": default_provider, "storage": storage}
+    return {
+        "status": "ok",
+        "providers": list(_llms.keys()),
+        "default": default_provider,
+        "storage": storage,
+        "warm": _warm["hosts"],
+        "admission": {name: lim.stats() for name, lim in _limiters.items()},
+        "routing": _router.stats(),
+        "adaptive_default": adaptive_default,
+        "scores": _selector.stats(),
+        "tokenizers": _tokenizers,
+        "prompt_cache": {name: llm.usage.stats() for name, llm in _llms.items() if hasattr(llm, "usage")},
+        "generation": _service.generation.stats(),
+        "retries": _service.retry.stats(),
+        "response_cache": _cache.stats() if _cache else None,
+        "store": _store.footprint() if hasattr(_store, "footprint") else None,
+        "db_writer": _store.writer.stats() if getattr(_store, "writer", None) else None,
+        "db_pool": _store.pool_stats() if db_async else None,
+        "write_behind": _store.stats() if write_behind else None,
+    }
+
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    # Prometheus text format; per process (each uvicorn worker reports its own)
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 
 @app.get("/conversation/{conversation_id}", response_model=ConversationOut)
-def get_conversation(conversation_id: str):
-    state = _store.get(conversation_id)
+async def get_conversation(conversation_id: str):
+    if store_async:
+        state = await _store.get(conversation_id)
+    else:
+        state = await run_in_threadpool(_store.get, conversation_id)
     if not state:
         raise HTTPException(status_code=404, detail="conversation not found")
     hist = state["history"][-10:]  
     return ConversationOut(conversation_id=conversation_id, message=[MessageItem(**m) for m in hist])
 
+@app.get("/conversation/{conversation_id}/messages", response_model=TranscriptPage)
+async def get_transcript(
+    conversation_id: str,
+    before: int | None = Query(None, ge=1, description="Return messages with seq < before"),
+    limit: int = Query(50, ge=1, le=200),
+):
+    """Full transcript, oldest first, one keyset page at a time."""
+    page = getattr(_store, "messages", None)
+    if page is None:
+        raise HTTPException(status_code=501, detail="transcripts need a persistent store (USE_DB=1 or USE_REDIS=1)")
+    if store_async:
+        msgs = await page(conversation_id, before=before, limit=limit)
+    else:
+        msgs = await run_in_threadpool(page, conversation_id, before=before, limit=limit)
+    if msgs is None:
+        raise HTTPException(status_code=404, detail="conversation not found")
+    next_before = msgs[0]["seq"] if msgs and msgs[0]["seq"] > 1 else None
+    return TranscriptPage(
+        conversation_id=conversation_id,
+        messages=[TranscriptItem(**m) for m in msgs],
+        next_before=next_before,
+    )
+
 @app.get("/", include_in_schema=False)
 def root():
     return FileResponse("static/index.html")
@@ -0,0 +1,26 @@
+import pytest
+
+# Sync provider: scripted replies first, then the same valid English reply
+class FakeLLM:
+    model = "fake-1"
+
+    def __init__(self, replies=()):
+        self.replies = list(replies)
+        self.calls = 0
+
+    def chat(self, topic, stance, history, user_msg):
+        self.calls += 1
+        return self.replies.pop(0) if self.replies else f"[[STANCE:{stance}]] Sure, we will keep defending the topic in English."
+
+# Manual clock so time-based math (token buckets, TTLs, idle expiry) is deterministic
+class Clock:
+    def __init__(self, t=0.0): self.t = t
+    def __call__(self): return self.t
+
+@pytest.fixture
+def fake_llm():
+    return FakeLLM()
+
+@pytest.fixture
+def clock():
+    return Clock()
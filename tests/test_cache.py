@@ -0,0 +1,89 @@
+import asyncio
+import threading
+
+import pytest
+from api.cache import (
+    MemoryCacheBackend, SQLiteCacheBackend, ResponseCache, cache_key, normalize_topic,
+)
+from api.services import ConversationService
+from api.storage_memory import InMemoryConversationStore
+
+# Counts upstream calls so cache hits are visible
+class FakeLLM:
+    def __init__(self): self.calls = 0
+    def chat(self, topic, stance, history, user_msg):
+        self.calls += 1
+        return f"[[STANCE:{stance}]] Reply about {topic}."
+
+def test_topic_normalization_shares_key():
+    assert normalize_topic("  The Earth is\tFLAT ") == "the earth is flat"
+    k1 = cache_key("openai", "gpt", "The Earth is flat", "pro", [])
+    assert k1 == cache_key("openai", "gpt", "the earth   is FLAT ", "pro", [])
+    assert k1 != cache_key("openai", "gpt", "the earth is flat", "contra", [])
+    # Punctuation is part of the topic
+    assert normalize_topic("C++ is better") != normalize_topic("C is better")
+    assert normalize_topic("The U.S. economy") != normalize_topic("The US economy")
+
+@pytest.mark.parametrize("make", [
+    lambda clock, tmp: MemoryCacheBackend(max_bytes=100, ttl=10, clock=clock),
+    lambda clock, tmp: SQLiteCacheBackend(str(tmp / "c.db"), max_bytes=100, ttl=10, clock=clock),
+])
+def test_backend_lru_ttl_and_byte_budget(make, tmp_path, clock):
+    b = make(clock, tmp_path)
+    b.put("a", "x" * 40)
+    clock.t += 1
+    b.put("b", "y" * 40)
+    clock.t += 1
+    assert b.get("a") == "x" * 40          # touch "a": "b" is now least recent
+    clock.t += 1
+    b.put("c", "z" * 40)                  # over 100 bytes -> evict "b"
+    assert b.get("b") is None and b.get("a") and b.get("c")
+    assert b.bytes <= 100 and b.evictions == 1
+    clock.t += 11
+    assert b.get("a") is None             # expired
+
+def test_service_serves_repeated_openings_from_cache():
+    llm = FakeLLM()
+    cache = ResponseCache(MemoryCacheBackend())
+    svc = ConversationService(InMemoryConversationStore(), {"fake": llm}, default_provider="fake", cache=cache)
+    _, h1 = svc.handle(None, "The Earth is flat", stance="pro")
+    _, h2 = svc.handle(None, "the earth  is FLAT", stance="pro")
+    assert llm.calls == 1 and cache.hits == 1
+    assert "Fixed topic: the earth is FLAT." in h2[-1]["message"]   # banner uses this topic
+    cid, _ = svc.handle(None, "The Earth is flat", stance="contra")
+    svc.handle(cid, "follow-up")                                      # not an opening
+    assert llm.calls == 3
+
+def test_bad_upstream_reply_is_never_cached():
+    # One body-less answer must not become the opening of every later conversation
+    class FlakyLLM(FakeLLM):
+        def chat(self, topic, stance, history, user_msg):
+            self.calls += 1
+            return "" if self.calls == 1 else f"[[STANCE:{stance}]] Reply about {topic}."
+    llm = FlakyLLM()
+    cache = ResponseCache(MemoryCacheBackend())
+    svc = ConversationService(InMemoryConversationStore(), {"fake": llm}, default_provider="fake", cache=cache)
+    svc.policy.max_repairs = 0
+    _, h1 = svc.handle(None, "The Earth is flat", stance="pro")
+    assert "I must reply in English" in h1[-1]["message"] and len(cache.backend) == 0
+    _, h2 = svc.handle(None, "The Earth is flat", stance="pro")
+    assert "Reply about The Earth is flat" in h2[-1]["message"] and llm.calls == 2
+    assert len(cache.backend) == 1
+
+def test_async_turns_use_the_sqlite_cache_off_the_event_loop(tmp_path):
+    backend = SQLiteCacheBackend(str(tmp_path / "c.db"))
+    threads = []
+    for name in ("get", "put"):
+        fn = getattr(backend, name)
+        setattr(backend, name, lambda *a, fn=fn: threads.append(threading.get_ident()) or fn(*a))
+    svc = ConversationService(InMemoryConversationStore(), {"fake": FakeLLM()}, default_provider="fake",
+                              cache=ResponseCache(backend))
+
+    async def run():
+        await svc.ahandle(None, "The Earth is flat", stance="pro")
+        await svc.ahandle(None, "The Earth is flat", stance="pro")
+        return [ev async for ev in svc.astream(None, "The Earth is flat", stance="pro")]
+
+    asyncio.run(run())
+    assert len(threads) == 4 and threading.get_ident() not in threads   # miss+put, hit, hit
+    assert svc.cache.hits == 2 and svc.cache.misses == 1
@@ -0,0 +1,59 @@
+import asyncio
+import json
+import uuid
+
+import httpx
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+from api import capture
+from api.capture import CaptureMiddleware
+
+def make_app(path):
+    app = FastAPI()
+
+    @app.post("/conversation")
+    async def conversation(payload: dict):
+        return {"conversation_id": payload.get("conversation_id") or uuid.uuid4().hex, "message": "secret reply"}
+
+    @app.post("/conversation/stream")
+    async def stream(payload: dict):
+        async def body():
+            yield f'event: meta\ndata: {{"conversation_id": "{payload["conversation_id"]}"}}\n\n'
+            yield 'event: error\ndata: {"status_code": 503}\n\n'
+        return StreamingResponse(body(), media_type="text/event-stream")
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    app.add_middleware(CaptureMiddleware, path=str(path))
+    return app
+
+def test_capture_keeps_shape_not_content(tmp_path):
+    path = tmp_path / "traffic.jsonl"
+    app = make_app(path)
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://app") as c:
+            r = await c.post("/conversation", json={"message": "my secret opening"},
+                             headers={"X-LLM-Provider": "openai", "X-Stance": "pro"})
+            cid = r.json()["conversation_id"]
+            await c.post("/conversation", json={"conversation_id": cid, "message": "and a follow up"})
+            await c.post("/conversation/stream", json={"conversation_id": cid, "message": "stream it"})
+            await c.get("/health")
+            return cid
+
+    cid = asyncio.run(run())
+    capture.writer.flush()   # lines are written by the background thread
+    raw = path.read_text()
+    assert "secret" not in raw and cid not in raw
+    opening, follow, streamed = [json.loads(line) for line in raw.splitlines()]
+    assert opening["new"] and not follow["new"] and not streamed["new"]
+    assert opening["conv"] == follow["conv"] == streamed["conv"]
+    assert opening["provider"] == "openai" and opening["stance"] == "pro" and "provider" not in follow
+    assert (opening["chars"], opening["words"]) == (17, 3)
+    assert opening["status"] == 200 and opening["resp_bytes"] > 0 and opening["req_bytes"] > 0
+    assert opening["t"] <= follow["t"] <= streamed["t"]
+    assert 0 <= opening["ttfb_ms"] <= opening["latency_ms"]
+    assert "stream_error" not in opening and streamed["stream_error"] is True
@@ -0,0 +1,63 @@
+from api import context
+from api.context import ContextBuilder, count_tokens, fit, fold
+from api.llm_openai import OpenAILLM
+from api.services import ConversationService, HISTORY_CAP
+from api.storage_memory import InMemoryConversationStore
+
+def msg(role, words):
+    return {"role": role, "message": " ".join(["word"] * words) + "."}
+
+def test_fit_keeps_newest_messages_within_budget():
+    history = [msg("user", 200), msg("bot", 200), msg("user", 10), msg("bot", 10)]
+    summary, kept = fit(history, budget=60, user_msg="next")
+    assert kept == history[2:]
+    assert summary.count("\n") == 1 and summary.startswith("- User: word word")
+
+def test_fit_leaves_short_histories_alone():
+    history = [msg("user", 5), msg("bot", 5)]
+    assert fit(history, budget=1000, summary="- User: hi") == ("- User: hi", history)
+
+def test_fold_is_bounded_and_drops_oldest_lines():
+    summary = ""
+    for i in range(50):
+        summary = fold(summary, [{"role": "user", "message": f"[[STANCE:pro]] point {i}. More detail here."}], max_tokens=60)
+    assert count_tokens(summary) <= 60
+    assert summary.splitlines()[-1] == "- User: point 49."
+    assert "[[STANCE" not in summary
+
+class RecordingLLM:
+    def __init__(self):
+        self.summaries = []
+    def chat(self, topic, stance, history, user_msg, summary=""):
+        self.summaries.append(summary)
+        return f"[[STANCE:{stance}]] A short reply in English about the topic."
+
+def test_service_folds_evicted_messages_into_summary():
+    llm = RecordingLLM()
+    svc = ConversationService(store=InMemoryConversationStore(), llms={"fake": llm}, default_provider="fake")
+    cid, _ = svc.handle(None, "Remote work is better")
+    for i in range(HISTORY_CAP):
+        cid, hist = svc.handle(cid, f"objection number {i}")
+    state = svc.store.get(cid)
+    assert len(state["history"]) == HISTORY_CAP
+    assert "- User: Remote work is better" in state["summary"]
+    assert llm.summaries[0] == "" and llm.summaries[-1] == state["summary"].rsplit("\n", 2)[0]
+
+def test_adapter_prompt_stays_flat_as_the_debate_grows():
+    llm = OpenAILLM(api_key="sk-test")
+    llm.context = ContextBuilder("openai", budget=120)
+    short = llm._messages("T", "pro", [msg("user", 5), msg("bot", 5)], "next")
+    long_history = [msg("user" if i % 2 == 0 else "bot", 60) for i in range(10)]
+    long = llm._messages("T", "pro", long_history, "next", summary="- User: opening claim")
+    size = lambda msgs: sum(count_tokens(m["content"]) for m in msgs)
+    assert size(long) < size(short) + 120 + 300
+    assert long[-2]["content"].startswith(context.SUMMARY_HEADER)
+    assert long[-1] == {"role": "user", "content": "next"}
+
+def test_preload_reports_the_tokenizer_per_model():
+    loaded = context.preload(["gpt-4o-mini", "deepseek-chat"])
+    assert set(loaded) == {"default", "gpt-4o-mini", "deepseek-chat"}
+    # Whatever was loaded at startup is what count_tokens uses afterwards
+    assert loaded["gpt-4o-mini"] == context.tokenizer("gpt-4o-mini")
+    if loaded["default"] == "chars/4":
+        assert count_tokens("x" * 40) == 10
@@ -0,0 +1,54 @@
+import threading
+import time
+import pytest
+from sqlalchemy import create_engine, text
+from api.persistence.writer import _STOP, GroupCommitWriter
+
+@pytest.fixture
+def engine(tmp_path):
+    eng = create_engine(f"sqlite:///{tmp_path / 'w.db'}", connect_args={"check_same_thread": False})
+    with eng.begin() as conn:
+        conn.execute(text("CREATE TABLE t (k INTEGER PRIMARY KEY)"))
+    yield eng
+    eng.dispose()
+
+def insert(k):
+    return lambda conn: conn.execute(text("INSERT INTO t (k) VALUES (:k)"), {"k": k})
+
+def test_concurrent_writes_share_commits(engine):
+    writer = GroupCommitWriter(engine, max_batch=64, max_delay=0.05)
+    threads = [threading.Thread(target=writer.write, args=(insert(i),)) for i in range(40)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    writer.close()
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM t")).scalar() == 40
+    stats = writer.stats()
+    assert stats["ops"] == 40 and stats["commits"] < 40
+
+def test_failing_op_does_not_sink_its_batch(engine):
+    writer = GroupCommitWriter(engine, max_delay=0.05)
+    ok, dup_a, dup_b = writer.submit(insert(1)), writer.submit(insert(2)), writer.submit(insert(2))
+    assert ok.result() is not None and dup_a.result() is not None
+    with pytest.raises(Exception):
+        dup_b.result()
+    writer.close()
+    assert writer.stats()["failures"] == 1
+
+def test_submit_racing_close_is_committed_not_stranded(engine):
+    writer = GroupCommitWriter(engine, max_delay=0.01)
+    put, closer = writer._q.put, threading.Thread(target=writer.close)
+
+    def slow_put(item):
+        # close() starts between the closed check and the enqueue
+        if item is not _STOP:
+            closer.start()
+            time.sleep(0.1)
+        put(item)
+
+    writer._q.put = slow_put
+    fut = writer.submit(insert(1))
+    closer.join()
+    assert fut.result(timeout=2) is not None
+    with pytest.raises(RuntimeError):
+        writer.submit(insert(2))
@@ -0,0 +1,123 @@
+import asyncio
+import time
+
+import pytest
+from google.api_core import exceptions as gax
+
+from api.deadline import Deadline, RetryPolicy, turn_deadline
+from api.errors import RateLimited, Unavailable, UpstreamTimeout
+from api.llm_gemini import _map_error as gemini_error
+from api.services import ConversationService
+from api.storage_memory import InMemoryConversationStore
+
+class Flaky:
+    """Fails `failures` times with `error`, then answers; records the timeouts it was given."""
+    def __init__(self, failures=0, error=Unavailable, hang=0.0):
+        self.failures = failures
+        self.error = error
+        self.hang = hang
+        self.timeouts = []
+
+    async def __call__(self, timeout):
+        self.timeouts.append(timeout)
+        if self.hang:
+            await asyncio.sleep(self.hang)
+        if len(self.timeouts) <= self.failures:
+            raise self.error()
+        return "ok"
+
+def test_turn_deadline_header_only_shortens():
+    assert turn_deadline(None, default=60).remaining() == pytest.approx(60, abs=0.5)
+    assert turn_deadline("5", default=60).remaining() == pytest.approx(5, abs=0.5)
+    assert turn_deadline("120", default=60).remaining() == pytest.approx(60, abs=0.5)
+    assert turn_deadline("5", default=0).remaining() == pytest.approx(5, abs=0.5)
+    assert turn_deadline(None, default=0).remaining() is None
+    with pytest.raises(ValueError):
+        turn_deadline("-1", default=60)
+
+def test_transient_errors_are_retried_within_the_budget():
+    policy = RetryPolicy(max_attempts=3, rng=lambda: 0.0)
+    fn = Flaky(failures=2)
+    assert asyncio.run(policy.arun(fn, Deadline(5))) == "ok"
+    assert len(fn.timeouts) == 3 and all(0 < t <= 5 for t in fn.timeouts)
+    assert policy.stats()["retries"] == {"Unavailable": 2}
+
+    # Attempts spent: the last error surfaces as is
+    fn = Flaky(failures=5)
+    with pytest.raises(Unavailable):
+        asyncio.run(policy.arun(fn, Deadline(5)))
+    assert policy.stats()["exhausted"] == 1
+
+    # Not transient: no retry (the limiter paces 429s)
+    fn = Flaky(failures=1, error=RateLimited)
+    with pytest.raises(RateLimited):
+        policy.run(lambda t: asyncio.run(fn(t)), Deadline(5))
+    assert len(fn.timeouts) == 1
+
+def test_gemini_server_errors_are_retried_like_the_other_providers():
+    for err in (gax.InternalServerError("boom"), gax.BadGateway("bad"), gax.GatewayTimeout("slow"), gax.DeadlineExceeded("late")):
+        policy = RetryPolicy(max_attempts=2, rng=lambda: 0.0)
+        calls = []
+
+        def fn(timeout):
+            calls.append(timeout)
+            if len(calls) == 1:
+                raise gemini_error(err)
+            return "ok"
+
+        assert policy.run(fn, Deadline(5)) == "ok" and len(calls) == 2
+
+def test_backoff_that_does_not_fit_becomes_a_timeout():
+    policy = RetryPolicy(max_attempts=5, base_delay=10.0, max_delay=10.0, rng=lambda: 0.5)
+    with pytest.raises(UpstreamTimeout):
+        asyncio.run(policy.arun(Flaky(failures=1), Deadline(1)))
+    assert policy.stats()["deadline_exceeded"] == 1
+
+def test_hung_call_is_cut_at_the_deadline():
+    policy = RetryPolicy(max_attempts=3, rng=lambda: 0.0)
+    t0 = time.perf_counter()
+    with pytest.raises(UpstreamTimeout):
+        asyncio.run(policy.arun(Flaky(hang=10), Deadline(0.1)))
+    assert time.perf_counter() - t0 < 1.0
+
+class SlowLLM:
+    def __init__(self, delay):
+        self.delay = delay
+        self.timeouts = []
+
+    async def achat(self, topic, stance, history, user_msg, timeout=None):
+        self.timeouts.append(timeout)
+        await asyncio.sleep(self.delay)
+        return f"[[STANCE:{stance}]] The answer is clear and it is in English."
+
+def test_service_passes_the_remaining_budget_and_bounds_the_turn():
+    llm = SlowLLM(delay=0.0)
+    svc = ConversationService(store=InMemoryConversationStore(), llms={"slow": llm}, default_provider="slow")
+    asyncio.run(svc.ahandle(None, "Cats are better than dogs", stance="pro", deadline=Deadline(5)))
+    assert 0 < llm.timeouts[0] <= 5
+
+    llm = SlowLLM(delay=10)
+    svc = ConversationService(store=InMemoryConversationStore(), llms={"slow": llm}, default_provider="slow",
+                              retry=RetryPolicy(max_attempts=3, rng=lambda: 0.0))
+    t0 = time.perf_counter()
+    with pytest.raises(UpstreamTimeout):
+        asyncio.run(svc.ahandle(None, "Cats are better than dogs", stance="pro", deadline=Deadline(0.2)))
+    assert time.perf_counter() - t0 < 1.0
+
+def test_stream_is_retried_only_before_the_first_delta():
+    opened = []
+
+    def open_stream(timeout):
+        opened.append(timeout)
+        async def gen():
+            if len(opened) == 1:
+                raise Unavailable()
+            yield "a"
+            yield "b"
+        return gen()
+
+    async def collect():
+        return [x async for x in RetryPolicy(max_attempts=3, rng=lambda: 0.0).aiter(open_stream, Deadline(5))]
+
+    assert asyncio.run(collect()) == ["a", "b"]
+    assert len(opened) == 2
@@ -0,0 +1,136 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from api.generation import GenerationPolicy, choose, from_env
+from api.errors import Unavailable
+from api.llm_deepseek import DeepSeekLLM
+from api.llm_openai import OpenAILLM
+from api.langid import is_english
+from api.services import ConversationService
+from api.storage_memory import InMemoryConversationStore
+
+SPANISH = "[[STANCE:pro]] Respuesta en español con acentos."
+WRONG_MARKER = "[[STANCE:contra]] The answer is clear and it is in English."
+GOOD = "[[STANCE:pro]] The answer is clear and it is in English."
+
+def test_choose_prefers_english_with_the_right_marker():
+    assert choose([SPANISH, WRONG_MARKER, GOOD], "pro", is_english) == (2, False, {"empty": 0, "not_english": 1})
+    # No exact match: first English candidate, marker rewritten by the service
+    assert choose(["", WRONG_MARKER], "pro", is_english) == (1, True, {"empty": 1, "not_english": 0})
+    assert choose([SPANISH], "pro", is_english)[0] is None
+
+class FakeCandidatesLLM:
+    def __init__(self, rounds):
+        self.rounds = rounds
+        self.calls = []
+
+    def _next(self, n, user_msg):
+        self.calls.append((n, user_msg))
+        return self.rounds[min(len(self.calls), len(self.rounds)) - 1][:n]
+
+    def candidates(self, topic, stance, history, user_msg, n=1):
+        return self._next(n, user_msg)
+
+    async def acandidates(self, topic, stance, history, user_msg, n=1):
+        return self._next(n, user_msg)
+
+def new_service(rounds, policy):
+    llm = FakeCandidatesLLM(rounds)
+    svc = ConversationService(store=InMemoryConversationStore(), llms={"fake": llm}, default_provider="fake", policy=policy)
+    return svc, llm
+
+def test_one_round_trip_picks_the_valid_candidate():
+    svc, llm = new_service([[SPANISH, WRONG_MARKER, GOOD]], GenerationPolicy(candidates=3, max_repairs=0))
+    cid, hist = asyncio.run(svc.ahandle(None, "Cats are better than dogs", stance="pro"))
+    assert llm.calls == [(3, "Cats are better than dogs")]
+    assert hist[-1]["message"].startswith("[[STANCE:pro]]")
+    assert "The answer is clear" in hist[-1]["message"]
+    stats = svc.generation.stats()
+    assert stats["first_round"] == 1 and stats["repaired"] == 0
+    assert stats["picked_index"] == {2: 1} and stats["rejected"]["not_english"] == 1
+
+def test_repair_round_is_budgeted_and_counted():
+    svc, llm = new_service([[SPANISH, SPANISH], [GOOD]], GenerationPolicy(candidates=2, max_repairs=1))
+    cid, hist = svc.handle(None, "Cats are better than dogs", stance="pro")
+    assert len(llm.calls) == 2 and "ENGLISH" in llm.calls[1][1]
+    assert svc.generation.stats()["repaired"] == 1
+
+    # No repair budget: the canned fallback after a single round trip
+    svc, llm = new_service([[SPANISH]], GenerationPolicy(candidates=1, max_repairs=0))
+    cid, hist = svc.handle(None, "Cats are better than dogs", stance="pro")
+    assert len(llm.calls) == 1
+    assert hist[-1]["message"].startswith("[[STANCE:pro]]")
+    assert svc.generation.stats()["exhausted"] == 1
+
+def test_openai_candidates_use_n():
+    llm = OpenAILLM(api_key="sk-test")
+    seen = {}
+
+    async def create(**kwargs):
+        seen.update(kwargs)
+        choices = [SimpleNamespace(message=SimpleNamespace(content=t)) for t in (SPANISH, GOOD)]
+        return SimpleNamespace(choices=choices, usage=None)
+
+    llm.aclient = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    texts = asyncio.run(llm.acandidates("Cats", "pro", [], "Why?", n=2))
+    assert seen["n"] == 2 and texts == [SPANISH, GOOD]
+
+def test_deepseek_candidates_stop_the_others_on_the_first_failure():
+    llm = DeepSeekLLM(api_key="sk-test")
+    cancelled = []
+
+    async def create(**kwargs):
+        if not cancelled:
+            cancelled.append(False)
+            raise Unavailable("boom")
+        try:
+            await asyncio.sleep(30)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    llm.aclient = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+    async def run():
+        with pytest.raises(Unavailable):
+            await llm.acandidates("Cats", "pro", [], "Why?", n=3)
+        return list(cancelled)   # before asyncio.run cancels whatever is left
+
+    assert asyncio.run(run()) == [False, True, True]
+
+def test_exhausted_or_empty_replies_fall_back_instead_of_a_bare_marker():
+    # An empty reply, or one that is only the marker, never reaches the history
+    for rounds in ([[""]], [["[[STANCE:pro]]"]]):
+        svc, llm = new_service(rounds, GenerationPolicy(candidates=1, max_repairs=0))
+        cid, hist = asyncio.run(svc.ahandle(None, "Cats are better than dogs", stance="pro"))
+        assert "I must reply in English" in hist[-1]["message"]
+        cid, hist = svc.handle(cid, "Why?")
+        assert "I must reply in English" in hist[-1]["message"]
+    assert choose(["[[STANCE:pro]]  "], "pro", is_english) == (None, False, {"empty": 1, "not_english": 0})
+
+class FakeStreamLLM:
+    def __init__(self, text):
+        self.text = text
+
+    async def astream(self, topic, stance, history, user_msg):
+        yield self.text
+
+def test_stream_without_repair_budget_falls_back():
+    for text in (SPANISH, ""):
+        svc = ConversationService(store=InMemoryConversationStore(), llms={"fake": FakeStreamLLM(text)},
+                                  default_provider="fake", policy=GenerationPolicy(max_repairs=0))
+
+        async def run():
+            return [ev async for ev in svc.astream(None, "Cats are better than dogs", stance="pro")]
+
+        done = asyncio.run(run())[-1][1]["message"][-1]["message"]
+        assert "I must reply in English" in done and svc.generation.stats()["exhausted"] == 1
+
+
+def test_from_env_defaults_match_the_constructor(monkeypatch):
+    monkeypatch.delenv("GEN_CANDIDATES", raising=False)
+    monkeypatch.delenv("GEN_MAX_REPAIRS", raising=False)
+    policy, default = from_env(), GenerationPolicy()
+    assert (policy.candidates, policy.max_repairs) == (default.candidates, default.max_repairs) == (1, 1)
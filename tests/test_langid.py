@@ -0,0 +1,33 @@
+from api.langid import detect, detect_batch, is_english
+
+SPANISH = "[[STANCE:pro]] Los gatos son mejores que los perros porque son independientes y limpios."
+ENGLISH_WITH_NAMES = "[[STANCE:contra]] José ordered a café in São Paulo, and the déjà vu was the whole argument."
+
+def test_english_passes_even_with_accents_and_loanwords():
+    assert is_english(ENGLISH_WITH_NAMES)
+    assert is_english("[[STANCE:pro]] The data on CPU latency, p99 and throughput says otherwise.")
+    # Too short to judge: never worth a retry
+    assert is_english("Sí.")
+
+def test_other_languages_are_rejected():
+    assert not is_english(SPANISH)
+    assert not is_english("Los gatos son mejores que los perros porque son independientes")  # no accents
+    assert detect(SPANISH)[0] == "es"
+    lang, confidence = detect("Die Katze ist unabhängig und braucht weniger Aufmerksamkeit als ein Hund.")
+    assert lang == "de" and 0.5 < confidence <= 1.0
+
+def test_batch_matches_single_detection():
+    texts = [SPANISH, ENGLISH_WITH_NAMES, "", "Le chat est plus indépendant que le chien."]
+    assert detect_batch(texts) == [detect(t) for t in texts]
+
+def test_plain_english_shortcut_agrees_with_the_model():
+    from api import langid
+    english = "[[STANCE:pro]] The evidence shows that cats bond with people, and that is the point for this debate."
+    normalized = langid._normalize(english)
+    assert langid._plainly_english(normalized) and detect(english)[0] == "en"
+    for other in (SPANISH, "Il gatto è più indipendente del cane e questo conta.", "No marker here; maybe español."):
+        assert not langid._plainly_english(langid._normalize(other))
+    # The ASCII fast path normalizes exactly like the regex
+    text = "It's 2024: p99_latency -- CPU/GPU, ok?!"
+    assert langid._normalize(text) == " " + langid._NON_LETTERS.sub(" ", text.lower()).strip() + " "
+    assert not is_english("No marker here; maybe español.")
@@ -0,0 +1,74 @@
+import asyncio
+import pytest
+from api.errors import RateLimited
+from api.generation import GenerationPolicy
+from api.limits import TokenBucket, ProviderLimiter, parse_duration
+from api.services import ConversationService
+from api.storage_memory import InMemoryConversationStore
+
+def test_token_bucket_refills_at_rate(clock):
+    b = TokenBucket(per_minute=60, clock=clock)   # 1 token / s, burst 60
+    assert b.reserve(60) == 0
+    assert b.delay_for(1) == pytest.approx(1.0)
+    clock.t = 5
+    assert b.delay_for(5) == 0
+
+def test_parse_duration_formats():
+    assert parse_duration("1m30s") == 90
+    assert parse_duration("20ms") == pytest.approx(0.02)
+    assert parse_duration("7") == 7
+    assert parse_duration(None) is None
+
+def test_limiter_rejects_when_budget_exceeds_max_wait(clock):
+    lim = ProviderLimiter("fake", rpm=60, max_wait=0.5, clock=clock)
+    lim.requests.tokens = 0                       # next slot is 1 s away
+    async def run():
+        async with lim.admit():
+            pass
+    with pytest.raises(RateLimited):
+        asyncio.run(run())
+    assert lim.rejected == 1 and lim.in_flight == 0
+
+def test_limiter_caps_in_flight_and_backs_off_on_429():
+    lim = ProviderLimiter("fake", max_in_flight=2, rpm=600, max_wait=1.0)
+    peak = 0
+    async def call(i):
+        nonlocal peak
+        async with lim.admit():
+            peak = max(peak, lim.in_flight)
+            await asyncio.sleep(0.01)
+            if i == 0:
+                raise RateLimited(retry_after=0.01)
+    async def run():
+        return await asyncio.gather(*(call(i) for i in range(6)), return_exceptions=True)
+    results = asyncio.run(run())
+    assert peak == 2
+    assert isinstance(results[0], RateLimited)
+    assert lim.throttled == 1 and lim.requests.rate * 60 < 600
+
+def test_observe_adopts_advertised_quota(clock):
+    lim = ProviderLimiter("fake", clock=clock)
+    lim.observe({"x-ratelimit-limit-requests": "100", "x-ratelimit-remaining-requests": "0",
+                 "x-ratelimit-reset-requests": "2s"})
+    assert lim.requests.limit == pytest.approx(90)
+    assert lim.requests.delay_for(1) == pytest.approx(2.0)
+
+def test_fan_out_books_one_slot_and_request_per_candidate(clock):
+    class FanOutLLM:
+        fans_out = True
+        def __init__(self): self.rounds = 0
+        async def acandidates(self, topic, stance, history, user_msg, n=1):
+            self.rounds += 1
+            peak.append(lim.in_flight)
+            text = "Respuesta en español con acentos." if self.rounds == 1 else "The answer is clear and in English."
+            return [f"[[STANCE:{stance}]] {text}"] * n
+
+    lim = ProviderLimiter("fake", max_in_flight=8, rpm=600, tpm=100000, clock=clock)
+    peak = []
+    svc = ConversationService(InMemoryConversationStore(), {"fake": FanOutLLM()}, default_provider="fake",
+                              limiters={"fake": lim}, policy=GenerationPolicy(candidates=3, max_repairs=1))
+    asyncio.run(svc.ahandle(None, "Cats are better than dogs"))
+    # Two round trips (first round + repair), each admitted on its own with 3 requests
+    assert lim.admitted == 2 and peak == [3, 3] and lim.in_flight == 0
+    assert lim.requests.tokens == pytest.approx(600 - 6)
+    assert 100000 - lim.tokens.tokens >= 2 * 3 * 256
@@ -0,0 +1,47 @@
+import threading
+
+from api import metrics
+from api.generation import GenerationPolicy
+from api.services import ConversationService
+from api.storage_memory import InMemoryConversationStore
+
+SPANISH = "[[STANCE:pro]] La respuesta sigue en español porque los gatos son mejores que los perros."
+
+def test_exposition_format_and_thread_shards():
+    c = metrics.Counter("t_total", "Test counter.", ("kind",))
+    h = metrics.Histogram("t_seconds", "Test histogram.", ("op",), buckets=(0.1, 1.0))
+    threads = [threading.Thread(target=lambda: [c.inc('a"b') for _ in range(1000)]) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for v in (0.05, 0.1, 0.5, 3.0):
+        h.observe(v, "get")
+    assert c.value('a"b') == 4000
+    assert c.render()[-1] == 't_total{kind="a\\"b"} 4000'
+    assert h.render()[2:] == [
+        't_seconds_bucket{op="get",le="0.1"} 2',
+        't_seconds_bucket{op="get",le="1.0"} 3',
+        't_seconds_bucket{op="get",le="+Inf"} 4',
+        't_seconds_sum{op="get"} 3.65',
+        't_seconds_count{op="get"} 4',
+    ]
+
+def test_service_reports_turns_store_provider_and_retries(fake_llm):
+    fake_llm.replies = [SPANISH]
+    svc = ConversationService(
+        store=InMemoryConversationStore(), llms={"fake": fake_llm}, default_provider="fake",
+        policy=GenerationPolicy(candidates=1, max_repairs=1),
+    )
+    turns = metrics.TURN_SECONDS.count("sync")
+    calls = metrics.PROVIDER_SECONDS.count("fake", "fake-1", "ok")
+    sets = metrics.STORE_SECONDS.count("InMemoryConversationStore", "set")
+    retries = metrics.RETRIES.value("fake", "not_english")
+
+    cid, _ = svc.handle(None, "Cats are better than dogs", stance="pro")
+    assert metrics.TURN_SECONDS.count("sync") == turns + 1
+    assert metrics.PROVIDER_SECONDS.count("fake", "fake-1", "ok") == calls + 2   # Spanish, then the repair
+    assert metrics.RETRIES.value("fake", "not_english") == retries + 1
+    assert metrics.STORE_SECONDS.count("InMemoryConversationStore", "set") == sets + 2   # bootstrap + turn
+    assert metrics.TURNS_IN_FLIGHT.value("sync") == 0
+    assert "rickbot_provider_request_seconds_bucket" in metrics.render()
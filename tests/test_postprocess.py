@@ -0,0 +1,40 @@
+import random
+
+from api.postprocess import ReplyStream, finalize, opening_banner, parse, strip_tag_and_check, truncate
+
+BODY = "Cats are independent, clean and quiet. " * 40
+
+def test_finalize_fixes_marker_and_counts_every_word():
+    assert finalize("[[STANCE:contra]] Hi there", "pro") == "[[STANCE:pro]] Hi there"
+    assert finalize("[[stance: PRO ]]Hi", "pro") == "[[STANCE:pro]] Hi"
+    assert finalize("[[STANCE:st]] Hi", "contra") == "[[STANCE:contra]] Hi"
+    assert finalize("No marker", "pro") == "[[STANCE:pro]] No marker"
+    assert finalize("", "pro") == "[[STANCE:pro]]"
+
+    out = finalize(BODY, "pro")
+    assert len(out.split()) == 180 and out.startswith("[[STANCE:pro]] Cats")
+    banner = opening_banner("Cats", "pro")
+    out = finalize(BODY, "pro", banner)
+    assert len(out.split()) == 180 and out.startswith("[[STANCE:pro]] " + banner + " Cats")
+    # Already carries the banner (e.g. a cached reply): not added twice
+    assert finalize(out, "pro", banner) == out
+
+def test_helpers_agree_with_the_marker_rules():
+    assert parse("[[STANCE:pro]]  body  ") == ("pro", "body")
+    assert strip_tag_and_check("[[STANCE:contra]] body", "pro") == ("body", False)
+    assert truncate("a  b\nc d", 3) == "a b c"
+
+def test_stream_matches_finalize_for_any_chunking():
+    banner = opening_banner("Cats", "contra")
+    rng = random.Random(3)
+    for text in ("[[STANCE:pro]] " + BODY, "  No marker at all, just words " * 3, "[[STANCE:contra]]Short", BODY):
+        for b in (None, banner):
+            for _ in range(20):
+                s = ReplyStream("contra", banner=b)
+                i, out = 0, []
+                while i < len(text):
+                    j = i + rng.randint(1, 9)
+                    out.append(s.feed(text[i:j]))
+                    i = j
+                out.append(s.close())
+                assert "".join(out) == s.text == finalize(text, "contra", b)
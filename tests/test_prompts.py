@@ -0,0 +1,55 @@
+import asyncio
+from types import SimpleNamespace
+
+from api.llm_deepseek import DeepSeekLLM
+from api.llm_gemini import GeminiLLM
+from api.llm_openai import OpenAILLM
+from api.prompts import prefix_key, system_prompt
+
+HISTORY = [{"role": "user", "message": "Cats rule"}, {"role": "bot", "message": "[[STANCE:pro]] Indeed."}]
+
+def test_prefix_is_one_stable_system_message():
+    llm = OpenAILLM(api_key="sk-test")
+    first = llm._messages("Cats", "pro", [], "Cats rule")
+    later = llm._messages("Cats", "pro", HISTORY, "Why?", summary="- User: older point")
+    assert first[0] == later[0] == {"role": "system", "content": system_prompt("Cats", "pro")}
+    assert [m["role"] for m in later[1:]] == ["user", "assistant", "system", "user"]
+    assert prefix_key("Cats", "pro") != prefix_key("Cats", "contra")
+
+def test_gemini_rules_go_to_system_instruction():
+    llm = GeminiLLM(api_key="test-key")
+    contents = llm._contents("Cats", "pro", HISTORY, "Why?")
+    assert [c["role"] for c in contents] == ["user", "model", "user"]
+    model = llm._model_for("Cats", "pro")
+    assert model is llm._model_for("Cats", "pro")
+    assert model._system_instruction.parts[0].text == system_prompt("Cats", "pro")
+    assert llm.usage.stats()["prefix_cache"] is False
+
+class FakeCompletions:
+    def __init__(self, usage):
+        self.usage = usage
+        self.kwargs = None
+
+    async def create(self, **kwargs):
+        self.kwargs = kwargs
+        msg = SimpleNamespace(content="[[STANCE:pro]] A reply.")
+        return SimpleNamespace(choices=[SimpleNamespace(message=msg)], usage=self.usage)
+
+def wire(llm, usage):
+    completions = FakeCompletions(usage)
+    llm.aclient = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    return completions
+
+def test_cached_tokens_are_counted_per_provider():
+    openai_llm = OpenAILLM(api_key="sk-test")
+    calls = wire(openai_llm, SimpleNamespace(prompt_tokens=1200, completion_tokens=50,
+                                             prompt_tokens_details=SimpleNamespace(cached_tokens=1024)))
+    asyncio.run(openai_llm.achat("Cats", "pro", HISTORY, "Why?"))
+    assert calls.kwargs["prompt_cache_key"] == prefix_key("Cats", "pro")
+    assert openai_llm.usage.stats()["cached_tokens"] == 1024
+
+    deepseek_llm = DeepSeekLLM(api_key="sk-test")
+    calls = wire(deepseek_llm, SimpleNamespace(prompt_tokens=800, completion_tokens=40, prompt_cache_hit_tokens=640))
+    asyncio.run(deepseek_llm.achat("Cats", "pro", HISTORY, "Why?"))
+    assert "prompt_cache_key" not in calls.kwargs
+    assert deepseek_llm.usage.stats()["cache_hit_ratio"] == 0.8
@@ -0,0 +1,116 @@
+import asyncio
+import pytest
+from api.errors import AdmissionRejected, Unavailable, AuthError
+from api.routing import Router, CircuitBreaker, ProviderSelector
+from api.services import ConversationService
+from api.storage_memory import InMemoryConversationStore
+
+# Async fake provider with a fixed delay and optional failure
+class SlowLLM:
+    def __init__(self, delay=0.0, fail=None, reply="[[STANCE:{stance}]] From {name}."):
+        self.delay, self.fail, self.reply, self.calls = delay, fail, reply, 0
+    async def achat(self, topic, stance, history, user_msg):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise self.fail()
+        return self.reply.format(stance=stance, name=id(self))
+    def chat(self, topic, stance, history, user_msg):
+        return asyncio.run(self.achat(topic, stance, history, user_msg))
+
+def test_breaker_opens_and_half_opens():
+    t = [0.0]
+    b = CircuitBreaker(failure_threshold=2, reset_after=10, clock=lambda: t[0])
+    b.record_failure(); b.record_failure()
+    assert b.state == "open" and not b.allow()
+    t[0] = 11
+    assert b.allow() and not b.allow()      # single probe
+    b.record_success()
+    assert b.state == "closed"
+
+def test_non_failover_error_on_the_probe_frees_the_breaker():
+    t = [0.0]
+    router = Router(["a", "b"], policy="failover", failure_threshold=1, reset_after=10, clock=lambda: t[0])
+    router.breakers["a"].record_failure()
+    t[0] = 11
+    llms = {"a": SlowLLM(fail=AuthError), "b": SlowLLM()}
+    with pytest.raises(AuthError):
+        asyncio.run(router.call("a", lambda p: llms[p].achat("t", "pro", [], "m")))
+    # The probe was spent on an error that is not a verdict: the next call may probe again
+    assert router.breakers["a"].allow()
+
+def test_failover_moves_to_backup_but_keeps_pin():
+    llms = {"a": SlowLLM(fail=Unavailable), "b": SlowLLM()}
+    router = Router(["a", "b"], policy="failover")
+    svc = ConversationService(InMemoryConversationStore(), llms, default_provider="a", router=router)
+    cid, hist = asyncio.run(svc.ahandle(None, "The Earth is flat", stance="pro"))
+    assert hist[-1]["message"].startswith("[[STANCE:pro]]")
+    assert svc.store.get(cid)["provider"] == "a"
+    assert router.failovers == 1 and llms["b"].calls == 1
+
+def test_local_rejections_fail_over_without_opening_the_breaker():
+    llms = {"a": SlowLLM(fail=AdmissionRejected), "b": SlowLLM()}
+    router = Router(["a", "b"], policy="failover", failure_threshold=1)
+    for _ in range(3):
+        provider, _ = asyncio.run(router.call("a", lambda p: llms[p].achat("t", "pro", [], "m")))
+        assert provider == "b"
+    assert router.breakers["a"].state == "closed" and llms["a"].calls == 3
+
+def test_hedge_uses_faster_backup():
+    llms = {"a": SlowLLM(delay=0.5), "b": SlowLLM(delay=0.01)}
+    router = Router(["a", "b"], policy="hedge", hedge_delay=0.05)
+    async def run():
+        return await router.call("a", lambda p: llms[p].achat("t", "pro", [], "m"))
+    provider, _ = asyncio.run(run())
+    assert provider == "b" and router.hedges == 1
+
+def test_non_retryable_errors_do_not_fail_over():
+    llms = {"a": SlowLLM(fail=AuthError), "b": SlowLLM()}
+    router = Router(["a", "b"], policy="failover")
+    with pytest.raises(AuthError):
+        asyncio.run(router.call("a", lambda p: llms[p].achat("t", "pro", [], "m")))
+    assert llms["b"].calls == 0
+
+def test_selector_prefers_fast_healthy_provider():
+    t = [0.0]
+    sel = ProviderSelector({"a": "m-a", "b": "m-b"}, half_life=2, explore=0, clock=lambda: t[0])
+    for _ in range(5):
+        t[0] += 1
+        sel.record("a", 0.2, ok=True)
+        sel.record("b", 1.0, ok=True)
+    assert sel.pick("b") == "a"
+    # "a" starts failing: it drops out within a few seconds of errors
+    for _ in range(3):
+        t[0] += 1
+        sel.record("a", 5.0, ok=False)
+    assert sel.pick("b") == "b"
+    assert sel.stats()["a"]["healthy"] is False
+
+def test_new_conversations_follow_selector():
+    llms = {"a": SlowLLM(), "b": SlowLLM()}
+    sel = ProviderSelector({"a": "m", "b": "m"}, explore=0)
+    sel.record("a", 3.0, ok=True)
+    sel.record("b", 0.1, ok=True)
+    svc = ConversationService(InMemoryConversationStore(), llms, default_provider="a", selector=sel)
+    cid, _ = asyncio.run(svc.ahandle(None, "The Earth is flat"))
+    assert svc.store.get(cid)["provider"] == "b"
+    cid, _ = asyncio.run(svc.ahandle(None, "Cats are great", provider="a"))
+    assert svc.store.get(cid)["provider"] == "a"    # explicit header still wins
+
+def test_sync_and_stream_turns_feed_the_selector():
+    llms = {"a": SlowLLM(delay=0.05), "b": SlowLLM(fail=Unavailable)}
+    sel = ProviderSelector({"a": "m", "b": "m"}, explore=0)
+    svc = ConversationService(InMemoryConversationStore(), llms, default_provider="a", selector=sel)
+
+    async def stream(provider):
+        return [ev async for ev in svc.astream(None, "Cats are great", provider=provider)]
+
+    svc.handle(None, "The Earth is flat")
+    asyncio.run(stream("a"))
+    assert sel.scores["a"].calls == 2 and sel.scores["a"].errors == 0
+    assert sel.stats()["a"]["ewma_ms"] >= 50
+    with pytest.raises(Unavailable):
+        svc.handle(None, "The Earth is flat", provider="b")
+    with pytest.raises(Unavailable):
+        asyncio.run(stream("b"))
+    assert sel.scores["b"].calls == 2 and sel.scores["b"].errors == 2
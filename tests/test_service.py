@@ -1,3 +1,4 @@
+import asyncio
 import re
 from api.services import ConversationService
 from api.storage_memory import InMemoryConversationStore
@@ -43,6 +44,14 @@ def test_first_turn_banner_marker_english():
     assert is_english(bot)
     assert words_count(bot) <= 180
 
+def test_spanish_first_reply_is_replaced_by_the_repair():
+    spanish = "No marker here; la respuesta sigue en español porque la tierra es plana."
+    svc = new_service(script=[spanish])
+    cid, hist = svc.handle(None, 'The Earth is flat', stance="pro")
+    bot = hist[-1]["message"]
+    assert "español" not in bot and "Fixed topic:" in bot and is_english(bot)
+    assert svc.llms["fake"].calls == 2   # the reply-in-English repair round
+
 def test_history_cap_and_order():
      # Verify that history is trimmed to last 5 turns (10 messages)
     svc = new_service()
@@ -65,3 +74,37 @@ def test_force_english_if_user_requests_spanish():
     assert bot.startswith("[[STANCE:pro]]")
     assert is_english(bot)
     assert words_count(bot) <= 180
+
+def test_async_handle_matches_sync_rules():
+    # FakeLLM only has a sync chat(); ahandle must still work through a thread
+    svc = new_service(script=["No marker here; maybe español."])
+    cid, hist = asyncio.run(svc.ahandle(None, 'The Earth is flat', stance="contra"))
+    bot = hist[-1]["message"]
+    assert bot.startswith("[[STANCE:contra]]")
+    assert "Fixed topic:" in bot
+    cid2, hist = asyncio.run(svc.ahandle(cid, "turn 1"))
+    assert cid2 == cid and len(hist) == 4
+
+class FakeStreamLLM(FakeLLM):
+    # Streams the scripted reply in small uneven chunks
+    async def astream(self, topic, stance, history, user_msg):
+        text = self.chat(topic, stance, history, user_msg)
+        for i in range(0, len(text), 7):
+            yield text[i:i + 7]
+
+async def collect(agen):
+    return [ev async for ev in agen]
+
+def test_stream_matches_sync_reply():
+    long_reply = "[[STANCE:contra]] " + " ".join(f"word{i}" for i in range(300)) + " the end"
+    store = InMemoryConversationStore()
+    svc = ConversationService(store=store, llms={"fake": FakeStreamLLM(script=[long_reply])}, default_provider="fake")
+    events = asyncio.run(collect(svc.astream(None, "The Earth is flat", stance="pro")))
+    assert events[0][0] == "meta" and events[-1][0] == "done"
+    streamed = "".join(d for ev, d in events if ev == "delta")
+    final = events[-1][1]["message"][-1]["message"]
+    assert streamed == final
+    assert final.startswith("[[STANCE:pro]]")       # wrong marker fixed mid-stream
+    assert "Fixed topic: The Earth is flat." in final
+    assert words_count(final) == 180
+    assert store.get(events[0][1]["conversation_id"])["history"][-1]["message"] == final
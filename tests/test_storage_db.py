@@ -0,0 +1,97 @@
+import asyncio
+import threading
+import pytest
+from sqlalchemy import create_engine
+
+from api.persistence import storage_db
+from api.persistence.models import Base
+from api.persistence.storage_db import DBConversationStore
+from api.errors import Unavailable
+from api.services import ConversationService
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    eng = create_engine(f"sqlite:///{tmp_path / 's.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(eng)
+    monkeypatch.setattr(storage_db, "engine", eng)
+    yield DBConversationStore(history_limit=4)
+    eng.dispose()
+
+def test_async_turns_read_off_the_event_loop(store, fake_llm):
+    svc = ConversationService(store=store, llms={"fake": fake_llm}, default_provider="fake")
+    reads = []
+    get = store.get
+    store.get = lambda cid: reads.append(threading.current_thread()) or get(cid)
+
+    async def run():
+        cid, _ = await svc.ahandle(None, "Cats are better than dogs")
+        return await svc.ahandle(cid, "Why?")
+
+    cid, hist = asyncio.run(run())
+    assert len(hist) == 4 and reads and threading.main_thread() not in reads
+
+STATE = {"topic": "T", "stance": "pro", "provider": "fake", "history": []}
+
+def turn(i):
+    return [{"role": "user", "message": f"u{i}"}, {"role": "bot", "message": f"b{i}"}]
+
+def transcript(store, cid):
+    return [(m["seq"], m["message"]) for m in store.messages(cid, limit=200)]
+
+@pytest.mark.parametrize("upsert", [True, False])
+def test_whole_state_writes_keep_the_transcript(store, upsert):
+    if not upsert:
+        store._insert = None          # dialect without INSERT ... ON CONFLICT
+    cid = store.new_id()
+    for i in range(3):
+        store.append(cid, STATE, turn(i))
+    # The state only carries the trimmed tail plus one turn the table has not seen
+    store.set(cid, {**STATE, "history": turn(1) + turn(2) + turn(3), "summary": "s", "message_count": 8})
+    store.write_batch([(cid, {**STATE, "history": turn(3) + turn(4), "message_count": 10}, None)])
+    store.set(cid, {**STATE, "history": turn(4), "message_count": 10})   # repeated write: no-op
+    store.append(cid, STATE, turn(5))
+    assert transcript(store, cid) == [(i + 1, m["message"]) for i, m in enumerate(sum((turn(i) for i in range(6)), []))]
+    assert [m["message"] for m in store.get(cid)["history"]] == ["u4", "b4", "u5", "b5"]
+
+def test_set_creates_a_new_conversation(store):
+    cid = store.new_id()
+    store.set(cid, {**STATE, "history": turn(0)})
+    store.set(cid, {**STATE, "history": turn(0)})
+    assert transcript(store, cid) == [(1, "u0"), (2, "b0")]
+
+def test_whole_state_writes_line_up_by_position_not_text(store):
+    # Identical turns (same question, same canned reply) must neither be skipped nor written twice
+    same = [{"role": "user", "message": "Why?"}, {"role": "bot", "message": "fallback"}]
+    cid = store.new_id()
+    store.append(cid, STATE, same)
+    state = store.get(cid)
+    assert state["message_count"] == 2
+    for _ in range(2):
+        state = {**state, "history": state["history"][-2:] + same, "message_count": state["message_count"] + 2}
+        store.set(cid, state)
+    assert transcript(store, cid) == [(i + 1, m["message"]) for i, m in enumerate(same * 3)]
+
+def test_failed_first_stream_leaves_a_usable_conversation(store, fake_llm):
+    class FlakyLLM:
+        down = True
+        def chat(self, topic, stance, history, user_msg):
+            return fake_llm.chat(topic, stance, history, user_msg)
+        async def astream(self, topic, stance, history, user_msg):
+            if self.down:
+                self.down = False
+                raise Unavailable()
+            yield self.chat(topic, stance, history, user_msg)
+
+    svc = ConversationService(store=store, llms={"fake": FlakyLLM()}, default_provider="fake")
+
+    async def run():
+        events = []
+        with pytest.raises(Unavailable):
+            async for ev in svc.astream(None, "Cats are better than dogs"):
+                events.append(ev)
+        cid = events[0][1]["conversation_id"]   # the UI keeps this id
+        return cid, await svc.ahandle(cid, "Why?")
+
+    cid, (_, hist) = asyncio.run(run())
+    assert [m["message"] for m in hist] == ["Why?", hist[-1]["message"]]
+    assert transcript(store, cid) == [(1, "Why?"), (2, hist[-1]["message"])]
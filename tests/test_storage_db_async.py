@@ -0,0 +1,96 @@
+import asyncio
+import pytest
+
+pytest.importorskip("aiosqlite")
+pytest.importorskip("greenlet")
+
+from api.persistence.db_async import async_url, make_async_engine
+from api.persistence.storage_db_async import AsyncDBConversationStore
+from api.services import ConversationService, ConversationNotFound
+
+def make_store(tmp_path, history_limit=10):
+    store = AsyncDBConversationStore(make_async_engine(f"sqlite:///{tmp_path / 'a.db'}"), history_limit=history_limit)
+    asyncio.run(store.create_tables())
+    return store
+
+def test_async_url_maps_drivers():
+    assert async_url("sqlite:///./c.db") == "sqlite+aiosqlite:///./c.db"
+    assert async_url("postgresql://u:p@db/app") == "postgresql+asyncpg://u:p@db/app"
+    assert async_url("postgresql+psycopg://u@db/app") == "postgresql+asyncpg://u@db/app"
+
+def test_append_get_set_roundtrip(tmp_path):
+    store = make_store(tmp_path, history_limit=4)
+    state = {"topic": "T", "stance": "pro", "provider": "openai", "history": []}
+
+    async def run():
+        cid = store.new_id()
+        assert await store.get(cid) is None
+        for i in range(3):
+            await store.append(cid, state, [{"role": "user", "message": f"u{i}"}, {"role": "bot", "message": f"b{i}"}])
+        got = await store.get(cid)
+        # A whole-state write only adds what the transcript is missing
+        await store.set(cid, {**got, "history": got["history"] + [{"role": "user", "message": "u3"}],
+                              "message_count": got["message_count"] + 1})
+        after = await store.get(cid)
+        page = await store.messages(cid, limit=50)
+        await store.aclose()
+        return got, after, page
+
+    got, after, page = asyncio.run(run())
+    assert [m["message"] for m in got["history"]] == ["u1", "b1", "u2", "b2"]
+    assert [m["message"] for m in after["history"]] == ["b1", "u2", "b2", "u3"]
+    assert [m["seq"] for m in page] == list(range(1, 8)) and page[0]["message"] == "u0"
+
+def test_concurrent_conversations_through_service(tmp_path, fake_llm):
+    store = make_store(tmp_path)
+    svc = ConversationService(store=store, llms={"fake": fake_llm}, default_provider="fake")
+
+    async def debate():
+        cid, _ = await svc.ahandle(None, "Cats are better than dogs")
+        for _ in range(2):
+            cid, hist = await svc.ahandle(cid, "Why?")
+        return cid, hist
+
+    async def run():
+        results = await asyncio.gather(*(debate() for _ in range(8)))
+        stored = [await store.get(cid) for cid, _ in results]
+        with pytest.raises(ConversationNotFound):
+            await svc.ahandle("missing", "hi")
+        await store.aclose()
+        return results, stored
+
+    results, stored = asyncio.run(run())
+    assert len({cid for cid, _ in results}) == 8
+    for (_, hist), state in zip(results, stored):
+        assert len(state["history"]) == 6
+        assert state["history"] == hist
+
+def test_sync_handle_rejects_async_store(tmp_path, fake_llm):
+    store = make_store(tmp_path)
+    svc = ConversationService(store=store, llms={"fake": fake_llm}, default_provider="fake")
+    with pytest.raises(TypeError):
+        svc.handle(None, "hi")
+    asyncio.run(store.aclose())
+
+def test_transcript_pages_walk_back_by_seq(tmp_path):
+    store = make_store(tmp_path, history_limit=4)
+    state = {"topic": "T", "stance": "pro", "provider": "openai", "history": []}
+
+    async def run():
+        cid = store.new_id()
+        for i in range(6):
+            await store.append(cid, state, [{"role": "user", "message": f"u{i}"}, {"role": "bot", "message": f"b{i}"}])
+        newest = await store.messages(cid, limit=5)
+        older = await store.messages(cid, before=newest[0]["seq"], limit=5)
+        oldest = await store.messages(cid, before=older[0]["seq"], limit=5)
+        context = await store.get(cid)
+        missing = await store.messages("nope")
+        await store.aclose()
+        return newest, older, oldest, context, missing
+
+    newest, older, oldest, context, missing = asyncio.run(run())
+    assert [m["seq"] for m in newest] == [8, 9, 10, 11, 12]
+    assert [m["seq"] for m in older] == [3, 4, 5, 6, 7]
+    assert [m["message"] for m in oldest] == ["u0", "b0"]
+    assert len(context["history"]) == 4   # the context window stays small
+    assert missing is None
@@ -0,0 +1,69 @@
+from api.storage_memory import InMemoryConversationStore
+
+def state(topic, n=0):
+    hist = [{"role": "user" if i % 2 == 0 else "bot", "message": f"m{i}"} for i in range(n)]
+    return {"topic": topic, "stance": "pro", "provider": "fake", "history": hist}
+
+def test_roundtrip_returns_plain_state():
+    store = InMemoryConversationStore()
+    store.set("a", state("t", 4))
+    got = store.get("a")
+    assert got == state("t", 4)
+    got["history"].append({"role": "user", "message": "x"})   # caller copy, not the record
+    assert len(store.get("a")["history"]) == 4
+
+def test_lru_eviction_by_count_and_bytes():
+    store = InMemoryConversationStore(max_conversations=2, shards=1)   # one LRU order
+    store.set("a", state("a")); store.set("b", state("b"))
+    store.get("a")                           # "b" becomes least recent
+    store.set("c", state("c"))
+    assert store.get("b") is None and store.get("a") and store.get("c")
+    one = store.footprint()["bytes"] // 2
+    small = InMemoryConversationStore(max_bytes=int(one * 1.5), shards=1)
+    small.set("a", state("a")); small.set("b", state("b"))
+    assert small.footprint()["conversations"] == 1 and small.evictions == 1
+
+def test_idle_ttl_expiry(clock):
+    store = InMemoryConversationStore(idle_ttl=60, clock=clock, shards=1)
+    store.set("a", state("a"))
+    clock.t = 30; store.set("b", state("b"))
+    clock.t = 70
+    assert store.get("a") is None and store.get("b")
+    assert store.footprint()["expirations"] == 1
+
+def test_concurrent_turns_on_one_conversation_keep_every_message():
+    import asyncio
+    from api.services import ConversationService
+
+    class SlowLLM:
+        async def achat(self, topic, stance, history, user_msg):
+            await asyncio.sleep(0.01)
+            return f"[[STANCE:{stance}]] The answer to {user_msg} is in the evidence."
+
+    store = InMemoryConversationStore()
+    svc = ConversationService(store, {"slow": SlowLLM()}, default_provider="slow")
+
+    async def run():
+        cid, _ = await svc.ahandle(None, "The Earth is flat")
+        await asyncio.gather(*(svc.ahandle(cid, f"turn {i}") for i in range(3)))
+        return cid
+
+    cid = asyncio.run(run())
+    users = [m["message"] for m in store.get(cid)["history"] if m["role"] == "user"]
+    assert users[1:] == ["turn 0", "turn 1", "turn 2"]     # none dropped, arrival order
+
+def test_limits_are_global_across_the_default_shards(clock):
+    store = InMemoryConversationStore(max_conversations=10, clock=clock)
+    for i in range(40):
+        clock.t = i
+        store.set(f"c{i}", state(f"c{i}"))
+    # Exactly the limit, and the survivors are the 10 most recent (LRU across shards)
+    assert store.footprint()["conversations"] == 10 and store.evictions == 30
+    assert [i for i in range(40) if store.get(f"c{i}")] == list(range(30, 40))
+
+    one = store.footprint()["bytes"] // 10
+    small = InMemoryConversationStore(max_bytes=one * 5)
+    for i in range(20):
+        small.set(f"c{i}", state(f"c{i}"))
+        assert small.footprint()["bytes"] <= one * 5
+    assert small.footprint()["conversations"] == 5
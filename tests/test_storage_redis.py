@@ -0,0 +1,92 @@
+import asyncio
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from api.storage_redis import RedisConversationStore
+from api.services import ConversationService, ConversationNotFound
+
+def make_store(**kw):
+    return RedisConversationStore(fakeredis.FakeAsyncRedis(decode_responses=True), **kw)
+
+def test_append_trims_to_history_limit():
+    store = make_store(history_limit=4, ttl=60)
+    state = {"topic": "T", "stance": "pro", "provider": "openai", "history": []}
+
+    async def run():
+        cid = store.new_id()
+        assert await store.get(cid) is None
+        for i in range(3):
+            await store.append(cid, state, [{"role": "user", "message": f"u{i}"}, {"role": "bot", "message": f"b{i}"}])
+        got = await store.get(cid)
+        length = await store.client.llen(f"rickbot:conv:{cid}:msgs")
+        ttl = await store.client.ttl(f"rickbot:conv:{cid}")
+        await store.set(cid, {**state, "history": [{"role": "user", "message": "only"}]})
+        return got, length, ttl, await store.get(cid)
+
+    got, length, ttl, reset = asyncio.run(run())
+    assert [m["message"] for m in got["history"]] == ["u1", "b1", "u2", "b2"]
+    assert length == 4 and 0 < ttl <= 60
+    assert reset["history"] == [{"role": "user", "message": "only"}]
+
+def test_two_services_share_one_store(fake_llm):
+    # Two "workers" with their own service objects, one Redis
+    client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    a = ConversationService(store=RedisConversationStore(client), llms={"fake": fake_llm}, default_provider="fake")
+    b = ConversationService(store=RedisConversationStore(client), llms={"fake": fake_llm}, default_provider="fake")
+
+    async def run():
+        cid, _ = await a.ahandle(None, "Cats are better than dogs")
+        cid, hist = await b.ahandle(cid, "Why?")
+        with pytest.raises(ConversationNotFound):
+            await b.ahandle("missing", "hi")
+        return hist
+
+    hist = asyncio.run(run())
+    assert [m["role"] for m in hist] == ["user", "bot", "user", "bot"]
+    assert hist[0]["message"] == "Cats are better than dogs"
+
+def test_transcript_is_kept_past_the_context_window():
+    store = make_store(history_limit=2)
+    state = {"topic": "T", "stance": "pro", "provider": "openai", "history": []}
+
+    async def run():
+        cid = store.new_id()
+        for i in range(3):
+            await store.append(cid, state, [{"role": "user", "message": f"u{i}"}, {"role": "bot", "message": f"b{i}"}])
+        return (
+            await store.messages(cid, limit=4),
+            await store.messages(cid, before=3, limit=4),
+            await store.messages(cid, before=1),
+            await store.messages(cid, before=100, limit=4),
+            await store.messages("nope"),
+            await store.get(cid),
+        )
+
+    newest, first, empty, past_end, missing, context = asyncio.run(run())
+    assert [(m["seq"], m["message"]) for m in newest] == [(3, "u1"), (4, "b1"), (5, "u2"), (6, "b2")]
+    assert [(m["seq"], m["message"]) for m in first] == [(1, "u0"), (2, "b0")]
+    assert empty == [] and missing is None
+    assert past_end == newest   # a cursor past the end reads the newest page, like the SQL stores
+    assert len(context["history"]) == 2
+
+def test_set_keeps_the_full_transcript():
+    from api.services import HISTORY_CAP
+    store = make_store(history_limit=HISTORY_CAP)
+    state = {"topic": "T", "stance": "pro", "provider": "openai", "history": []}
+    turns = HISTORY_CAP   # 2*HISTORY_CAP messages, more than the window holds
+
+    async def run():
+        cid = store.new_id()
+        for i in range(turns):
+            await store.append(cid, state, [{"role": "user", "message": f"u{i}"}, {"role": "bot", "message": f"b{i}"}])
+        window = (await store.get(cid))["history"]
+        await store.set(cid, {**state, "history": window, "summary": "s"})
+        fresh = store.new_id()
+        await store.set(fresh, {**state, "history": window[:2]})
+        return await store.messages(cid, limit=1000), await store.get(cid), await store.messages(fresh)
+
+    log, got, fresh = asyncio.run(run())
+    assert [m["seq"] for m in log] == list(range(1, 2 * turns + 1)) and log[0]["message"] == "u0"
+    assert got["summary"] == "s" and len(got["history"]) == HISTORY_CAP
+    assert [m["message"] for m in fresh] == [m["message"] for m in log[-HISTORY_CAP:][:2]]
@@ -0,0 +1,135 @@
+import asyncio
+import threading
+import uuid
+import pytest
+
+from api.persistence.storage_tiered import WriteBehindStore
+from api.storage_memory import InMemoryConversationStore
+from api.services import ConversationService
+
+class FakeDB:
+    """Stands in for DBConversationStore: records batches, optionally blocks or fails."""
+    def __init__(self):
+        self.rows = {}
+        self.batches = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.fail_cid = None
+
+    def new_id(self):
+        return uuid.uuid4().hex
+
+    def get(self, cid):
+        return self.rows.get(cid)
+
+    def write_batch(self, items):
+        self.gate.wait()
+        if any(cid == self.fail_cid for cid, _, _ in items):
+            raise RuntimeError("boom")
+        self.batches.append(len(items))
+        for cid, state, messages in items:
+            if messages is None:
+                self.rows[cid] = {**state, "history": list(state["history"])}
+            else:
+                self.rows.setdefault(cid, {**state, "history": []})["history"].extend(messages)
+
+class FakeWriter:
+    def __init__(self):
+        self.closed = 0
+
+    def close(self):
+        self.closed += 1
+
+STATE = {"topic": "T", "stance": "pro", "provider": "fake", "history": []}
+
+def turn(i):
+    return [{"role": "user", "message": f"u{i}"}, {"role": "bot", "message": f"b{i}"}]
+
+def test_turns_return_before_the_flush_and_close_persists(fake_llm):
+    db = FakeDB()
+    store = WriteBehindStore(db, flush_interval=60)
+    svc = ConversationService(store=store, llms={"fake": fake_llm}, default_provider="fake")
+    cids = [svc.handle(None, f"topic {i}")[0] for i in range(5)]
+    svc.handle(cids[0], "again")
+    assert db.rows == {}                     # nothing written yet
+    assert len(store.get(cids[0])["history"]) == 4
+    store.close()
+    assert db.batches == [5]                 # one transaction for everything dirty
+    assert len(db.rows[cids[0]]["history"]) == 4
+
+def test_backing_writer_is_exposed_and_closed():
+    db = FakeDB()
+    bare = WriteBehindStore(db, flush_interval=60)
+    assert bare.writer is None
+    bare.close()
+    db.writer = FakeWriter()
+    store = WriteBehindStore(db, flush_interval=60)
+    assert store.writer is db.writer
+    store.close()
+    assert db.writer.closed == 1
+
+def test_read_through_on_miss():
+    db = FakeDB()
+    db.rows["old"] = {**STATE, "history": turn(0)}
+    store = WriteBehindStore(db, hot=InMemoryConversationStore(max_conversations=1, shards=1), flush_interval=60)
+    assert store.get("old")["history"] == turn(0)
+    assert store.stats()["read_through"] == 1
+    # Evicted from the hot tier while still dirty: served from the pending write, not the DB
+    store.append("new", {**STATE, "history": turn(1)}, turn(1))
+    store.append("other", {**STATE, "history": turn(2)}, turn(2))
+    assert store.get("new")["history"] == turn(1)
+    store.close()
+
+def test_dirty_bound_applies_backpressure():
+    db = FakeDB()
+    store = WriteBehindStore(db, flush_interval=60, max_dirty=2)
+    store.append("a", STATE, turn(0))
+    store.append("b", STATE, turn(0))
+    store.append("a", STATE, turn(1))        # already dirty: no new slot needed
+    done = threading.Event()
+    threading.Thread(target=lambda: (store.append("c", STATE, turn(0)), done.set())).start()
+    assert done.wait(2)                      # kicked an early flush instead of waiting 60s
+    assert store.stats()["backpressure_waits"] >= 1
+    assert db.rows["a"]["history"] == turn(0) + turn(1)
+    store.close()
+
+def test_failed_conversation_is_retried_without_blocking_others():
+    db = FakeDB()
+    db.fail_cid = "bad"
+    store = WriteBehindStore(db, flush_interval=60)
+    store.append("bad", STATE, turn(0))
+    store.append("good", STATE, turn(0))
+    store.flush()
+    assert "good" in db.rows and store.stats()["dirty"] == 1
+    db.fail_cid = None
+    store.append("bad", STATE, turn(1))
+    store.close()
+    assert db.rows["bad"]["history"] == turn(0) + turn(1)
+
+def test_async_turns(fake_llm):
+    db = FakeDB()
+    store = WriteBehindStore(db, flush_interval=0.01)
+    svc = ConversationService(store=store, llms={"fake": fake_llm}, default_provider="fake")
+
+    async def run():
+        cid, _ = await svc.ahandle(None, "Cats")
+        cid, hist = await svc.ahandle(cid, "Why?")
+        return cid, hist
+
+    cid, hist = asyncio.run(run())
+    store.close()
+    assert db.rows[cid]["history"] == hist
+
+def test_persistently_failing_turns_are_kept_and_reported(caplog):
+    db = FakeDB()
+    db.fail_cid = "bad"
+    store = WriteBehindStore(db, flush_interval=60, max_attempts=2)
+    store.append("bad", STATE, turn(0))
+    for _ in range(3):
+        store.flush()
+    assert store.stats()["dirty"] == 1 and store.stats()["stuck"] == 1
+    assert "bad" in caplog.text
+    db.fail_cid = None
+    store.append("bad", STATE, turn(1))
+    store.close()
+    assert db.rows["bad"]["history"] == turn(0) + turn(1)   # nothing lost, in order
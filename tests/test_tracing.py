@@ -0,0 +1,56 @@
+import asyncio
+import json
+import threading
+
+from api import tracing
+from api.services import ConversationService
+from api.storage_memory import InMemoryConversationStore
+
+def test_spans_nest_and_sum_into_server_timing():
+    with tracing.span("outside"):
+        pass   # no request: nothing recorded, nothing raised
+    with tracing.request("GET /x") as trace:
+        with tracing.span("store.get"):
+            with tracing.span("prompt"):
+                pass
+        with tracing.span("store.get"):
+            pass
+    names = [(s[2], s[1]) for s in trace.spans]
+    prompt_parent = names[0][1]
+    assert names[0][0] == "prompt" and prompt_parent == trace.spans[1][0]
+    assert trace.spans[1][1] == trace.spans[2][1] == trace.span_id
+    header = trace.server_timing()
+    assert header.startswith('prompt;dur=') and 'store.get;desc="x2";dur=' in header
+    assert header.split(", ")[-1].startswith("total;dur=")
+
+def test_otlp_export_shape():
+    with tracing.request("POST /conversation") as trace:
+        with tracing.span("upstream.fake"):
+            pass
+    spans = json.loads(json.dumps(trace.otlp()))["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    root, child = spans
+    assert root["name"] == "POST /conversation" and "parentSpanId" not in root
+    assert child["parentSpanId"] == root["spanId"] and child["traceId"] == root["traceId"] == trace.trace_id
+    assert len(root["traceId"]) == 32 and len(root["spanId"]) == 16
+    assert int(root["startTimeUnixNano"]) <= int(child["startTimeUnixNano"]) <= int(child["endTimeUnixNano"])
+
+def test_service_spans_follow_the_request_into_threads(fake_llm):
+    svc = ConversationService(store=InMemoryConversationStore(), llms={"fake": fake_llm}, default_provider="fake")
+    with tracing.request("POST /conversation") as trace:
+        asyncio.run(svc.ahandle(None, "Cats are better than dogs", stance="pro"))
+    names = [s[2] for s in trace.spans]
+    assert {"turn", "store.set", "upstream.fake", "postprocess"} <= set(names)
+    turn = next(s for s in trace.spans if s[2] == "turn")
+    assert all(s[1] == turn[0] for s in trace.spans if s[2] != "turn")
+
+def test_export_is_written_off_the_calling_thread(tmp_path, monkeypatch):
+    path = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(tracing, "EXPORT_PATH", str(path))
+    writers = []
+    export = tracing._export
+    monkeypatch.setattr(tracing, "_export", lambda trace: (writers.append(threading.get_ident()), export(trace)))
+    with tracing.request("POST /conversation") as trace:
+        pass
+    tracing.writer.flush()
+    assert writers and writers[0] != threading.get_ident()
+    assert json.loads(path.read_text())["resourceSpans"][0]["scopeSpans"][0]["spans"][0]["traceId"] == trace.trace_id